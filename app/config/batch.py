@@ -0,0 +1,219 @@
+import codecs
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from itertools import chain
+
+from .corpus import _skip_separators, index_messages
+from .mt import iter_mt_messages
+from .mx import map_ordered
+from .xsd import OUTPUT_CHECK_PASSED
+
+# Written as the last entry of every batch output zip
+BATCH_MANIFEST = 'manifest.json'
+
+# Sources extracted and mapped together by one worker
+BATCH_GROUP_SIZE = 16
+
+_SPOOL_CHUNK = 1024 * 1024
+
+
+class ZipStream:
+    """
+    Write-only file object for zipfile.ZipFile: whatever the archive writes
+    is collected until drain() hands it to the response, so the output zip
+    is streamed out entry by entry instead of being built in memory.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Yields what was written since the last drain, if anything."""
+        if self._chunks:
+            data = b''.join(self._chunks)
+            self._chunks = []
+            yield data
+
+
+def iter_batch_sources(uploads):
+    """
+    Yields (name, bytes) for every source document in uploads, a list of
+    (filename, file object) pairs. A zip contributes one document per file
+    entry. Any other upload is split into its messages: MT batches with
+    iter_mt_messages, MX batches the way the corpus index does. An upload
+    in which no message is found is taken whole (e.g. a single MX document
+    without an AppHdr). Each upload is spooled to a temporary file first
+    and read one document at a time.
+    """
+    for filename, fileobj in uploads:
+        stem = os.path.splitext(os.path.basename(filename or 'upload'))[0] or 'upload'
+        with tempfile.TemporaryFile() as spool:
+            shutil.copyfileobj(fileobj, spool, _SPOOL_CHUNK)
+            spool.flush()
+            if spool.tell() == 0:
+                continue
+            spool.seek(0)
+            if zipfile.is_zipfile(spool):
+                spool.seek(0)
+                with zipfile.ZipFile(spool) as zf:
+                    for info in zf.infolist():
+                        if not info.is_dir():
+                            yield info.filename, zf.read(info)
+                continue
+            with mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = _skip_separators(mm, 0, len(mm))
+                if mm[start:start + 1] == b'<':
+                    _, entries = index_messages(mm)
+                    messages = (mm[e.offset:e.offset + e.length] for e in entries)
+                else:
+                    messages = _mt_messages(spool, mm)
+                first = next(messages, None)
+                if first is None:
+                    yield filename or stem, mm[:]
+                    continue
+                second = next(messages, None)
+                if second is None:
+                    yield filename or stem, first
+                    continue
+                for n, data in enumerate(chain((first, second), messages), 1):
+                    yield f'{stem}_{n:05d}', data
+
+
+def _mt_messages(spool, mm):
+    # Decoded like decode_swift does: UTF-8, or latin-1 for legacy FIN files
+    encoding = 'utf-8'
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for pos in range(0, len(mm), _SPOOL_CHUNK):
+            decoder.decode(mm[pos:pos + _SPOOL_CHUNK])
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        encoding = 'latin-1'
+    spool.seek(0)
+    for index in iter_mt_messages(spool, encoding=encoding):
+        yield index.content[index.start:index.end].encode(encoding)
+
+
+def _output_name(source_name, ext, used):
+    """
+    Unique <name>.<ext> entry name for a source. Source names come from the
+    upload (zip entry names included), so absolute paths, drive letters and
+    '..' components are dropped to keep every output inside the archive.
+    """
+    parts = [p for p in source_name.replace('\\', '/').split('/') if p not in ('', '.', '..') and not p.endswith(':')]
+    base = os.path.splitext('/'.join(parts))[0] or 'output'
+    name = f'{base}.{ext}'
+    n = 1
+    while name in used:
+        n += 1
+        name = f'{base}_{n}.{ext}'
+    used.add(name)
+    return name
+
+
+def _groups(items, size):
+    group = []
+    for item in items:
+        group.append(item)
+        if len(group) >= size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def stream_batch_zip(sources, extract, map_batch, render, ext, workers=None, manifest_info=None, check=None):
+    """
+    Converts (name, bytes) sources and yields the bytes of a zip holding one
+    <name>.<ext> output per source plus manifest.json. Sources are handled
+    in groups of BATCH_GROUP_SIZE on a thread pool (see map_ordered):
+    extract(data) per source, then map_batch(list of extracted records) for
+    the group, so transforms run in their batch form. render(values) turns
+    the mapped values into text chunks; outputs are written in input order
+    as soon as they are ready. check(), if given, returns a fresh output
+    checker (see routes.OutputChecker) that is fed each chunk as it is
+    written, so no output is held whole; its result() is kept as
+    output_check. An output that does not pass is still written but
+    counted as 'invalid'. The
+    manifest lists every source with its status ('ok', 'invalid' or
+    'error'), error, output name, size, check result and timings in ms.
+    """
+    def run(group):
+        results = []
+        for name, data in group:
+            start = time.perf_counter()
+            try:
+                results.append([name, extract(data), None, time.perf_counter() - start])
+            except Exception as e:
+                results.append([name, None, str(e), time.perf_counter() - start])
+        ok = [r for r in results if r[2] is None]
+        start = time.perf_counter()
+        try:
+            mapped = map_batch([r[1] for r in ok])
+        except Exception as e:
+            mapped = None
+            for r in ok:
+                r[1], r[2] = None, f'Error in mapping: {e}'
+        # Mapping time is shared out evenly over the group
+        share = (time.perf_counter() - start) / len(ok) if ok else 0.0
+        for i, r in enumerate(ok):
+            if mapped is not None:
+                r[1] = mapped[i]
+            r[3] += share
+        return results
+
+    out = ZipStream()
+    manifest = []
+    used = {BATCH_MANIFEST}
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, values, error, elapsed in chain.from_iterable(map_ordered(run, _groups(sources, BATCH_GROUP_SIZE), workers)):
+            record = {'source': name, 'status': 'error' if error else 'ok', 'error': error,
+                      'output': None, 'bytes': 0, 'output_check': None,
+                      'convert_ms': round(elapsed * 1000, 3), 'render_ms': 0.0, 'check_ms': 0.0}
+            if error is None:
+                record['output'] = _output_name(name, ext, used)
+                rendering = checking = 0.0
+                checker = check() if check is not None else None
+                chunks = iter(render(values))
+                with zf.open(record['output'], 'w') as f:
+                    while True:
+                        start = time.perf_counter()
+                        chunk = next(chunks, None)
+                        if chunk is None:
+                            break
+                        data = chunk.encode('utf-8')
+                        f.write(data)
+                        record['bytes'] += len(data)
+                        rendering += time.perf_counter() - start
+                        if checker is not None:
+                            start = time.perf_counter()
+                            checker.feed(chunk)
+                            checking += time.perf_counter() - start
+                        # Not counted: the time the client takes to read it
+                        yield from out.drain()
+                record['render_ms'] = round(rendering * 1000, 3)
+                if checker is not None:
+                    start = time.perf_counter()
+                    record['output_check'] = checker.result()
+                    record['check_ms'] = round((checking + time.perf_counter() - start) * 1000, 3)
+                    if record['output_check']['status'] not in OUTPUT_CHECK_PASSED:
+                        record['status'] = 'invalid'
+            manifest.append(record)
+            yield from out.drain()
+        failed = sum(1 for r in manifest if r['status'] == 'error')
+        invalid = sum(1 for r in manifest if r['status'] == 'invalid')
+        summary = dict(manifest_info or {}, total=len(manifest), ok=len(manifest) - failed - invalid, failed=failed,
+                       invalid=invalid, entries=manifest)
+        zf.writestr(BATCH_MANIFEST, json.dumps(summary, indent=2))
+    yield from out.drain()
@@ -0,0 +1,319 @@
+import json
+import os
+import re
+import threading
+import time
+
+from .rules import LRUCache, rules_hash
+from .transforms import DATE_INPUT_FORMATS, DateParser, get_transform
+
+PLACEHOLDER_PATTERN = re.compile(r'@@(.*?)@@')
+
+
+def required_source_fields(mapping_rules, template_content):
+    """
+    Source fields a ConverterConfig actually reads for the template's
+    @@var@@ placeholders, following the same precedence as the mapping
+    loop: 'sources' (only together with a transform), then 'source'.
+    """
+    fields = set()
+    for tgt_var in set(PLACEHOLDER_PATTERN.findall(template_content)):
+        map_cfg = mapping_rules.get(tgt_var)
+        if not isinstance(map_cfg, dict):
+            continue
+        if map_cfg.get('sources') and map_cfg.get('transform'):
+            fields.update(map_cfg['sources'])
+        elif map_cfg.get('source'):
+            fields.add(map_cfg['source'])
+    return fields
+
+
+# Rendered text is handed to the output in pieces of about this many characters
+RENDER_CHUNK_SIZE = 64 * 1024
+
+
+class SegmentTemplate:
+    """
+    A templates/filetypes template split once into literal and @@var@@
+    placeholder segments. Rendering joins the segments with the values
+    filled in; iter_render/write produce the same text in chunks so large
+    outputs never have to exist as one string.
+    """
+    def __init__(self, content):
+        self.content = content
+        # Odd indexes are placeholder names, even ones the literal text between them
+        self.parts = PLACEHOLDER_PATTERN.split(content)
+        self.placeholders = self.parts[1::2]
+        self.variables = list(dict.fromkeys(self.placeholders))
+
+    def render(self, values):
+        """The template with every placeholder replaced by str(values.get(name, ''))."""
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            parts[i] = str(values.get(parts[i], ''))
+        return ''.join(parts)
+
+    def iter_render(self, values, chunk_size=RENDER_CHUNK_SIZE):
+        """Yields the rendered text in chunks of roughly chunk_size characters."""
+        buf, size = [], 0
+        for i, part in enumerate(self.parts):
+            if i % 2:
+                part = str(values.get(part, ''))
+            if not part:
+                continue
+            buf.append(part)
+            size += len(part)
+            if size >= chunk_size:
+                yield ''.join(buf)
+                buf, size = [], 0
+        if buf:
+            yield ''.join(buf)
+
+    def write(self, values, fileobj, chunk_size=RENDER_CHUNK_SIZE):
+        """Writes the rendered text to a text-mode file object."""
+        for chunk in self.iter_render(values, chunk_size):
+            fileobj.write(chunk)
+
+
+# Seconds between checks of templates/filetypes for added, removed or edited files
+TEMPLATE_CHECK_INTERVAL = 2.0
+
+TEMPLATE_EXTENSIONS = ('xml', 'txt')
+
+
+class TemplateEntry:
+    """One <FileType name>.<ext>.j2 file; its SegmentTemplate is read on first use."""
+    __slots__ = ('name', 'ext', 'path', 'mtime_ns', 'size', '_segments')
+
+    def __init__(self, name, ext, path, mtime_ns, size):
+        self.name = name
+        self.ext = ext
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self._segments = None
+
+    @property
+    def segments(self):
+        if self._segments is None:
+            with open(self.path, encoding='utf-8') as f:
+                self._segments = SegmentTemplate(f.read())
+        return self._segments
+
+
+class TemplateRegistry:
+    """
+    The templates of one templates/filetypes directory, indexed by FileType
+    name and extension. The directory is listed once and re-listed at most
+    every check_interval seconds (or on refresh()), so lookups on the
+    conversion path do not touch the filesystem. Entries whose file did not
+    change keep their parsed template across re-listings. The listing also
+    keeps (path, mtime_ns, size) of every other file, for the XSD and field
+    format lookups of the output checks.
+    """
+    def __init__(self, template_dir, check_interval=TEMPLATE_CHECK_INTERVAL):
+        self.template_dir = template_dir
+        self.check_interval = check_interval
+        self._entries = {}
+        self._files = {}
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def get(self, name, ext):
+        """TemplateEntry for <name>.<ext>.j2, or None."""
+        self._check()
+        return self._entries.get((name, ext))
+
+    def find(self, name, exts=TEMPLATE_EXTENSIONS):
+        """First TemplateEntry of name in exts order (xml before txt), or None."""
+        self._check()
+        for ext in exts:
+            entry = self._entries.get((name, ext))
+            if entry is not None:
+                return entry
+        return None
+
+    def stat(self, filename):
+        """(path, mtime_ns, size) of a file in the directory, or None."""
+        self._check()
+        return self._files.get(filename)
+
+    def files(self, prefix, suffix):
+        """(path, mtime_ns, size) of the files named <prefix>...<suffix>, sorted by name."""
+        self._check()
+        return [self._files[filename] for filename in sorted(self._files)
+                if filename.startswith(prefix) and filename.endswith(suffix)
+                and len(filename) >= len(prefix) + len(suffix)]
+
+    def refresh(self):
+        """Re-lists the directory now, e.g. after a template was written."""
+        with self._lock:
+            self._scan()
+
+    def _check(self):
+        if self._checked is not None and time.monotonic() - self._checked < self.check_interval:
+            return
+        with self._lock:
+            if self._checked is None or time.monotonic() - self._checked >= self.check_interval:
+                self._scan()
+
+    def _scan(self):
+        entries, files = {}, {}
+        try:
+            with os.scandir(self.template_dir) as it:
+                for dirent in it:
+                    if not dirent.is_file():
+                        continue
+                    st = dirent.stat()
+                    files[dirent.name] = (dirent.path, st.st_mtime_ns, st.st_size)
+                    if not dirent.name.endswith('.j2'):
+                        continue
+                    name, _, ext = dirent.name[:-3].rpartition('.')
+                    if not name or ext not in TEMPLATE_EXTENSIONS:
+                        continue
+                    entry = self._entries.get((name, ext))
+                    if entry is None or (entry.mtime_ns, entry.size) != (st.st_mtime_ns, st.st_size):
+                        entry = TemplateEntry(name, ext, dirent.path, st.st_mtime_ns, st.st_size)
+                    entries[(name, ext)] = entry
+        except FileNotFoundError:
+            pass
+        self._entries = entries
+        self._files = files
+        self._checked = time.monotonic()
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_template_registry(template_dir):
+    """The shared TemplateRegistry of a template directory."""
+    registry = _registries.get(template_dir)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.setdefault(template_dir, TemplateRegistry(template_dir))
+    return registry
+
+
+class MappingRule:
+    """
+    One ConverterConfig mapping entry ({source | sources + transform |
+    default, prefix, ...}) with its lookups resolved once and its own
+    instance of the registered transform (see transforms.TRANSFORMS).
+    """
+    __slots__ = ('source', 'sources', 'default', 'has_default', 'func', 'prefix', 'value_transform', 'date_format', 'dates')
+
+    def __init__(self, map_cfg, value_transforms=True):
+        transform = map_cfg.get('transform')
+        self.sources = list(map_cfg['sources']) if map_cfg.get('sources') and transform else None
+        self.source = map_cfg.get('source') or None
+        self.default = map_cfg.get('default', '')
+        self.has_default = 'default' in map_cfg
+        self.func = get_transform(transform) if self.sources else None
+        self.prefix = map_cfg.get('prefix')
+        # uppercase / lowercase / date_format, applied after the prefix
+        self.value_transform = map_cfg.get('transform', 'none') if value_transforms else None
+        self.date_format = map_cfg.get('date_format', '')
+        self.dates = DateParser(DATE_INPUT_FORMATS) if self.value_transform == 'date_format' and self.date_format else None
+
+    def value(self, extracted):
+        if self.sources:
+            vals = [extracted.get(s, '') for s in self.sources]
+            value = self.func(vals) if self.func else ''.join(vals)
+        else:
+            value = self._lookup(extracted)
+        return self._finish(value)
+
+    def values(self, records):
+        """value() for many extracted records; 'sources' transforms run in their batch form."""
+        if self.sources and self.func:
+            rows = [[extracted.get(s, '') for s in self.sources] for extracted in records]
+            return [self._finish(value) for value in self.func.batch(rows)]
+        return [self.value(extracted) for extracted in records]
+
+    def _lookup(self, extracted):
+        if self.source:
+            return extracted.get(self.source, self.default)
+        if self.has_default:
+            return self.default
+        return ''
+
+    def _finish(self, value):
+        if value and self.prefix:
+            value = f'{self.prefix}{value}'
+        if self.value_transform and value is not None and value != '':
+            value = self._transform_value(value)
+        return value if value is not None else ''
+
+    def _transform_value(self, value):
+        if self.value_transform == 'uppercase':
+            return str(value).upper()
+        if self.value_transform == 'lowercase':
+            return str(value).lower()
+        if self.dates is not None:
+            dt = self.dates.parse(value)
+            if dt is not None:
+                return dt.strftime(self.date_format)
+        return value
+
+
+class ConversionPlan:
+    """
+    A ConverterConfig compiled against its target SegmentTemplate: mapping
+    rules bound per placeholder and the source fields the mapping reads.
+    error is set when the mapping rules are not valid JSON (they then map
+    nothing, as the routes always did).
+    """
+    def __init__(self, rules_json, segments, value_transforms=True):
+        self.segments = segments
+        self.template = segments.content
+        self.error = None
+        try:
+            mapping_rules = json.loads(rules_json)
+        except Exception as e:
+            self.error = f'Error in mapping: {e}'
+            mapping_rules = {}
+        if not isinstance(mapping_rules, dict):
+            mapping_rules = {}
+        self.fields = required_source_fields(mapping_rules, segments.content)
+        empty = MappingRule({}, value_transforms)
+        self.rules = {}
+        for var in segments.variables:
+            map_cfg = mapping_rules.get(var)
+            self.rules[var] = MappingRule(map_cfg, value_transforms) if isinstance(map_cfg, dict) else empty
+
+    def map(self, extracted):
+        """{placeholder: value} for one extracted source record."""
+        return {var: rule.value(extracted) for var, rule in self.rules.items()}
+
+    def map_batch(self, records):
+        """map() for a list of extracted records, one mapping rule at a time."""
+        columns = {var: rule.values(records) for var, rule in self.rules.items()}
+        return [{var: values[i] for var, values in columns.items()} for i in range(len(records))]
+
+    def render(self, mapped):
+        return self.segments.render(mapped)
+
+    def iter_render(self, mapped, chunk_size=RENDER_CHUNK_SIZE):
+        return self.segments.iter_render(mapped, chunk_size)
+
+    def write(self, mapped, fileobj, chunk_size=RENDER_CHUNK_SIZE):
+        self.segments.write(mapped, fileobj, chunk_size)
+
+
+_plan_cache = LRUCache(maxsize=128)
+
+
+def get_conversion_plan(converter, template, value_transforms=True):
+    """
+    Cached ConversionPlan for a ConverterConfig and its TemplateEntry, keyed
+    by (config id, rules hash, template path and mtime).
+    """
+    key = (converter.id, rules_hash(converter.rules), template.path, template.mtime_ns, template.size, value_transforms)
+    return _plan_cache.get_or_build(key, lambda: ConversionPlan(converter.rules, template.segments, value_transforms))
+
+
+def invalidate_conversion_plans(converter_id=None, template_path=None):
+    """Drops cached plans of one ConverterConfig and/or one template file."""
+    _plan_cache.discard_where(lambda key: (converter_id is not None and key[0] == converter_id)
+                              or (template_path is not None and key[2] == template_path))
@@ -0,0 +1,184 @@
+import json
+import mmap
+import os
+import re
+from collections import namedtuple
+
+# Sidecar written next to the corpus file: <file>.idx.json
+SIDECAR_SUFFIX = '.idx.json'
+INDEX_VERSION = 1
+
+MessageEntry = namedtuple('MessageEntry', ['offset', 'length', 'type', 'ref', 'uetr'])
+
+# Whitespace and RJE/FIN batch delimiters ('$', SOH, ETX) between messages
+_SEPARATOR_BYTES = b' \t\r\n\f\v$\x01\x03'
+
+_MT_START = re.compile(rb'(?<![^\s}$\x01\x03])\{1:')
+_MT_END = re.compile(rb'(?<![^\n])[ \t]*-\}')
+_MT_TYPE = re.compile(rb'\{2:[IO](\d{3})')
+_MT_REF = re.compile(rb'(?<![^\n])[ \t]*:20:([^\r\n]*)')
+_MT_UETR = re.compile(rb'\{121:([^}]*)\}')
+
+_MX_START = re.compile(rb'<\?xml\b[^>]*\?>|<(?:[\w.-]+:)?(AppHdr|Document)(?=[\s>/])')
+_MX_MSGDEF = re.compile(rb'<(?:[\w.-]+:)?MsgDefIdr>([^<]+)<')
+_MX_NS = re.compile(rb'urn:iso:std:iso:20022:tech:xsd:((?!head\.)[^"\'\s]+)')
+_MX_MSGID = re.compile(rb'<(?:[\w.-]+:)?MsgId>([^<]*)<')
+_MX_BIZMSGID = re.compile(rb'<(?:[\w.-]+:)?BizMsgIdr>([^<]*)<')
+_MX_UETR = re.compile(rb'<(?:[\w.-]+:)?UETR>([^<]*)<')
+
+
+def sidecar_path_for(path):
+    return path + SIDECAR_SUFFIX
+
+
+def build_message_index(path, sidecar_path=None):
+    """
+    Memory-maps a batch file of MT or MX messages once and records offset,
+    length, type and key reference of each message. The index is written
+    to a small JSON sidecar and returned as a list of MessageEntry.
+    """
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        if st.st_size == 0:
+            entries = []
+            file_format = None
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                file_format, entries = index_messages(mm)
+    sidecar = {
+        'version': INDEX_VERSION,
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'format': file_format,
+        'messages': [list(e) for e in entries],
+    }
+    with open(sidecar_path or sidecar_path_for(path), 'w', encoding='utf-8') as f:
+        json.dump(sidecar, f, separators=(',', ':'))
+    return entries
+
+
+def load_message_index(path, sidecar_path=None):
+    """
+    Returns the message index for path, reading the sidecar if it still
+    matches the file's size and mtime and rebuilding it otherwise.
+    """
+    sidecar_path = sidecar_path or sidecar_path_for(path)
+    st = os.stat(path)
+    try:
+        with open(sidecar_path, encoding='utf-8') as f:
+            sidecar = json.load(f)
+        if (sidecar.get('version') == INDEX_VERSION and sidecar.get('size') == st.st_size
+                and sidecar.get('mtime_ns') == st.st_mtime_ns):
+            return [MessageEntry(*m) for m in sidecar['messages']]
+    except (OSError, ValueError, TypeError, KeyError):
+        pass
+    return build_message_index(path, sidecar_path)
+
+
+def index_messages(mm):
+    """
+    Splits a buffer (mmap or bytes) holding MT or MX messages back to back.
+    Returns ('mt' | 'mx', [MessageEntry]).
+    """
+    first = _skip_separators(mm, 0, len(mm))
+    if mm[first:first + 1] == b'<':
+        return 'mx', _index_mx(mm)
+    return 'mt', _index_mt(mm)
+
+
+def read_message(path, n, entries=None):
+    """Seeks straight to message n (0-based) of path and returns its bytes."""
+    if entries is None:
+        entries = load_message_index(path)
+    entry = entries[n]
+    with open(path, 'rb') as f:
+        f.seek(entry.offset)
+        return f.read(entry.length)
+
+
+def _skip_separators(mm, pos, end):
+    while pos < end and mm[pos:pos + 1] in _SEPARATOR_BYTES:
+        pos += 1
+    return pos
+
+
+def _trim_end(mm, start, end):
+    while end > start and mm[end - 1:end] in _SEPARATOR_BYTES:
+        end -= 1
+    return end
+
+
+def _text(m):
+    return m.group(1).decode('utf-8', errors='replace').strip() if m else None
+
+
+def _spans(mm, starts):
+    """(start, end) per message from sorted start offsets, separators trimmed."""
+    size = len(mm)
+    spans = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else size
+        end = _trim_end(mm, start, end)
+        if end > start:
+            spans.append((start, end))
+    return spans
+
+
+def _index_mt(mm):
+    size = len(mm)
+    starts = [m.start() for m in _MT_START.finditer(mm)]
+    first = _skip_separators(mm, 0, size)
+    if not starts or starts[0] > first:
+        # Bare tag listings: one message per '-}' terminator
+        limit = starts[0] if starts else size
+        bare = [first]
+        for m in _MT_END.finditer(mm, first, limit):
+            nxt = _skip_separators(mm, m.end(), limit)
+            if nxt < limit:
+                bare.append(nxt)
+        starts = bare + starts
+    entries = []
+    for start, end in _spans(mm, starts):
+        mt_type = _MT_TYPE.search(mm, start, end)
+        entries.append(MessageEntry(
+            start, end - start,
+            f'MT{mt_type.group(1).decode()}' if mt_type else 'MT',
+            _text(_MT_REF.search(mm, start, end)),
+            _text(_MT_UETR.search(mm, start, end)),
+        ))
+    return entries
+
+
+def _index_mx(mm):
+    # A new message starts at an XML declaration, at an AppHdr, or at a
+    # Document that does not belong to the AppHdr just before it
+    starts = []
+    seen_decl = seen_hdr = seen_doc = False
+    for m in _MX_START.finditer(mm):
+        name = m.group(1)
+        if name is None:
+            new = True
+        elif name == b'AppHdr':
+            new = seen_hdr or seen_doc or not seen_decl
+        else:
+            new = seen_doc or not (seen_decl or seen_hdr)
+        if new:
+            starts.append(m.start())
+            seen_decl = seen_hdr = seen_doc = False
+        if name is None:
+            seen_decl = True
+        elif name == b'AppHdr':
+            seen_hdr = True
+        else:
+            seen_doc = True
+    entries = []
+    for start, end in _spans(mm, starts):
+        msg_def = _MX_MSGDEF.search(mm, start, end) or _MX_NS.search(mm, start, end)
+        ref = _MX_MSGID.search(mm, start, end) or _MX_BIZMSGID.search(mm, start, end)
+        entries.append(MessageEntry(
+            start, end - start,
+            _text(msg_def) or 'MX',
+            _text(ref),
+            _text(_MX_UETR.search(mm, start, end)),
+        ))
+    return entries
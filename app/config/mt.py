@@ -0,0 +1,518 @@
+import codecs
+import json
+import logging
+import re
+import time
+
+from .profiling import PARSE_STEP
+from .regex_guard import GuardedPattern, RegexTimeout
+from .rules import LRUCache, compile_condition, rules_hash
+
+# Compiled MT rule plans, keyed by rules hash (see get_mt_rule_plan)
+_mt_plan_cache = LRUCache(maxsize=256)
+
+# Read size for iter_mt_messages; messages larger than this just span chunks
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class MTIndex:
+    """
+    Offsets of one SWIFT MT message inside the original buffer, produced by
+    a single tokenize_mt pass.
+
+    blocks: list of (block_id, start, end, depth); content[start:end] is the
+            text between '{id:' and its matching '}', nested blocks included.
+    tags:   list of (tag, start, end) in message order, tag like ':20:';
+            content[start:end] is the value after the tag followed by its
+            continuation lines, up to the next tag or the end of block 4.
+    start/end: the slice of the buffer the message occupies.
+    """
+    __slots__ = ('content', 'start', 'end', 'blocks', 'tags', '_block_dict', '_tag_dict')
+
+    def __init__(self, content, start, end, blocks, tags):
+        self.content = content
+        self.start = start
+        self.end = end
+        self.blocks = blocks
+        self.tags = tags
+        self._block_dict = None
+        self._tag_dict = None
+
+    def block_dict(self):
+        """{block_id: stripped block text}; the first occurrence of an id wins."""
+        if self._block_dict is None:
+            d = {}
+            for block_id, start, end, depth in self.blocks:
+                if block_id not in d:
+                    d[block_id] = self.content[start:end].strip()
+            self._block_dict = d
+        return self._block_dict
+
+    def _split_lines(self, start, end):
+        text = self.content[start:end]
+        lines = text.split('\n')
+        if '\r' in text:
+            lines = [l[:-1] if l.endswith('\r') else l for l in lines]
+        return lines
+
+    def raw_lines(self, start, end):
+        """Value lines of one tag occurrence, continuation lines kept verbatim."""
+        lines = self._split_lines(start, end)
+        if not lines[0].strip() and lines[0] != '':
+            del lines[0]
+        return lines
+
+    def tag_dict(self):
+        """{tag: [values]} with the same line rules as parse_swift_tags always had."""
+        if self._tag_dict is None:
+            d = {}
+            for tag, start, end in self.tags:
+                first, *rest = self._split_lines(start, end)
+                # A whitespace-only first line is dropped; continuation lines
+                # keep their leading spaces, whitespace-only ones are dropped
+                # and empty ones only count once something was collected
+                kept = [first] if first.strip() or first == '' else []
+                for line in rest:
+                    if line.strip() != '' or (line == '' and kept):
+                        kept.append(line)
+                d.setdefault(tag, []).append('\n'.join(kept).rstrip('\n'))
+            self._tag_dict = d
+        return self._tag_dict
+
+
+_WS = re.compile(r'\s*')
+_BRACE = re.compile(r'\{([0-9A-Za-z]+):|\}')
+_FLAT_BLOCK = re.compile(r'\{([0-9A-Za-z]+):([^{}]*)\}')
+_TAG_HERE = re.compile(r'[ \t\f\v]*(:[0-9A-Za-z]{2,3}:)')
+_TAG_LINE = re.compile(r'\n[ \t\f\v]*(:[0-9A-Za-z]{2,3}:)')
+# Whitespace and RJE/FIN batch delimiters ('$', SOH, ETX) between messages
+_SEPARATORS = re.compile(r'[\s$\x01\x03]*')
+_BARE_CR = re.compile(r'\r(?!\n)')
+
+
+def tokenize_mt(content, pos=0, endpos=None, wanted=None):
+    """
+    Walks one SWIFT MT message once, starting at pos, and returns an MTIndex.
+
+    Header and trailer blocks are matched with a brace stack, so nested
+    blocks like {3:{108:...}{121:...}} are recorded correctly. The text
+    block (or a bare tag listing with no blocks at all) is indexed with one
+    scan for tag starts. The message ends after the '-}' line and any
+    trailer blocks that follow it, or where the next {1: block starts.
+
+    wanted: optional set of tags (e.g. {'20', '50K'}); only those are kept in
+    index.tags. The whole text block is still scanned, so a repeated tag
+    keeps every occurrence and callers see the same last value as a full
+    scan.
+    """
+    if endpos is None:
+        endpos = len(content)
+    cr = content.find('\r', pos, endpos)
+    if cr != -1 and content[cr + 1:cr + 2] != '\n':
+        # Bare CR line endings: same-length rewrite keeps every offset valid
+        content = content.replace('\r', '\n')
+    blocks = []
+    tags = []
+    p = _WS.match(content, pos, endpos).end()
+    text_start = p
+    in_block4 = False
+    while content.startswith('{', p, endpos):
+        if content.startswith('{4:', p, endpos):
+            text_start = p + 3
+            in_block4 = True
+            break
+        if blocks and content.startswith('{1:', p, endpos):
+            # No text block before the next message
+            return MTIndex(content, pos, p, blocks, tags)
+        block_end = _scan_blocks(content, p, endpos, blocks)
+        if block_end == p:
+            break
+        p = text_start = _WS.match(content, block_end, endpos).end()
+    text_end, brace = _find_text_end(content, text_start, endpos)
+    tag_starts = []
+    first = _TAG_HERE.match(content, text_start, text_end)
+    if first:
+        tag_starts.append(first)
+    tag_starts.extend(_TAG_LINE.finditer(content, text_start, text_end))
+    if tag_starts:
+        # Each value runs up to the newline in front of the next tag
+        ends = [tm.start() for tm in tag_starts[1:]]
+        ends.append(_value_end(content, tag_starts[-1], text_end))
+        tags = [(tm.group(1), tm.end(), end) for tm, end in zip(tag_starts, ends)
+                if wanted is None or tm.group(1)[1:-1] in wanted]
+    if brace is None:
+        return MTIndex(content, pos, text_end, blocks, tags)
+    # '-}' closes the text block; trailer blocks ({5:...}) may follow
+    if in_block4:
+        blocks.append(('4', text_start, brace, 0))
+    end = brace + 1
+    p = _WS.match(content, end, endpos).end()
+    while content.startswith('{', p, endpos) and not content.startswith('{1:', p, endpos):
+        block_end = _scan_blocks(content, p, endpos, blocks)
+        if block_end == p:
+            break
+        end = block_end
+        p = _WS.match(content, end, endpos).end()
+    return MTIndex(content, pos, end, blocks, tags)
+
+
+def _find_text_end(content, start, endpos):
+    """
+    Locates the '-}' line closing the text block: returns (line_start, brace)
+    with brace the offset of its '}'. If the next message's {1: comes first,
+    or there is neither, returns (offset, None).
+    """
+    i = content.find('-}', start, endpos)
+    while i != -1:
+        line_start = max(content.rfind('\n', start, i) + 1, start)
+        if not content[line_start:i].strip():
+            break
+        i = content.find('-}', i + 2, endpos)
+    limit = line_start if i != -1 else endpos
+    next_msg = content.find('\n{1:', start, limit)
+    if next_msg != -1:
+        # Next message starts before any '-}': this one is unterminated
+        return next_msg + 1, None
+    if i != -1:
+        return line_start, i + 1
+    return endpos, None
+
+
+def _value_end(content, tm, text_end):
+    """End of the last tag's value: text_end without the line break before it."""
+    if content[text_end - 1:text_end] == '\n':
+        text_end -= 1
+    return max(text_end, tm.end())
+
+
+def _scan_blocks(content, pos, endpos, blocks):
+    """
+    Records the balanced block opening at pos (and any nested blocks) and
+    returns the offset just past its closing brace, or pos if no block
+    starts there.
+    """
+    m = _FLAT_BLOCK.match(content, pos, endpos)
+    if m:
+        blocks.append((m.group(1), m.start(2), m.end(2), 0))
+        return m.end()
+    stack = []
+    for m in _BRACE.finditer(content, pos, endpos):
+        if not stack and (m.start() != pos or m.group(1) is None):
+            return pos
+        if m.group(1) is not None:
+            stack.append((m.group(1), m.end()))
+        elif stack:
+            block_id, start = stack.pop()
+            blocks.append((block_id, start, m.start(), len(stack)))
+            if not stack:
+                return m.end()
+    return endpos
+
+
+def parse_swift_tags(content):
+    """
+    Returns a dict: {tag: [list of values for that tag]}
+    Handles edge cases per SWIFT rules.
+    """
+    return tokenize_mt(content).tag_dict()
+
+
+def parse_remittance_lines(lines):
+    """
+    Given a list of remittance lines, returns a list of dicts with key-value pairs.
+    Handles /KEY/VALUE, /KEY, and value-only segments (assigns to previous key).
+    """
+    parsed = []
+    for line in lines:
+        d = {}
+        last_key = None
+        # Split by '///' or '//' (SWIFT can use both)
+        segments = re.split(r'/+', line)
+        segments = [seg for seg in segments if seg]  # Remove empty
+        i = 0
+        while i < len(segments):
+            key = segments[i]
+            if i + 1 < len(segments):
+                value = segments[i + 1]
+                d[key] = value
+                last_key = key
+                i += 2
+            else:
+                # If only a key left, treat as key with None value
+                d[key] = None
+                i += 1
+        if d:
+            parsed.append(d)
+    return parsed
+
+
+def process_account_lines(lines):
+    """
+    For :50K: and :59: fields, extract the account number from the first line if it starts with a slash.
+    Return a dict: {'account_number': ..., 'lines': [...]}.
+    """
+    if not lines or not isinstance(lines, list):
+        return None
+    account_number = None
+    rest_lines = lines[:]
+    if lines and lines[0].startswith('/'):
+        account_number = lines[0][1:]
+        rest_lines = lines[1:]
+    return {'account_number': account_number, 'lines': rest_lines}
+
+
+class MTFieldRule:
+    """
+    One compiled MT extraction rule: what to read (block, regex or tag),
+    plus the condition predicate and postprocess function bound up front.
+    """
+    __slots__ = ('field', 'path', 'kind', 'key', 'multiple', 'predicate', 'postprocess')
+
+    def __init__(self, field, rule):
+        self.field = field
+        if isinstance(rule, dict):
+            path = rule.get('path')
+            condition = rule.get('condition')
+            cond_value = rule.get('value')
+            self.multiple = rule.get('multiple', False)
+            block_num = rule.get('block')
+            postprocess = rule.get('postprocess')
+        else:
+            path = rule
+            condition = None
+            cond_value = None
+            self.multiple = False
+            block_num = None
+            postprocess = None
+        self.path = f'block {block_num}' if block_num is not None else path
+        if block_num is not None:
+            self.kind = 'block'
+            self.key = str(block_num)
+        elif isinstance(path, str) and path.startswith('regex:'):
+            self.kind = 'regex'
+            self.key = GuardedPattern(path[len('regex:'):].strip(), re.MULTILINE | re.DOTALL)
+        elif path:
+            self.kind = 'tag'
+            self.key = path if path.startswith(':') else f':{path}:'
+        else:
+            self.kind = None
+            self.key = None
+        self.predicate = compile_condition(condition, cond_value)
+        func = globals().get(f"process_{postprocess}") if postprocess else None
+        self.postprocess = func if callable(func) else None
+
+    def extract(self, content, index):
+        value = None
+        if self.kind == 'block':
+            value = index.block_dict().get(self.key, None)
+        elif self.kind == 'regex':
+            try:
+                if self.multiple:
+                    value = [v.strip() for v in self.key.all(content)]
+                else:
+                    value = self.key.first(content)
+                    value = value.strip() if value is not None else None
+            except RegexTimeout as e:
+                # Fail this field only; the rest of the message still extracts
+                logging.warning('MT rule %s skipped: %s', self.field, e)
+                value = None
+        elif self.kind == 'tag':
+            tag_values = index.tag_dict().get(self.key, None)
+            if tag_values:
+                if self.multiple:
+                    # Flatten all lines from all occurrences
+                    lines = []
+                    for val in tag_values:
+                        lines.extend([l for l in val.split('\n') if l.strip() != ''])
+                    value = lines if lines else None
+                else:
+                    # Use the first occurrence, join lines
+                    value = tag_values[0]
+        if self.predicate:
+            if self.multiple and isinstance(value, list):
+                value = [v for v in value if self.predicate(v)]
+            elif value is not None:
+                value = self.predicate(value)
+        if self.postprocess and value:
+            value = self.postprocess(value)
+        return value
+
+
+class MTRulePlan:
+    """
+    Rules JSON for extract_mt_fields compiled once: precompiled patterns,
+    condition predicates and bound postprocess functions per field.
+    """
+    def __init__(self, rules):
+        self.fields = [MTFieldRule(field, rule) for field, rule in rules.items()]
+
+    def extract(self, content, index=None, profile=None):
+        if profile is not None:
+            return self._extract_profiled(content, index, profile)
+        if index is None:
+            index = tokenize_mt(content)
+        return {f.field: f.extract(content, index) for f in self.fields}
+
+    def _extract_profiled(self, content, index, profile):
+        if index is None:
+            t0 = time.perf_counter()
+            index = tokenize_mt(content)
+            profile.record(PARSE_STEP, time.perf_counter() - t0)
+        result = {}
+        for f in self.fields:
+            t0 = time.perf_counter()
+            value = result[f.field] = f.extract(content, index)
+            profile.record(f.field, time.perf_counter() - t0, value, f.path)
+        return result
+
+    def extract_index(self, index):
+        """Extracts one message of a larger buffer; regex rules only see that message."""
+        return self.extract(index.content[index.start:index.end], index)
+
+
+def get_mt_rule_plan(rules_json):
+    """
+    Returns the cached MTRulePlan for a Configuration/FileType rules string,
+    or None if the rules are not valid JSON.
+    """
+    key = rules_hash(rules_json)
+    plan = _mt_plan_cache.get(key)
+    if plan is None:
+        try:
+            rules = json.loads(rules_json)
+        except Exception:
+            return None
+        plan = _mt_plan_cache.put(key, MTRulePlan(rules))
+    return plan
+
+
+def decode_swift(data):
+    """
+    Text for an MT message given as str, bytes-like (bytes, bytearray,
+    memoryview, mmap) or a file object. Decodes straight from the buffer,
+    falling back to latin-1 for non-UTF-8 legacy FIN files.
+    """
+    if isinstance(data, str):
+        return data
+    if hasattr(data, 'read'):
+        data = data.read()
+        if isinstance(data, str):
+            return data
+    try:
+        return str(data, 'utf-8')
+    except UnicodeDecodeError:
+        return str(data, 'latin-1')
+
+
+def extract_mt_fields(content, rules_json, profile=None):
+    """
+    Applies MT Configuration rules to one message. profile: optional
+    RuleProfile that collects per-rule timings.
+    """
+    logging.debug('extract_mt_fields: rules_json = %s', rules_json)
+    plan = get_mt_rule_plan(rules_json)
+    if plan is None:
+        return None
+    return plan.extract(decode_swift(content), profile=profile)
+
+
+def iter_mt_fields(fileobj, rules_json, chunk_size=STREAM_CHUNK_SIZE, encoding='utf-8'):
+    """
+    Streaming counterpart of extract_mt_fields for batch files holding many
+    MT messages back to back. Yields one extraction result per message while
+    only ever holding the current chunk in memory. Yields nothing if the
+    rules are not valid JSON.
+    """
+    plan = get_mt_rule_plan(rules_json)
+    if plan is None:
+        return
+    for index in iter_mt_messages(fileobj, chunk_size=chunk_size, encoding=encoding):
+        yield plan.extract_index(index)
+
+
+def iter_mt_messages(fileobj, chunk_size=STREAM_CHUNK_SIZE, encoding='utf-8'):
+    """
+    Reads a text or binary file object incrementally and yields an MTIndex
+    per message. A message is only yielded once the start of the next one
+    (or EOF) is in the buffer, so chunk boundaries never split a message.
+    Bare CR line endings are turned into LF as each chunk is read, so
+    tokenize_mt never has to rewrite the buffer.
+    """
+    decoder = None
+    buf = ''
+    cr = ''
+    eof = False
+    while not eof:
+        chunk = fileobj.read(chunk_size)
+        if isinstance(chunk, bytes):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+            chunk = decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            eof = True
+        chunk, cr = cr + chunk, ''
+        if '\r' in chunk:
+            if chunk.endswith('\r') and not eof:
+                # Could be the first half of a CRLF split across chunks
+                chunk, cr = chunk[:-1], '\r'
+            chunk = _BARE_CR.sub('\n', chunk)
+        buf += chunk
+        pos = 0
+        while True:
+            pos = _SEPARATORS.match(buf, pos).end()
+            if pos >= len(buf):
+                break
+            index = tokenize_mt(buf, pos)
+            if index.end <= pos:
+                index.end = len(buf)
+            if not eof and _SEPARATORS.match(buf, index.end).end() >= len(buf):
+                # Could still be growing (trailer blocks, unterminated text)
+                break
+            yield index
+            pos = index.end
+        buf = buf[pos:]
+
+
+def extract_generic_text_fields(file_content, template_content=None, fields=None):
+    """
+    Flattens MT tags into tagXX / tagXXLineN variables for the converters.
+    fields: optional set of variable names actually needed; only those tags
+    are flattened (a repeated tag still yields its last occurrence).
+    """
+    wanted = required_tags(fields) if fields is not None else None
+    if isinstance(file_content, MTIndex):
+        index = file_content
+    else:
+        index = tokenize_mt(decode_swift(file_content), wanted=wanted)
+    # Last occurrence of a repeated tag wins
+    tag_dict = {}
+    for name, start, end in index.tags:
+        tag = name[1:-1]  # e.g., '50K'
+        if wanted is None or tag in wanted:
+            tag_dict[tag] = (start, end)
+    # Flatten for output
+    tags = {}
+    for tag, (start, end) in tag_dict.items():
+        lines = index.raw_lines(start, end)
+        tags[f'tag{tag}'] = ' '.join([l.strip() for l in lines])
+        for idx, line in enumerate(lines):
+            tags[f'tag{tag}Line{idx+1}'] = line.strip()
+    return tags
+
+
+_GENERIC_FIELD = re.compile(r'tag([0-9A-Za-z]{2,3}?)(?:Line\d+)?')
+
+
+def required_tags(fields):
+    """
+    Maps extract_generic_text_fields variable names (tag50K, tag50KLine2)
+    back to the tags they come from. Returns None if any name is not a tag
+    variable, in which case the whole message has to be read.
+    """
+    tags = set()
+    for name in fields:
+        m = _GENERIC_FIELD.fullmatch(name)
+        if not m:
+            return None
+        tags.add(m.group(1))
+    return tags
@@ -0,0 +1,194 @@
+import json
+import os
+import re
+
+from werkzeug.utils import secure_filename
+
+from .conversion import get_template_registry
+from .mt import tokenize_mt
+from .rules import LRUCache
+
+# SWIFT character sets used in field format specs
+CHARSETS = {
+    'n': '0-9',
+    'a': 'A-Z',
+    'c': '0-9A-Z',
+    'h': '0-9A-F',
+    'x': r"0-9A-Za-z/\-?:().,'+ ",
+    'y': r"0-9A-Z .,\-()/='+:?!\"%&*<>;",
+    'z': r"0-9A-Za-z/\-?:().,'+ =!\"%&*<>;{@#_",
+    'e': ' ',
+}
+
+# Text block formats of the MT messages we generate; a FileType can
+# override them with templates/filetypes/<name>.formats.json
+MT_FIELD_FORMATS = {
+    '103': {
+        '20': '16x',
+        '23B': '4!c',
+        '32A': '6!n3!a15d',
+        '33B': '3!a15d',
+        '50K': '[/34x CrLf]4*35x',
+        '52A': '[/1!a][/34x CrLf]4!a2!a2!c[3!c]',
+        '56A': '[/1!a][/34x CrLf]4!a2!a2!c[3!c]',
+        '57A': '[/1!a][/34x CrLf]4!a2!a2!c[3!c]',
+        '59': '[/34x CrLf]4*35x',
+        '70': '4*35x',
+        '71A': '3!a',
+        '72': '6*35x',
+    },
+}
+
+_SPEC_TOKEN = re.compile(r'\s+|CrLf|\[|\]|(?:(\d+)\*)?(\d+)(!?)([nachxyzed])|([/:,])')
+
+_format_cache = LRUCache(maxsize=512)
+_validator_cache = LRUCache(maxsize=64)
+
+
+def compile_format(spec):
+    """
+    Compiles a SWIFT field format spec such as 6!n3!a15d or [/34x CrLf]4*35x
+    into a regex for the whole field value (lines joined with '\\n').
+    Raises ValueError for specs it cannot read.
+    """
+    return _format_cache.get_or_build(spec, lambda: re.compile(_format_regex(spec)))
+
+
+def _format_regex(spec):
+    parts = []
+    stack = []
+    pos = 0
+    while pos < len(spec):
+        m = _SPEC_TOKEN.match(spec, pos)
+        if m is None:
+            raise ValueError(f'unexpected {spec[pos:]!r} in field format {spec!r}')
+        token = m.group(0)
+        pos = m.end()
+        if token.isspace():
+            continue
+        if token == 'CrLf':
+            parts.append(r'\n')
+        elif token == '[':
+            stack.append(parts)
+            parts = []
+        elif token == ']':
+            if not stack:
+                raise ValueError(f'unbalanced ] in field format {spec!r}')
+            optional = ''.join(parts)
+            parts = stack.pop()
+            parts.append(f'(?:{optional})?')
+        elif m.group(5):
+            parts.append(re.escape(m.group(5)))
+        else:
+            parts.append(_field_regex(int(m.group(1) or 1), int(m.group(2)), bool(m.group(3)), m.group(4)))
+    if stack:
+        raise ValueError(f'unbalanced [ in field format {spec!r}')
+    return ''.join(parts)
+
+
+def _field_regex(lines, length, exact, charset):
+    if charset == 'd':
+        # Digits with exactly one decimal comma, the comma counted in length
+        line = rf'(?=[0-9,]{{2,{length}}}(?![0-9,]))[0-9]+,[0-9]*'
+    else:
+        line = f"[{CHARSETS[charset]}]{{{length if exact else 1},{length}}}"
+    if lines == 1:
+        return line
+    return f'{line}(?:\\n{line}){{0,{lines - 1}}}'
+
+
+class MTFormatValidator:
+    """Compiled per-tag format checks for one MT FileType."""
+    def __init__(self, formats):
+        self.formats = dict(formats)
+        self.checks = {f':{tag}:': (spec, compile_format(spec)) for tag, spec in formats.items()}
+
+    def errors(self, message):
+        """Messages for every tag in the text block that does not match its format."""
+        index = tokenize_mt(message)
+        errors = []
+        for tag, start, end in index.tags:
+            check = self.checks.get(tag)
+            if check is None:
+                continue
+            value = '\n'.join(index.raw_lines(start, end)).rstrip('\n')
+            if not check[1].fullmatch(value):
+                errors.append(f'{tag} {value!r} does not match {check[0]}')
+        return errors
+
+
+def _message_type(filetype_name):
+    m = re.search(r'MT\s*(\d{3})', filetype_name or '', re.IGNORECASE)
+    return m.group(1) if m else None
+
+
+def formats_filename(filetype_name):
+    """
+    Name the field formats of a FileType are stored under: <name>.formats.json
+    with the name passed through secure_filename, or None if nothing of the
+    name is left.
+    """
+    stem = secure_filename(filetype_name)
+    return f'{stem}.formats.json' if stem else None
+
+
+def formats_path(formats_dir, filetype_name):
+    """Where the field formats of a FileType are stored (see formats_filename), or None."""
+    filename = formats_filename(filetype_name)
+    return os.path.join(formats_dir, filename) if filename else None
+
+
+def get_mt_format_validator(formats_dir, filetype_name):
+    """
+    MTFormatValidator for a FileType: its formats_path file if present
+    ({tag: spec}), else the built-in formats of the MT number in its name.
+    None if neither applies. Whether the file exists comes from the shared
+    listing of formats_dir (see TemplateRegistry); cached until it changes.
+    """
+    filename = formats_filename(filetype_name)
+    st = get_template_registry(formats_dir).stat(filename) if filename else None
+    if st is None:
+        mt = _message_type(filetype_name)
+        if mt not in MT_FIELD_FORMATS:
+            return None
+        return _validator_cache.get_or_build(('builtin', mt), lambda: MTFormatValidator(MT_FIELD_FORMATS[mt]))
+    path = st[0]
+
+    def build():
+        with open(path, encoding='utf-8') as f:
+            return MTFormatValidator(json.load(f))
+    return _validator_cache.get_or_build(st, build)
+
+
+class MTOutputCheck:
+    """
+    validate_mt_output over an output fed in chunks, the counterpart of
+    xsd.XMLOutputCheck. An MT message is at most 10,000 characters, so the
+    chunks are simply joined for the check.
+    """
+    def __init__(self, formats_dir, filetype_name):
+        self.formats_dir = formats_dir
+        self.filetype_name = filetype_name
+        self._chunks = []
+
+    def feed(self, chunk):
+        self._chunks.append(chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk)
+
+    def result(self):
+        return validate_mt_output(''.join(self._chunks), self.formats_dir, self.filetype_name)
+
+
+def validate_mt_output(message, formats_dir, filetype_name):
+    """
+    Field format check of a rendered MT message. Returns the same shape as
+    validate_xml_output: {'status', 'errors', 'checked'}, status 'valid',
+    'invalid' or 'unchecked' (no formats registered for the FileType).
+    """
+    try:
+        validator = get_mt_format_validator(formats_dir, filetype_name)
+    except (OSError, ValueError) as e:
+        return {'status': 'invalid', 'errors': [f'Field formats for {filetype_name}: {e}'], 'checked': []}
+    if validator is None:
+        return {'status': 'unchecked', 'errors': [], 'checked': []}
+    errors = validator.errors(message)
+    return {'status': 'invalid' if errors else 'valid', 'errors': errors, 'checked': sorted(validator.formats)}
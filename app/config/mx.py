@@ -0,0 +1,1049 @@
+import io
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from lxml import etree
+
+from .profiling import PARSE_STEP
+from .rules import LRUCache, compile_condition, rules_hash
+
+# Bytes handed to the parser per feed() call for buffer/file sources
+FEED_CHUNK_SIZE = 1 << 20
+
+_XML_DECL = re.compile(rb'<\?xml[^>]*\?>')
+_XML_DECL_STR = re.compile(r'<\?xml[^>]*\?>')
+_DECL_ENCODING = re.compile(rb'encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+_BOM = b'\xef\xbb\xbf'
+
+_parsers = threading.local()
+# Set on map_ordered pool threads
+_batch_worker = threading.local()
+
+# Compiled XPath tables keyed by (rules hash, namespace map)
+_xpath_cache = LRUCache(maxsize=256)
+
+
+def _fragment_parser(encoding=None):
+    """
+    Reusable recover-mode parser, one per thread and input encoding: lxml
+    parsers can be reused after close() but must not be shared by threads.
+    An encoding lxml does not know falls back to UTF-8, the way the XML
+    declaration used to be ignored altogether.
+    """
+    cache = getattr(_parsers, 'cache', None)
+    if cache is None:
+        cache = _parsers.cache = {}
+    parser = cache.get(encoding)
+    if parser is None:
+        try:
+            parser = etree.XMLParser(recover=True, encoding=encoding)
+        except LookupError:
+            return _fragment_parser(None)
+        cache[encoding] = parser
+    return parser
+
+
+def _iter_chunks(source):
+    """
+    Yields the source as str or bytes chunks without materialising a copy
+    of the whole input: str and bytes are passed through as-is, buffers
+    (bytearray, memoryview, mmap) are sliced and file objects are read.
+    """
+    if isinstance(source, (str, bytes)):
+        yield source
+    elif isinstance(source, (bytearray, memoryview, mmap.mmap)):
+        view = memoryview(source)
+        for i in range(0, len(view), FEED_CHUNK_SIZE):
+            yield view[i:i + FEED_CHUNK_SIZE].tobytes()
+    elif hasattr(source, 'read'):
+        while True:
+            chunk = source.read(FEED_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        raise TypeError(f'Unsupported XML source: {type(source).__name__}')
+
+
+def _strip_declarations(chunks):
+    """Drops <?xml ...?> declarations from a chunk stream, including ones split across chunks."""
+    carry = None
+    for chunk in chunks:
+        if carry:
+            chunk = carry + chunk
+            carry = None
+        text = isinstance(chunk, str)
+        lt = chunk.rfind('<' if text else b'<')
+        if lt != -1 and chunk.find('>' if text else b'>', lt) == -1:
+            # Possibly the start of a declaration: hold it back
+            carry, chunk = chunk[lt:], chunk[:lt]
+        decl = _XML_DECL_STR if text else _XML_DECL
+        if decl.search(chunk):
+            chunk = decl.sub('' if text else b'', chunk)
+        if chunk:
+            yield chunk
+    if carry:
+        yield carry
+
+
+def parse_fragments(source):
+    """
+    Parses an MX message under a synthetic <Root> element, so top-level
+    AppHdr + Document fragments form one tree. source may be str, bytes,
+    bytearray, memoryview, mmap or a text/binary file object. The input is
+    fed to a reusable parser in chunks instead of being decoded, wrapped in
+    a new string and re-encoded; a non-UTF-8 encoding named in the XML
+    declaration is honoured.
+    """
+    encoding, chunks = _fragment_feed(source)
+    parser = _fragment_parser(encoding)
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+    except Exception:
+        # Reset the parser so the next document starts clean
+        try:
+            parser.close()
+        except Exception:
+            pass
+        raise
+    return parser.close()
+
+
+def _fragment_feed(source):
+    """
+    (encoding, chunks) to feed a parser for source wrapped in <Root>...</Root>.
+    encoding is the one named in the XML declaration if that is not UTF-8.
+    """
+    chunks = _iter_chunks(source)
+    first = next(chunks, b'')
+    encoding = None
+    if isinstance(first, bytes):
+        # Make sure the whole declaration is in hand before sniffing it
+        while b'?>' not in first and first.lstrip(_BOM + b' \t\r\n').startswith(b'<?'):
+            more = next(chunks, b'')
+            if not more:
+                break
+            first += more
+        if first.startswith(_BOM):
+            first = first[len(_BOM):]
+        decl = _XML_DECL.match(first.lstrip())
+        m = _DECL_ENCODING.search(decl.group(0)) if decl else None
+        if m and m.group(1).lower().replace(b'_', b'-') not in (b'utf-8', b'utf8'):
+            encoding = m.group(1).decode('ascii')
+    return encoding, _wrap_root(first, chunks)
+
+
+def _wrap_root(first, chunks):
+    text = isinstance(first, str)
+    yield '<Root>' if text else b'<Root>'
+    yield from _strip_declarations(_chain(first, chunks))
+    yield '</Root>' if text else b'</Root>'
+
+
+def _chain(first, rest):
+    if first:
+        yield first
+    yield from rest
+
+
+class XPathTable(dict):
+    """
+    expression -> compiled etree.XPath for one rules string and namespace
+    map. Expressions are compiled on first use and then reused for every
+    document and every nested 'fields' element. With local_names,
+    un-prefixed name tests match elements in any namespace.
+    """
+    def __init__(self, namespaces=None, local_names=False):
+        super().__init__()
+        self.namespaces = namespaces
+        self.local_names = local_names
+
+    def __missing__(self, expr):
+        if self.local_names:
+            compiled = self[expr] = LocalNameXPath(expr, self.namespaces)
+        else:
+            compiled = self[expr] = etree.XPath(expr, namespaces=self.namespaces)
+        return compiled
+
+
+class LocalNameXPath:
+    """
+    Un-prefixed rule path compiled against the header namespaces of a
+    message (see localize_xpath). If that finds nothing, e.g. because an
+    element sits in another namespace than its header, the pure
+    local-name() form is tried before giving up.
+    """
+    __slots__ = ('expr', 'bound', '_fallback')
+
+    def __init__(self, expr, namespaces=None, context=''):
+        self.expr = expr
+        self.bound = etree.XPath(localize_xpath(expr, namespaces or {}, context), namespaces=namespaces)
+        self._fallback = None
+
+    def __call__(self, node):
+        found = self.bound(node)
+        if found:
+            return found
+        if self._fallback is None:
+            self._fallback = etree.XPath(localize_xpath(self.expr))
+        return self._fallback(node)
+
+
+def get_xpath_table(rules_json, nsmap=None, local_names=False):
+    """Cached XPathTable for a rules string and the namespaces it is evaluated with."""
+    # An etree.XPath object evaluates under its own lock, so each batch worker
+    # thread gets its own table instead of queueing on shared expressions
+    owner = threading.get_ident() if getattr(_batch_worker, 'active', False) else None
+    key = (rules_hash(rules_json), tuple(sorted(nsmap.items())) if nsmap else (), local_names, owner)
+    return _xpath_cache.get_or_build(key, lambda: XPathTable(dict(nsmap) if nsmap else None, local_names))
+
+
+_XPATH_TOKEN = re.compile(r"""
+    (?P<literal>"[^"]*"|'[^']*'|\$[A-Za-z_][\w.-]*(?::[A-Za-z_][\w.-]*)?|\d+(?:\.\d*)?|\.\d+)
+  | (?P<name>[A-Za-z_][\w.-]*(?::(?:[A-Za-z_][\w.-]*|\*))?)
+  | (?P<ws>\s+)
+  | (?P<op>//|::|\.\.|!=|<=|>=|[/\[\](),|@+\-=<>*.])
+""", re.VERBOSE)
+# Tokens after which the expression continues with an operator, not an operand
+_OPERAND_END = {')', ']', '.', '..'}
+# Header elements whose default namespace is bound to a prefix
+_HEADER_PREFIX = {'AppHdr': 'app', 'Document': 'def'}
+# Axes along which an element keeps the namespace of its context element
+_SCOPED_AXES = (None, 'child', 'descendant', 'descendant-or-self', 'self')
+
+
+def localize_xpath(expr, namespaces=None, context=''):
+    """
+    Resolves the un-prefixed element name tests of an XPath 1.0 rule
+    (/Root/Document/GrpHdr/...) against a namespaced message without
+    rewriting the document. AppHdr/Document and the elements below them
+    are bound to the 'app'/'def' prefixes of namespaces, as discovered by
+    discover_headers(); a name test whose namespace cannot be told from the
+    path becomes a local-name() test. With namespaces=None every name test
+    becomes a local-name() test. Attribute tests, functions, axes,
+    literals and prefixed names are kept. context: scope of the element the
+    expression is evaluated on ('' for <Root>, 'app' or 'def' below a
+    header).
+    """
+    tokens = []
+    pos = 0
+    while pos < len(expr):
+        m = _XPATH_TOKEN.match(expr, pos)
+        if m is None:
+            raise etree.XPathSyntaxError(f'Invalid expression at {pos}: {expr!r}')
+        tokens.append((m.lastgroup, m.group()))
+        pos = m.end()
+    significant = [i for i, (kind, _) in enumerate(tokens) if kind != 'ws']
+    out = []
+    prev = axis = None
+    operand_end = False
+    # Namespace scope of the current step: '' none, 'app'/'def' bound, None unknown.
+    # Paths are evaluated from the synthetic <Root>, which has no namespace.
+    context = scope = context if namespaces is not None else None
+    path_start = True
+    descend = False
+    stack = []
+
+    def name_test(name):
+        nonlocal scope
+        base = context if path_start else scope
+        if axis not in _SCOPED_AXES or (descend and base == ''):
+            base = None
+        prefix = _HEADER_PREFIX.get(name)
+        if namespaces is None:
+            scope = None
+        elif prefix and prefix in namespaces and axis != 'self':
+            scope = prefix
+        elif base == '' and name == '*':
+            # Children of <Root> are the headers, in their own namespaces
+            scope = None
+        else:
+            scope = base
+        if name == '*':
+            return name
+        if scope is None:
+            return f"*[local-name()='{name}']"
+        return f'{scope}:{name}' if scope else name
+
+    for n, i in enumerate(significant):
+        kind, text = tokens[i]
+        # Whitespace between tokens is kept as written
+        out.extend(t for _, t in tokens[significant[n - 1] + 1 if n else 0:i])
+        nxt = tokens[significant[n + 1]][1] if n + 1 < len(significant) else None
+        step = False
+        if kind == 'literal':
+            operand_end = True
+            path_start = False
+        elif kind == 'name' and operand_end:
+            # Operator name: and, or, div, mod
+            operand_end = False
+            path_start = True
+        elif kind == 'name' and nxt == '(':
+            pass  # function or node type test
+        elif kind == 'name' and nxt == '::':
+            axis = text
+        elif kind == 'name' or (text == '*' and not operand_end):
+            attribute = prev == '@' or axis in ('attribute', 'namespace')
+            if not attribute and ':' not in text:
+                text = name_test(text)
+            elif ':' in text:
+                scope = None
+            step = True
+            operand_end = True
+            path_start = False
+        elif text in ('/', '//'):
+            if path_start:
+                # Absolute path: children of the document node are <Root>
+                scope = '' if text == '/' and namespaces is not None else None
+                path_start = False
+            descend = text == '//'
+            operand_end = False
+        elif text == '.':
+            if path_start:
+                scope = context
+            operand_end = True
+            path_start = False
+        elif text == '..':
+            scope = None
+            operand_end = True
+            path_start = False
+        elif text in ('[', '('):
+            stack.append((context, scope))
+            if text == '[':
+                context = scope
+            path_start = True
+            operand_end = False
+        elif text in (']', ')'):
+            context, scope = stack.pop() if stack else (context, scope)
+            if text == ')':
+                scope = None
+            operand_end = True
+            path_start = False
+        elif text not in ('::', '@'):
+            # Remaining operators start a new operand
+            operand_end = False
+            path_start = True
+        if step or text in ('/', '[', '(', ']', ')'):
+            axis = None
+        if step:
+            descend = False
+        out.append(text)
+        prev = tokens[i][1]
+    out.extend(t for _, t in tokens[significant[-1] + 1 if significant else 0:])
+    return ''.join(out)
+
+
+def discover_headers(root):
+    """
+    Single pass over the AppHdr/Document elements of a parsed message,
+    stopping once both are found with a default namespace. Returns
+    (apphdr_elem, doc_elem, nsmap) where nsmap maps 'app'/'def' to those
+    namespaces; an element without one is still returned if it is the
+    only candidate.
+    """
+    nsmap = {}
+    apphdr_elem = None
+    doc_elem = None
+    for elem in root.iter('{*}AppHdr', '{*}Document'):
+        ns_uri = elem.nsmap.get(None)
+        if etree.QName(elem).localname == 'AppHdr':
+            if 'app' in nsmap:
+                continue
+            if ns_uri:
+                nsmap['app'] = ns_uri
+                apphdr_elem = elem
+            elif apphdr_elem is None:
+                apphdr_elem = elem
+        else:
+            if 'def' in nsmap:
+                continue
+            if ns_uri:
+                nsmap['def'] = ns_uri
+                doc_elem = elem
+            elif doc_elem is None:
+                doc_elem = elem
+        if 'app' in nsmap and 'def' in nsmap:
+            break
+    return apphdr_elem, doc_elem, nsmap
+
+
+class XMLFieldRule:
+    """
+    One compiled Configuration rule for MX messages: the rewritten XPath
+    and its base (AppHdr, Document or the context element), the condition
+    predicate, and the compiled sub-rules of a 'fields' group.
+    """
+    __slots__ = ('name', 'path', 'base', 'xp', 'multiple', 'predicate', 'fields')
+
+    def __init__(self, name, rule):
+        self.name = name
+        if isinstance(rule, dict):
+            path = rule.get('path')
+            condition = rule.get('condition')
+            cond_value = rule.get('value')
+            self.multiple = rule.get('multiple', False)
+            fields = rule.get('fields')
+        else:
+            path = rule
+            condition = None
+            cond_value = None
+            self.multiple = False
+            fields = None
+        self.path = path
+        self.base = None
+        self.xp = path
+        if path and path.startswith('/def:Document'):
+            self.base = 'def'
+            self.xp = '.' + path[len('/def:Document'):]
+        elif path and path.startswith('/app:AppHdr'):
+            self.base = 'app'
+            self.xp = '.' + path[len('/app:AppHdr'):]
+        try:
+            self.predicate = compile_condition(condition, cond_value)
+        except Exception as e:
+            # e.g. an invalid regex: the field fails, the others still extract
+            self.predicate = _failing_predicate(e)
+        self.fields = [XMLFieldRule(n, r) for n, r in fields.items()] if fields else None
+
+    def find(self, doc, context=None):
+        if self.base == 'def':
+            base = doc.doc_elem
+        elif self.base == 'app':
+            base = doc.apphdr_elem
+        else:
+            base = context if context is not None else doc.root
+        if doc.debug:
+            logging.debug('extract_field: path=%s, base_tag=%s', self.xp, getattr(base, 'tag', None))
+        found = doc.xpaths[self.xp](base) if hasattr(base, 'xpath') else []
+        if doc.debug:
+            logging.debug('extract_field: found=%s', found)
+        return found
+
+    def extract(self, doc, context=None):
+        """Value in the extract_xml_fields shape: text, list of texts, dict or list of dicts."""
+        if not self.path:
+            return None
+        try:
+            found = self.find(doc, context)
+            if self.fields:
+                if self.multiple:
+                    return [{f.name: f.extract(doc, elem) for f in self.fields} for elem in found]
+                elem = found[0] if found else None
+                if elem is None:
+                    return None
+                return {f.name: f.extract(doc, elem) for f in self.fields}
+            if self.multiple:
+                values = [_node_text(elem) for elem in found]
+                if self.predicate:
+                    values = [self.predicate(v) for v in values]
+                return [v for v in values if v is not None]
+            value = _node_text(found[0]) if found else None
+            return self.predicate(value) if self.predicate else value
+        except Exception as e:
+            logging.debug('extract_field: Exception %s', e)
+            return None
+
+
+def _node_text(node):
+    return node.text if isinstance(node, etree._Element) else str(node)
+
+
+def _failing_predicate(error):
+    def predicate(value):
+        raise error
+    return predicate
+
+
+class _MXDocument:
+    """A parsed MX message with its headers and the XPath table for its namespaces."""
+    __slots__ = ('root', 'apphdr_elem', 'doc_elem', 'xpaths', 'debug')
+
+    def __init__(self, root, rules_json):
+        self.root = root
+        self.apphdr_elem, self.doc_elem, nsmap = discover_headers(root)
+        self.xpaths = get_xpath_table(rules_json, nsmap)
+        self.debug = logging.root.isEnabledFor(logging.DEBUG)
+        if self.debug:
+            for elem in root.iter(etree.Element):
+                logging.debug('ELEMENT tag: %s, nsmap: %s', elem.tag, elem.nsmap)
+            logging.debug('extract_xml_fields nsmap: %s', nsmap)
+            logging.debug('apphdr_elem tag: %s', getattr(self.apphdr_elem, 'tag', None))
+            logging.debug('doc_elem tag: %s', getattr(self.doc_elem, 'tag', None))
+
+
+class XMLRulePlan:
+    """
+    Configuration rules for MX messages compiled once. extract() gives the
+    nested extract_xml_fields result; rows() flattens the repeating group
+    (a 'multiple' rule with 'fields', e.g. CdtTrfTxInf) into one tuple per
+    element, with the plain header rules (GrpHdr, AppHdr, ...) broadcast
+    onto every row. A group nested in the group (PmtInf > CdtTrfTxInf)
+    is expanded the same way.
+    """
+    def __init__(self, rules):
+        self.rules = [XMLFieldRule(name, rule) for name, rule in rules.items()]
+        self._row_layouts = {}
+
+    def extract(self, doc, profile=None):
+        if profile is None:
+            return {rule.name: rule.extract(doc) for rule in self.rules}
+        result = {}
+        for rule in self.rules:
+            t0 = time.perf_counter()
+            value = result[rule.name] = rule.extract(doc)
+            profile.record(rule.name, time.perf_counter() - t0, value, rule.path)
+        return result
+
+    def row_layout(self, group=None):
+        """(columns, header rules, group rule) for the named or first repeating group."""
+        layout = self._row_layouts.get(group)
+        if layout is None:
+            groups = [r for r in self.rules if r.fields]
+            if group is not None:
+                groups = [r for r in groups if r.name == group]
+            group_rule = groups[0] if groups else None
+            header = [r for r in self.rules if not r.fields]
+            columns = [r.name for r in header]
+            rule = group_rule
+            while rule is not None:
+                for f in rule.fields:
+                    if not f.fields:
+                        columns.append(f.name if f.name not in columns else f'{rule.name}.{f.name}')
+                rule = next((f for f in rule.fields if f.fields), None)
+            layout = self._row_layouts[group] = (tuple(columns), header, group_rule)
+        return layout
+
+    def rows(self, doc, group=None):
+        columns, header, group_rule = self.row_layout(group)
+        head = tuple(rule.extract(doc) for rule in header)
+        if group_rule is None:
+            return [head]
+        return [head + tail for tail in _group_rows(group_rule, doc, None)]
+
+
+def _group_rows(rule, doc, context):
+    scalars = [f for f in rule.fields if not f.fields]
+    child = next((f for f in rule.fields if f.fields), None)
+    try:
+        found = rule.find(doc, context) if rule.path else []
+    except Exception as e:
+        logging.debug('extract_field: Exception %s', e)
+        found = []
+    if not rule.multiple:
+        found = found[:1]
+    rows = []
+    for elem in found:
+        values = tuple(f.extract(doc, elem) for f in scalars)
+        if child is None:
+            rows.append(values)
+            continue
+        child_rows = _group_rows(child, doc, elem)
+        if child_rows:
+            rows.extend(values + r for r in child_rows)
+        else:
+            # Keep the parent row even if it has no children
+            rows.append(values + (None,) * _group_width(child))
+    return rows
+
+
+def _group_width(rule):
+    width = 0
+    while rule is not None:
+        width += sum(1 for f in rule.fields if not f.fields)
+        rule = next((f for f in rule.fields if f.fields), None)
+    return width
+
+
+_xml_plan_cache = LRUCache(maxsize=256)
+
+
+def get_xml_rule_plan(rules_json):
+    """Cached XMLRulePlan for a Configuration rules string; raises on invalid rules."""
+    return _xml_plan_cache.get_or_build(rules_hash(rules_json), lambda: XMLRulePlan(json.loads(rules_json)))
+
+
+def extract_xml_fields(content, rules_json, profile=None):
+    """
+    Extracts Configuration rules from an MX message (AppHdr and/or Document
+    fragments). content may be str, bytes, memoryview, mmap or a file object.
+    profile: optional RuleProfile that collects per-rule timings.
+    """
+    try:
+        plan = get_xml_rule_plan(rules_json)
+    except Exception:
+        return None
+    try:
+        t0 = time.perf_counter()
+        # Parse as fragments under a dummy root
+        doc = _MXDocument(parse_fragments(content), rules_json)
+        if profile is not None:
+            profile.record(PARSE_STEP, time.perf_counter() - t0)
+        return plan.extract(doc, profile)
+    except Exception as e:
+        logging.debug('extract_xml_fields: Exception %s', e)
+        return None
+
+
+# Rows per RowBatch from iter_xml_row_batches
+ROW_BATCH_SIZE = 1000
+
+
+class RowBatch:
+    """
+    Flat per-transaction rows sharing one column list. Rows are tuples in
+    column order; to_columns() gives the same data column-wise.
+    """
+    __slots__ = ('columns', 'rows')
+
+    def __init__(self, columns, rows=None):
+        self.columns = columns
+        self.rows = rows if rows is not None else []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def column(self, name):
+        i = self.columns.index(name)
+        return [row[i] for row in self.rows]
+
+    def to_columns(self):
+        if not self.rows:
+            return {name: [] for name in self.columns}
+        return {name: list(values) for name, values in zip(self.columns, zip(*self.rows))}
+
+    def as_dicts(self):
+        return [dict(zip(self.columns, row)) for row in self.rows]
+
+
+def extract_xml_rows(content, rules_json, group=None):
+    """
+    One flat row per element of the repeating group (the first 'multiple'
+    rule with 'fields', or the one named group) of an MX message, with
+    header fields broadcast onto each row. Returns a RowBatch, or None if
+    the rules are invalid or the message cannot be parsed.
+    """
+    try:
+        plan = get_xml_rule_plan(rules_json)
+        columns = plan.row_layout(group)[0]
+        doc = _MXDocument(parse_fragments(content), rules_json)
+        return RowBatch(columns, plan.rows(doc, group))
+    except Exception as e:
+        logging.debug('extract_xml_rows: Exception %s', e)
+        return None
+
+
+def iter_xml_row_batches(sources, rules_json, group=None, batch_size=ROW_BATCH_SIZE, workers=None):
+    """
+    Row extraction over many messages: yields RowBatch objects of about
+    batch_size rows. Messages that cannot be parsed are skipped. Messages
+    are parsed on up to workers threads (see map_ordered); row order
+    follows the sources.
+    """
+    plan = get_xml_rule_plan(rules_json)
+    columns = plan.row_layout(group)[0]
+
+    def source_rows(source):
+        try:
+            return plan.rows(_MXDocument(parse_fragments(source), rules_json), group)
+        except Exception as e:
+            logging.debug('iter_xml_row_batches: Exception %s', e)
+            return None
+
+    batch = RowBatch(columns)
+    for rows in map_ordered(source_rows, sources, workers):
+        if rows is None:
+            continue
+        batch.rows.extend(rows)
+        if len(batch.rows) >= batch_size:
+            yield batch
+            batch = RowBatch(columns)
+    if batch.rows:
+        yield batch
+
+
+class PathTrie:
+    """
+    FileType rules compiled into one trie of child steps, so plain absolute
+    paths (/Root/Document/.../Tag, optionally with positional steps such as
+    AdrLine[2] and a final /@attr or /text()) are all resolved in a single
+    walk of the document that only descends into elements some pending rule
+    still needs. Steps match by local name, like LocalNameXPath. Rules the
+    trie cannot express (other predicates, functions, '//' and so on) are
+    left in fallback for the XPath table.
+    """
+    def __init__(self, rules):
+        self.order = list(rules)
+        self.paths = dict(rules)
+        self.names = []
+        self.fallback = {}
+        # Per trie node: {local name: {position or None: child node}}
+        self.children = [{}]
+        self.element_vars = [[]]
+        self.attr_vars = [[]]
+        self.text_vars = [[]]
+        # Per variable: trie nodes on its path, used to count what is still pending below a node
+        self.var_nodes = []
+        for var, xpath in rules.items():
+            steps = _trie_steps(xpath)
+            if steps is None:
+                self.fallback[var] = xpath
+                continue
+            *steps, last = steps
+            node, path = 0, [0]
+            for name, position in steps:
+                child = self.children[node].setdefault(name, {}).get(position)
+                if child is None:
+                    child = self.children[node][name][position] = len(self.children)
+                    self.children.append({})
+                    self.element_vars.append([])
+                    self.attr_vars.append([])
+                    self.text_vars.append([])
+                node = child
+                path.append(node)
+            index = len(self.names)
+            self.names.append(var)
+            self.var_nodes.append(path)
+            if last == 'text()':
+                self.text_vars[node].append(index)
+            elif last:
+                self.attr_vars[node].append((index, last))
+            else:
+                self.element_vars[node].append(index)
+        self.pending = [0] * len(self.children)
+        for path in self.var_nodes:
+            for node in path:
+                self.pending[node] += 1
+
+    def evaluate(self, root):
+        """{var: value} for the trie rules; '' where nothing matched, as with _first_value."""
+        values = [None] * len(self.names)
+        if self.names:
+            steps = self.children[0].get(_local_name(root.tag))
+            if steps:
+                self._descend(root, 1, steps, values, list(self.pending))
+        return {var: '' if value is None else value for var, value in zip(self.names, values)}
+
+    def _descend(self, elem, position, steps, values, pending):
+        node = steps.get(None)
+        if node is not None:
+            self._walk(elem, node, values, pending)
+        node = steps.get(position)
+        if node is not None:
+            self._walk(elem, node, values, pending)
+
+    def _walk(self, elem, node, values, pending):
+        if not pending[node]:
+            return
+        for index in self.element_vars[node]:
+            if values[index] is None:
+                self._resolve(index, (elem.text or '').strip(), values, pending)
+        for index, attr in self.attr_vars[node]:
+            if values[index] is None:
+                value = elem.get(attr)
+                if value is not None:
+                    self._resolve(index, value.strip(), values, pending)
+        for index in self.text_vars[node]:
+            if values[index] is None:
+                value = _first_text(elem)
+                if value is not None:
+                    self._resolve(index, value.strip(), values, pending)
+        children = self.children[node]
+        if not children:
+            return
+        # Document order, so the first element reached is the one XPath would return first
+        seen = {}
+        for child in elem.iterchildren(etree.Element):
+            if not pending[node]:
+                return
+            name = _local_name(child.tag)
+            steps = children.get(name)
+            if steps is not None:
+                position = seen[name] = seen.get(name, 0) + 1
+                self._descend(child, position, steps, values, pending)
+
+    def _resolve(self, index, value, values, pending):
+        values[index] = value
+        for node in self.var_nodes[index]:
+            pending[node] -= 1
+
+
+_TRIE_STEP = re.compile(r'([A-Za-z_][\w.-]*)(?:\[([1-9][0-9]*)\])?$')
+
+
+def _trie_steps(xpath):
+    """
+    [(name, position or None), ..., last] for a rule the trie can evaluate,
+    where last is '' (element text), an attribute name or 'text()'; else None.
+    """
+    raw = _rule_steps(xpath)
+    if not raw:
+        return None
+    last = ''
+    if raw[-1] == 'text()':
+        last = raw.pop()
+    elif raw[-1].startswith('@') and _NAME_STEP.match(raw[-1][1:]):
+        last = raw.pop()[1:]
+    steps = []
+    for step in raw:
+        m = _TRIE_STEP.match(step)
+        if m is None:
+            return None
+        steps.append((m.group(1), int(m.group(2)) if m.group(2) else None))
+    if not steps:
+        return None
+    steps.append(last)
+    return steps
+
+
+def _local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+def _first_text(elem):
+    """First text node child of elem (its text, else a child's tail), or None."""
+    if elem.text is not None:
+        return elem.text
+    for child in elem:
+        if child.tail is not None:
+            return child.tail
+    return None
+
+
+_trie_cache = LRUCache(maxsize=256)
+
+
+def get_path_trie(rules_json, fields=None):
+    """PathTrie for a rules string (restricted to fields when given), cached by rules hash."""
+    key = (rules_hash(rules_json), tuple(sorted(fields)) if fields is not None else None)
+
+    def build():
+        rules = json.loads(rules_json)
+        if fields is not None:
+            rules = {var: xpath for var, xpath in rules.items() if var in fields}
+        return PathTrie(rules)
+    return _trie_cache.get_or_build(key, build)
+
+
+def extract_xml_with_xpaths(file_content, rules_json, fields=None, profile=None):
+    """
+    Evaluates FileType.extraction_rules ({var: xpath}) against the parsed
+    document. Rule paths are written without namespaces (/Root/Document/...)
+    and are matched by local name. Plain paths are resolved together in one
+    PathTrie walk; the rest go through XPath. fields: optional set of
+    variables to evaluate; the other rules are skipped. profile: optional
+    RuleProfile that collects timings; the trie walk cannot be split per
+    rule, so when profiling every rule is evaluated and timed on its own
+    through XPath (same results, one entry per rule).
+    """
+    trie = get_path_trie(rules_json, fields)
+    t0 = time.perf_counter()
+    root = parse_fragments(file_content)
+    if profile is not None:
+        profile.record(PARSE_STEP, time.perf_counter() - t0)
+        found, pending = {}, trie.paths
+    else:
+        found, pending = trie.evaluate(root), trie.fallback
+    if pending:
+        xpaths = get_xpath_table(rules_json, discover_headers(root)[2], local_names=True)
+        for var, xpath in pending.items():
+            t0 = time.perf_counter()
+            try:
+                found[var] = _first_value(xpaths[xpath](root))
+            except Exception:
+                found[var] = ''
+            if profile is not None:
+                profile.record(var, time.perf_counter() - t0, found[var], xpath)
+    # Keep the rule order of the FileType
+    return {var: found[var] for var in trie.order}
+
+
+# Default thread count for the batch XML APIs
+XML_BATCH_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def map_ordered(func, items, workers=None):
+    """
+    Yields func(item) for every item in input order, running up to workers
+    (default XML_BATCH_WORKERS) calls at once on a thread pool. lxml
+    releases the GIL while it parses and evaluates XPath, so XML work runs
+    on several cores without pickling anything to worker processes. At
+    most 2 * workers items are in flight, so items can be a lazy iterable.
+    """
+    workers = workers or XML_BATCH_WORKERS
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+    with ThreadPoolExecutor(max_workers=workers, initializer=_start_batch_worker) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _start_batch_worker():
+    _batch_worker.active = True
+
+
+def extract_xml_fields_batch(sources, rules_json, workers=None):
+    """
+    extract_xml_fields over many messages (anything it accepts) on a thread
+    pool. Returns the results in input order; None for a message that
+    cannot be parsed.
+    """
+    return list(map_ordered(lambda source: extract_xml_fields(source, rules_json), sources, workers))
+
+
+def extract_xml_with_xpaths_batch(sources, rules_json, fields=None, workers=None):
+    """
+    extract_xml_with_xpaths over many messages on a thread pool. Returns
+    the results in input order; None for a message whose extraction raised.
+    """
+    def extract(source):
+        try:
+            return extract_xml_with_xpaths(source, rules_json, fields=fields)
+        except Exception as e:
+            logging.debug('extract_xml_with_xpaths_batch: Exception %s', e)
+            return None
+    return list(map_ordered(extract, sources, workers))
+
+
+def _first_value(found):
+    """Stripped text of the first XPath result, '' if there is none."""
+    if found:
+        if isinstance(found[0], etree._Element):
+            return (found[0].text or '').strip()
+        return str(found[0]).strip()
+    return ''
+
+
+# Repeating elements a bulk pacs.008 / pain.001 file is split into, innermost first
+RECORD_TAGS = ('CdtTrfTxInf', 'PmtInf')
+
+_NAME_STEP = re.compile(r'[A-Za-z_][\w.-]*$')
+
+
+def detect_record_tag(rules):
+    """First of RECORD_TAGS that the FileType rules refer to, CdtTrfTxInf by default."""
+    for tag in RECORD_TAGS:
+        pattern = re.compile(rf'\b{tag}\b')
+        if any(isinstance(xpath, str) and pattern.search(xpath) for xpath in rules.values()):
+            return tag
+    return RECORD_TAGS[0]
+
+
+def _rule_steps(xpath):
+    """Steps of a plain absolute child path (/Root/Document/...), else None."""
+    if not isinstance(xpath, str) or not xpath.startswith('/') or '//' in xpath:
+        return None
+    return xpath[1:].split('/')
+
+
+class RecordPlan:
+    """
+    FileType rules split for one record path, e.g. Root/Document/
+    FIToFICstmrCdtTrf/CdtTrfTxInf. A rule is evaluated relative to the
+    deepest record ancestor on its own path: ./PmtId/InstrId on the record,
+    ./Dbtr/Nm on the enclosing PmtInf, AppHdr/BizMsgIdr on <Root>. Rules
+    that are not plain child paths run against the partial document.
+    """
+    def __init__(self, rules, record_path, namespaces):
+        self.rules = []
+        for var, xpath in rules.items():
+            steps = _rule_steps(xpath)
+            k = 0
+            if steps is not None:
+                while k < len(steps) and k < len(record_path) and steps[k] == record_path[k]:
+                    k += 1
+            if k == 0:
+                self.rules.append((var, None, LocalNameXPath(xpath, namespaces)))
+                continue
+            rest = '/'.join(steps[k:])
+            expr = f'./{rest}' if rest else '.'
+            self.rules.append((var, k - 1, LocalNameXPath(expr, namespaces, _path_scope(record_path[:k], namespaces))))
+
+    def evaluate(self, chain):
+        """chain: the record element's ancestors from <Root> down, then the record."""
+        result = {}
+        for var, depth, xpath in self.rules:
+            node = chain[depth] if depth is not None else chain[0]
+            try:
+                result[var] = _first_value(xpath(node))
+            except Exception:
+                result[var] = ''
+        return result
+
+
+def _path_scope(names, namespaces):
+    for name in reversed(names):
+        prefix = _HEADER_PREFIX.get(name)
+        if prefix:
+            return prefix if prefix in namespaces else ''
+    return ''
+
+
+def _release(elem):
+    """
+    Frees a processed record: clears it, drops the records before it and
+    every finished earlier sibling of its ancestors with the same tag (e.g.
+    completed PmtInf blocks), so the partial tree stays bounded.
+    """
+    elem.clear(keep_tail=True)
+    node, parent = elem, elem.getparent()
+    while parent is not None:
+        prev = node.getprevious()
+        while prev is not None and prev.tag == node.tag:
+            parent.remove(prev)
+            prev = node.getprevious()
+        node, parent = parent, parent.getparent()
+
+
+def iter_xml_records(source, rules_json, record_tag=None, fields=None):
+    """
+    Streaming counterpart of extract_xml_with_xpaths for bulk pacs.008 /
+    pain.001 files. Parses incrementally (iterparse-style pull parser) and
+    yields one {var: value} dict per repeating record element (record_tag,
+    detected from the rules if not given), with the FileType rules
+    evaluated for that record. Processed records are cleared as soon as
+    they have been yielded, so peak memory does not grow with the number
+    of transactions. Values of elements that only appear after the records
+    are not available.
+    """
+    rules = json.loads(rules_json)
+    if fields is not None:
+        rules = {var: xpath for var, xpath in rules.items() if var in fields}
+    record_tag = record_tag or detect_record_tag(rules)
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    elif isinstance(source, str):
+        source = io.StringIO(source)
+    encoding, chunks = _fragment_feed(source)
+    parser = etree.XMLPullParser(events=('end',), tag='{*}' + record_tag, recover=True, encoding=encoding)
+    namespaces = None
+    plans = {}
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, elem in parser.read_events():
+            chain = list(elem.iterancestors())
+            chain.reverse()
+            chain.append(elem)
+            if namespaces is None:
+                namespaces = discover_headers(chain[0])[2]
+            path = tuple(etree.QName(e).localname for e in chain)
+            plan = plans.get(path)
+            if plan is None:
+                plan = plans[path] = RecordPlan(rules, path, namespaces)
+            yield plan.evaluate(chain)
+            _release(elem)
+    parser.close()
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import threading
+import uuid
+
+from flask import session
+
+from .mt import MTFieldRule, decode_swift, tokenize_mt
+from .mx import PathTrie, XMLFieldRule, _MXDocument, _first_value, get_xpath_table, parse_fragments
+from .rules import LRUCache
+
+# Parsed samples kept per browser session, and in total
+PREVIEW_SAMPLES = 3
+PREVIEW_MAX_SAMPLES = 96
+# Upload bytes of all cached samples together; the parsed form is a few
+# times larger. A sample over the limit is used once and not cached.
+PREVIEW_MAX_BYTES = 32 * 1024 * 1024
+
+# (session id, kind, sample hash) -> PreviewSample, shared by all sessions
+_samples = LRUCache(maxsize=PREVIEW_MAX_SAMPLES, maxbytes=PREVIEW_MAX_BYTES, sizeof=lambda sample: sample.size)
+
+
+class PreviewSample:
+    """
+    An uploaded sample parsed once ('mt': decoded text plus its MTIndex,
+    'xml': the fragment tree) and kept for the following previews, along
+    with the value each rule produced the last time it was run. key is the
+    sample's hash; XPath tables are looked up by the rules being previewed,
+    like everywhere else.
+    """
+    def __init__(self, key, kind, data):
+        self.key = key
+        self.kind = kind
+        self.size = len(data)
+        self.error = None
+        self.content = self.index = self.root = None
+        self._results = {}
+        self._lock = threading.Lock()
+        if kind == 'mt':
+            self.content = decode_swift(data)
+            self.index = tokenize_mt(self.content)
+        else:
+            try:
+                self.root = parse_fragments(data)
+            except Exception as e:
+                self.error = str(e)
+
+    def evaluate(self, mode, rules, rules_json):
+        """
+        Runs rules ({name: rule}, parsed from rules_json) against the sample. A rule whose name and
+        definition are unchanged since the previous call keeps its previous
+        value; only new or edited rules are evaluated. Returns (result, names
+        of the rules evaluated).
+        """
+        with self._lock:
+            previous, current = self._results, {}
+            keys = {name: (mode, name, json.dumps(rule, sort_keys=True)) for name, rule in rules.items()}
+            changed = {name: rule for name, rule in rules.items() if keys[name] not in previous}
+            values = self._run(mode, changed, rules_json) if changed else {}
+            result = {}
+            for name, key in keys.items():
+                value = values[name] if name in changed else previous[key]
+                current[key] = result[name] = value
+            self._results = current
+        return result, list(changed)
+
+    def _run(self, mode, rules, rules_json):
+        if mode == 'mt':
+            return {name: MTFieldRule(name, rule).extract(self.content, self.index) for name, rule in rules.items()}
+        doc = _MXDocument(self.root, rules_json)
+        if mode == 'xml':
+            return {name: XMLFieldRule(name, rule).extract(doc) for name, rule in rules.items()}
+        # FileType mapping: plain paths in one trie walk, the rest through XPath
+        trie = PathTrie(rules)
+        values = trie.evaluate(doc.root)
+        xpaths = get_xpath_table(rules_json, doc.xpaths.namespaces, local_names=True)
+        for name, xpath in trie.fallback.items():
+            try:
+                values[name] = _first_value(xpaths[xpath](doc.root))
+            except Exception:
+                values[name] = ''
+        return values
+
+
+def _session_id():
+    sid = session.get('preview_id')
+    if sid is None:
+        sid = session['preview_id'] = uuid.uuid4().hex
+    return sid
+
+
+def load_sample(data, kind):
+    """
+    PreviewSample for uploaded bytes ('mt' or 'xml'); an upload this session
+    has already sent is not parsed again.
+    """
+    sid = _session_id()
+    key = hashlib.sha256(data).hexdigest()
+    sample = _samples.get((sid, kind, key))
+    if sample is None:
+        sample = _samples.put((sid, kind, key), PreviewSample(key, kind, data))
+        # Keep this session's PREVIEW_SAMPLES most recent samples
+        own = [k for k in _samples.keys() if k[0] == sid]
+        for k in own[:-PREVIEW_SAMPLES]:
+            _samples.pop(k)
+    return sample
+
+
+def cached_sample(key, kind):
+    """Sample previously returned by load_sample in this session, or None if it was evicted."""
+    return _samples.get((_session_id(), kind, key))
+
+
+def preview_rules(sample, rules_json, mode):
+    """
+    Extraction result of a rules string against a cached sample. mode is
+    'mt' or 'xml' for Configuration-style rules (the extract_mt_fields /
+    extract_xml_fields output) and 'xpath' for FileType XML mappings (the
+    extract_xml_with_xpaths output). Returns (result, evaluated names);
+    result is None if the XML sample did not parse. Raises ValueError for
+    rules that are not a JSON object.
+    """
+    rules = json.loads(rules_json) if rules_json else {}
+    if not isinstance(rules, dict):
+        raise ValueError('rules must be a JSON object')
+    if sample.error is not None:
+        return None, []
+    return sample.evaluate(mode, rules, rules_json)
@@ -0,0 +1,80 @@
+import json
+import os
+
+from .corpus import load_message_index
+
+# Upper bound on messages run through a rule set per profiling request
+PROFILE_MAX_MESSAGES = 500
+
+# Pseudo-rule under which the per-message parse/tokenize cost is recorded
+PARSE_STEP = '(parse)'
+
+
+class RuleProfile:
+    """
+    Per-rule wall time, match count and result size accumulated while the
+    extractors run over a sample corpus. Pass one as profile= to
+    extract_mt_fields, extract_xml_fields or extract_xml_with_xpaths.
+    """
+    def __init__(self):
+        self.messages = 0
+        self.stats = {}
+
+    def record(self, rule, elapsed, value=None, path=None):
+        stats = self.stats.get(rule)
+        if stats is None:
+            stats = self.stats[rule] = {'rule': rule, 'path': path, 'calls': 0, 'time': 0.0, 'max': 0.0, 'matches': 0, 'size': 0}
+        stats['calls'] += 1
+        stats['time'] += elapsed
+        if elapsed > stats['max']:
+            stats['max'] = elapsed
+        stats['matches'] += _match_count(value)
+        stats['size'] += _result_size(value)
+
+    def ranked(self):
+        """Rows sorted by total time, most expensive first, with averages and share of the total."""
+        total = sum(s['time'] for s in self.stats.values()) or 1.0
+        rows = []
+        for s in sorted(self.stats.values(), key=lambda s: s['time'], reverse=True):
+            row = dict(s)
+            row['avg_ms'] = s['time'] * 1000.0 / s['calls'] if s['calls'] else 0.0
+            row['max_ms'] = s['max'] * 1000.0
+            row['total_ms'] = s['time'] * 1000.0
+            row['share'] = s['time'] * 100.0 / total
+            rows.append(row)
+        return rows
+
+
+def _match_count(value):
+    if value is None or value == '':
+        return 0
+    if isinstance(value, (list, tuple)):
+        return sum(1 for v in value if v not in (None, ''))
+    return 1
+
+
+def _result_size(value):
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value)
+    return len(json.dumps(value, default=str))
+
+
+def profile_corpus(extract, paths, limit=PROFILE_MAX_MESSAGES):
+    """
+    Runs extract(message_bytes, profile) over every message of the given
+    corpus files (split with the message offset index) and returns the
+    filled RuleProfile. Stops after limit messages.
+    """
+    profile = RuleProfile()
+    for path in paths:
+        entries = load_message_index(path) if os.path.getsize(path) else []
+        with open(path, 'rb') as f:
+            for entry in entries:
+                if profile.messages >= limit:
+                    return profile
+                f.seek(entry.offset)
+                extract(f.read(entry.length), profile)
+                profile.messages += 1
+    return profile
@@ -0,0 +1,257 @@
+import atexit
+import json
+import logging
+import os
+import pickle
+import queue
+import re
+import subprocess
+import sys
+import threading
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+# Wall-clock budget (seconds) for one evaluation of a user regex
+REGEX_TIME_BUDGET = 1.0
+# Time allowed for a fresh worker process to start, not counted in the budget
+WORKER_START_TIMEOUT = 30.0
+# Worker processes alive at once (see configure_workers); evaluations beyond
+# that wait for a free worker before their budget starts
+REGEX_MAX_WORKERS = 4
+
+_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'regex_worker.py')
+
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+_MAXREPEAT = sre_constants.MAXREPEAT
+
+
+class RegexTimeout(Exception):
+    """A guarded regex evaluation ran over REGEX_TIME_BUDGET."""
+
+
+def analyze_pattern(pattern):
+    """
+    Static check for catastrophic-backtracking shapes. Returns a list of
+    (severity, message): 'error' for nested quantifiers such as (a+)+ and
+    for patterns that do not compile, 'warning' for alternation under a
+    quantifier such as (a|ab)* and for quantifiers inside a group repeated
+    a fixed number of times such as (.*?,){12}. This only informs the user
+    at save time; every evaluation runs under REGEX_TIME_BUDGET anyway.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error as e:
+        return [('error', f'invalid regular expression: {e}')]
+    issues = []
+    _scan(parsed, False, issues)
+    # One message per kind of problem is enough for the user
+    return list(dict.fromkeys(issues))
+
+
+def _scan(subpattern, in_repeat, issues, in_fixed=False):
+    for op, av in subpattern:
+        if op in _REPEATS:
+            lo, hi, item = av
+            variable = hi == _MAXREPEAT or hi > lo
+            if variable and in_repeat:
+                issues.append(('error', 'nested quantifier (e.g. (a+)+) can backtrack catastrophically'))
+            elif variable and in_fixed:
+                issues.append(('warning', 'quantifier inside a repeated group (e.g. (.*?,){12}) may backtrack heavily'))
+            _scan(item, in_repeat or variable, issues, in_fixed or (not variable and hi > 1))
+        elif op == sre_constants.SUBPATTERN:
+            _scan(av[-1], in_repeat, issues, in_fixed)
+        elif op == sre_constants.BRANCH:
+            if in_repeat:
+                issues.append(('warning', 'alternation inside a quantified group (e.g. (a|ab)*) may backtrack heavily'))
+            for branch in av[1]:
+                _scan(branch, in_repeat, issues, in_fixed)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            _scan(av[1], in_repeat, issues, in_fixed)
+        elif op == sre_constants.GROUPREF_EXISTS:
+            _scan(av[1], in_repeat, issues, in_fixed)
+            if av[2] is not None:
+                _scan(av[2], in_repeat, issues, in_fixed)
+        # Possessive repeats and atomic groups cannot backtrack: not scanned
+
+
+def iter_rule_patterns(rules, field=None):
+    """
+    Yields (field, pattern) for every regex in a Configuration rules dict:
+    'regex:' paths and 'condition': 'regex' values, including nested 'fields'.
+    """
+    for name, rule in rules.items():
+        label = f'{field}.{name}' if field else name
+        if isinstance(rule, str):
+            path = rule
+        elif isinstance(rule, dict):
+            path = rule.get('path')
+            if rule.get('condition') == 'regex' and isinstance(rule.get('value'), str):
+                yield label, rule['value']
+            if isinstance(rule.get('fields'), dict):
+                yield from iter_rule_patterns(rule['fields'], label)
+        else:
+            continue
+        if isinstance(path, str) and path.startswith('regex:'):
+            yield label, path[len('regex:'):].strip()
+
+
+def check_rule_patterns(rules_json):
+    """
+    Save-time analysis of every regex in a rules string. Returns
+    (errors, warnings) as lists of user-facing messages.
+    """
+    errors, warnings = [], []
+    try:
+        rules = json.loads(rules_json) if rules_json else {}
+    except ValueError:
+        return errors, warnings
+    if not isinstance(rules, dict):
+        return errors, warnings
+    for field, pattern in iter_rule_patterns(rules):
+        for severity, message in analyze_pattern(pattern):
+            text = f"Rule '{field}': {message}."
+            (errors if severity == 'error' else warnings).append(text)
+    return errors, warnings
+
+
+class GuardedPattern:
+    """
+    Pattern used by the extraction rules. Compiled here so an invalid
+    pattern fails at rule-build time; every evaluation runs in a worker
+    process under REGEX_TIME_BUDGET and raises RegexTimeout instead of
+    blocking, since no static check catches every backtracking shape.
+    """
+    __slots__ = ('pattern', 'flags')
+
+    def __init__(self, pattern, flags=0):
+        re.compile(pattern, flags)
+        self.pattern = pattern
+        self.flags = flags
+
+    def first(self, text):
+        """Group 1 (or the whole match) of the first match, or None."""
+        return _evaluate(self.pattern, self.flags, 'first', text)
+
+    def all(self, text):
+        """Group 1 (or the whole match) of every match."""
+        return _evaluate(self.pattern, self.flags, 'all', text)
+
+    def test(self, text):
+        return _evaluate(self.pattern, self.flags, 'test', text)
+
+
+class _RegexWorker:
+    """
+    One regex_worker.py child process. A reader thread moves its results
+    into a queue so waiting for one can time out on any platform.
+    """
+    def __init__(self):
+        self.process = subprocess.Popen([_worker_python(), _WORKER_SCRIPT], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.results = queue.Queue()
+        threading.Thread(target=self._read, daemon=True).start()
+        try:
+            self.results.get(timeout=WORKER_START_TIMEOUT)
+        except queue.Empty:
+            self.kill()
+            raise RuntimeError('regex worker did not start')
+
+    def _read(self):
+        stdout = self.process.stdout
+        while True:
+            try:
+                self.results.put(pickle.load(stdout))
+            except (EOFError, OSError, ValueError, pickle.UnpicklingError):
+                # ValueError: stdout was closed by kill()
+                break
+
+    def send(self, job):
+        pickle.dump(job, self.process.stdin)
+        self.process.stdin.flush()
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+        for f in (self.process.stdin, self.process.stdout):
+            try:
+                f.close()
+            except OSError:
+                pass
+
+
+# Idle workers; each evaluation checks one out, and a worker that runs over
+# budget is killed, not reused. A slot is held while a worker is checked
+# out, so at most REGEX_MAX_WORKERS processes exist.
+_idle_workers = []
+_workers_lock = threading.Lock()
+_worker_slots = threading.BoundedSemaphore(REGEX_MAX_WORKERS)
+_python = None
+
+
+def configure_workers(python=None, max_workers=None):
+    """
+    Sets the interpreter regex workers are started with (default: this
+    one, see _worker_python) and how many may run at once. Called from
+    the app setup with REGEX_WORKER_PYTHON / REGEX_MAX_WORKERS.
+    """
+    global _python, _worker_slots, REGEX_MAX_WORKERS
+    _python = python or None
+    if max_workers and max_workers != REGEX_MAX_WORKERS:
+        shutdown_workers()
+        REGEX_MAX_WORKERS = max_workers
+        _worker_slots = threading.BoundedSemaphore(max_workers)
+
+
+def _worker_python():
+    if _python:
+        return _python
+    if os.path.basename(sys.executable or '').lower().startswith(('python', 'pypy')):
+        return sys.executable
+    # Embedded interpreters (uwsgi, mod_wsgi) report their server binary as
+    # sys.executable: look for the interpreter of the same installation
+    version = f'python{sys.version_info[0]}.{sys.version_info[1]}'
+    for name in (version, f'python{sys.version_info[0]}', 'python'):
+        for folder in ('bin', 'Scripts', ''):
+            path = os.path.join(sys.exec_prefix, folder, name + ('.exe' if os.name == 'nt' else ''))
+            if os.path.isfile(path):
+                return path
+    raise RuntimeError('no Python interpreter found for regex workers; set REGEX_WORKER_PYTHON')
+
+
+def _evaluate(pattern, flags, op, text):
+    slots = _worker_slots
+    with slots:
+        with _workers_lock:
+            worker = _idle_workers.pop() if _idle_workers else None
+        if worker is None:
+            worker = _RegexWorker()
+        try:
+            worker.send((pattern, flags, op, text))
+            try:
+                ok, value = worker.results.get(timeout=REGEX_TIME_BUDGET)
+            except queue.Empty:
+                raise RegexTimeout(f'pattern {pattern!r} exceeded {REGEX_TIME_BUDGET}s') from None
+        except BaseException:
+            worker.kill()
+            raise
+        with _workers_lock:
+            _idle_workers.append(worker)
+    if not ok:
+        logging.debug('regex worker error for %r: %s', pattern, value)
+        return None if op != 'all' else []
+    return value
+
+
+def shutdown_workers():
+    """Stops the idle workers; registered with atexit."""
+    with _workers_lock:
+        workers = _idle_workers[:]
+        del _idle_workers[:]
+    for worker in workers:
+        worker.kill()
+
+
+atexit.register(shutdown_workers)
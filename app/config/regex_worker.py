@@ -0,0 +1,45 @@
+"""
+Regex evaluation worker for regex_guard. Started as a plain script
+(python regex_worker.py) so the child imports nothing but the standard
+library: it reads pickled (pattern, flags, op, text) jobs on stdin and
+writes pickled (ok, value) results on stdout.
+"""
+import pickle
+import re
+import sys
+
+
+def match_value(m):
+    if m is None:
+        return None
+    return m.group(1) if m.lastindex else m.group(0)
+
+
+def run_job(pattern, flags, op, text):
+    compiled = re.compile(pattern, flags)
+    if op == 'first':
+        return match_value(compiled.search(text))
+    if op == 'all':
+        return [match_value(m) for m in compiled.finditer(text)]
+    return compiled.search(text) is not None
+
+
+def main():
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    pickle.dump('ready', stdout)
+    stdout.flush()
+    while True:
+        try:
+            job = pickle.load(stdin)
+        except EOFError:
+            break
+        try:
+            result = (True, run_job(*job))
+        except Exception as e:
+            result = (False, repr(e))
+        pickle.dump(result, stdout)
+        stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
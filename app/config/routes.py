@@ -2,24 +2,35 @@ from flask import render_template, redirect, url_for, flash, request, abort, g,
 from flask_login import login_required, current_user
 from . import config
 from ..models import Configuration, FileType, AuditLog, Workflow, ConverterConfig, WorkflowAuditLog
-from .. import db
+from .. import db, csrf
 # from .forms import ConverterConfigForm  # forms.py has been deleted
 import json
-from jsonschema import validate as jsonschema_validate, ValidationError as JsonSchemaValidationError
 from werkzeug.utils import secure_filename
 import os
 import tempfile
+import shutil
 import re
 import logging
 from flask import Blueprint
 import difflib
 from markupsafe import Markup
 import csv
-from flask import Response
+from flask import Response, stream_with_context
 import io
 from lxml import etree
 from app.testcases import permission_required
 from datetime import datetime
+from .mt import extract_mt_fields, iter_mt_fields, get_mt_rule_plan, extract_generic_text_fields, decode_swift
+from .mx import extract_xml_fields, extract_xml_with_xpaths, iter_xml_records, iter_xml_row_batches, get_xml_rule_plan, extract_xml_fields_batch, extract_xml_with_xpaths_batch
+from .corpus import SIDECAR_SUFFIX, load_message_index, read_message
+from .batch import iter_batch_sources, stream_batch_zip
+from .conversion import get_conversion_plan, get_template_registry, invalidate_conversion_plans
+from .regex_guard import check_rule_patterns, configure_workers
+from .profiling import PROFILE_MAX_MESSAGES, profile_corpus
+from .preview import load_sample, cached_sample, preview_rules
+from .validation import get_schema_validator, invalidate_schema_validators
+from .xsd import OUTPUT_CHECK_PASSED, XMLOutputCheck, xsd_filename, xsd_paths, compile_uploaded_xsd
+from .mt_format import MTOutputCheck, compile_format, formats_path, get_mt_format_validator
 
 def admin_required(f):
     from functools import wraps
@@ -54,6 +65,14 @@ def add_configuration():
             except json.JSONDecodeError:
                 flash('Rules must be valid JSON.')
                 return render_template('config_form.html', form=form, action='Add')
+            # Reject regexes that can backtrack catastrophically
+            regex_errors, regex_warnings = check_rule_patterns(rules_data)
+            if regex_errors:
+                for e in regex_errors:
+                    flash(e)
+                return render_template('config_form.html', form=form, action='Add')
+            for w in regex_warnings:
+                flash(w)
         if schema_data:
             try:
                 json.loads(schema_data)
@@ -108,6 +127,14 @@ def edit_configuration(config_id):
             except json.JSONDecodeError:
                 flash('Rules must be valid JSON.')
                 return render_template('config_form.html', form=form, action='Edit')
+            # Reject regexes that can backtrack catastrophically
+            regex_errors, regex_warnings = check_rule_patterns(rules_data)
+            if regex_errors:
+                for e in regex_errors:
+                    flash(e)
+                return render_template('config_form.html', form=form, action='Edit')
+            for w in regex_warnings:
+                flash(w)
         if schema_data:
             try:
                 json.loads(schema_data)
@@ -127,6 +154,7 @@ def edit_configuration(config_id):
         config_obj.rules = rules_data
         config_obj.schema = schema_data
         db.session.commit()
+        invalidate_schema_validators(('config', config_obj.id))
         # Audit log for edit (store pretty-printed rules and schema)
         rules_pretty = json.dumps(json.loads(rules_data), indent=2, sort_keys=True) if rules_data else ''
         schema_pretty = json.dumps(json.loads(schema_data), indent=2, sort_keys=True) if schema_data else ''
@@ -148,6 +176,7 @@ def delete_configuration(config_id):
     config_obj = Configuration.query.get_or_404(config_id)
     db.session.delete(config_obj)
     db.session.commit()
+    invalidate_schema_validators(('config', config_id))
     # Audit log for delete
     db.session.add(AuditLog(
         user=current_user.username,
@@ -173,20 +202,14 @@ def test_extraction(config_id):
             flash('Please upload a file to test.')
             return redirect(request.url)
         filename = secure_filename(file.filename)
-        temp_dir = tempfile.mkdtemp()
-        file_path = os.path.join(temp_dir, filename)
-        file.save(file_path)
         try:
             schema_type = request.form.get('schema_type', 'json').lower()
             # Determine file type and extraction logic
-            if schema_type == 'text' or config_obj.file_type.lower().startswith('mt'):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                extracted = extract_mt_fields(content, config_obj.rules)
-            elif schema_type == 'xml' or config_obj.file_type.lower().endswith('.xml') or config_obj.file_type.lower().startswith('pacs') or config_obj.file_type.lower().startswith('pain') or filename.lower().endswith('.xml'):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                extracted = extract_xml_fields(content, config_obj.rules)
+            kind = config_sample_kind(config_obj, schema_type, filename)
+            if kind:
+                # Parsed samples are cached per session, so resubmitting the same file skips the parse
+                sample = load_sample(file.read(), kind)
+                extracted, _ = preview_rules(sample, config_obj.rules, kind)
             else:
                 error = 'Unsupported file type for extraction.'
             # Debug log for extracted output
@@ -194,348 +217,73 @@ def test_extraction(config_id):
             # Custom check for required fields (must not be None, empty string, empty list, or empty dict)
             if extracted and config_obj.schema:
                 try:
-                    schema_json = json.loads(config_obj.schema)
-                    required_fields = schema_json.get('required', [])
-                    missing = [f for f in required_fields if extracted.get(f) in (None, '', [], {})]
+                    validator = get_schema_validator(config_obj.schema, ('config', config_obj.id))
+                    missing = validator.missing(extracted)
                     if missing:
                         validation_result = f"Invalid: Required field(s) missing or empty: {', '.join(missing)}"
                         extracted = None  # Do not show extracted output
                     else:
-                        jsonschema_validate(instance=extracted, schema=schema_json)
-                        validation_result = 'Valid! Extracted data matches the schema.'
-                except JsonSchemaValidationError as ve:
-                    validation_result = f'Invalid: {ve.message}'
+                        schema_error = validator.first_error(extracted)
+                        if schema_error is None:
+                            validation_result = 'Valid! Extracted data matches the schema.'
+                        else:
+                            validation_result = f'Invalid: {schema_error.message}'
                 except Exception as e:
                     validation_result = f'Error in validation: {e}'
         except Exception as e:
             error = str(e)
-        finally:
-            os.remove(file_path)
-            os.rmdir(temp_dir)
     return render_template('test_extraction.html', config=config_obj, extracted=extracted, validation_result=validation_result, error=error)
 
-def apply_condition(extracted_value, condition, cond_value):
-    if extracted_value is None:
-        return None
-    if condition == 'contains':
-        return extracted_value if cond_value in extracted_value else None
-    elif condition == 'equals':
-        return extracted_value if extracted_value == cond_value else None
-    elif condition == 'not_equals':
-        return extracted_value if extracted_value != cond_value else None
-    elif condition == 'starts_with':
-        return extracted_value if extracted_value.startswith(cond_value) else None
-    elif condition == 'ends_with':
-        return extracted_value if extracted_value.endswith(cond_value) else None
-    elif condition == 'regex':
-        import re
-        return extracted_value if re.search(cond_value, extracted_value) else None
-    return extracted_value
-
-def parse_swift_tags(content):
-    """
-    Returns a dict: {tag: [list of values for that tag]}
-    Handles edge cases per SWIFT rules.
-    """
-    import re
-    tag_dict = {}
-    current_tag = None
-    current_value_lines = []
-    # Normalize line endings and handle end-of-block
-    lines = content.replace('\r\n', '\n').replace('\r', '\n').split('\n')
-    for line in lines:
-        # End of block marker
-        if line.strip() == '-}':
-            break
-        # Tag detection (allow for leading whitespace, case-insensitive)
-        tag_match = re.match(r'^\s*(:[0-9A-Za-z]{2,3}:)', line)
-        if tag_match:
-            # Save previous tag's value
-            if current_tag is not None:
-                if current_tag not in tag_dict:
-                    tag_dict[current_tag] = []
-                tag_dict[current_tag].append('\n'.join(current_value_lines).rstrip('\n'))
-            # Start new tag
-            current_tag = tag_match.group(1)
-            value = line[line.find(current_tag) + len(current_tag):]
-            current_value_lines = [value] if value.strip() or value == '' else []
-        elif current_tag is not None:
-            # Continuation line: preserve leading spaces
-            if line.strip() != '' or (line == '' and current_value_lines):
-                current_value_lines.append(line)
-    # Save last tag
-    if current_tag is not None:
-        if current_tag not in tag_dict:
-            tag_dict[current_tag] = []
-        tag_dict[current_tag].append('\n'.join(current_value_lines).rstrip('\n'))
-    return tag_dict
-
-def parse_remittance_lines(lines):
-    """
-    Given a list of remittance lines, returns a list of dicts with key-value pairs.
-    Handles /KEY/VALUE, /KEY, and value-only segments (assigns to previous key).
-    """
-    parsed = []
-    for line in lines:
-        d = {}
-        last_key = None
-        # Split by '///' or '//' (SWIFT can use both)
-        segments = re.split(r'/+', line)
-        segments = [seg for seg in segments if seg]  # Remove empty
-        i = 0
-        while i < len(segments):
-            key = segments[i]
-            if i + 1 < len(segments):
-                value = segments[i + 1]
-                d[key] = value
-                last_key = key
-                i += 2
-            else:
-                # If only a key left, treat as key with None value
-                d[key] = None
-                i += 1
-        if d:
-            parsed.append(d)
-    return parsed
-
-def process_account_lines(lines):
+def config_sample_kind(config_obj, schema_type, filename):
+    """'mt' or 'xml' extraction for a Configuration sample, None if unsupported."""
+    file_type = config_obj.file_type.lower()
+    if schema_type == 'text' or file_type.startswith('mt'):
+        return 'mt'
+    if schema_type == 'xml' or file_type.endswith('.xml') or file_type.startswith('pacs') or file_type.startswith('pain') or filename.lower().endswith('.xml'):
+        return 'xml'
+    return None
+
+def preview_response(kind, mode, rules_json):
     """
-    For :50K: and :59: fields, extract the account number from the first line if it starts with a slash.
-    Return a dict: {'account_number': ..., 'lines': [...]}.
+    JSON preview of rules_json against the uploaded sample_file, or against
+    the sample cached under the 'sample' key returned by an earlier call.
     """
-    if not lines or not isinstance(lines, list):
-        return None
-    account_number = None
-    rest_lines = lines[:]
-    if lines and lines[0].startswith('/'):
-        account_number = lines[0][1:]
-        rest_lines = lines[1:]
-    return {'account_number': account_number, 'lines': rest_lines}
-
-def extract_mt_fields(content, rules_json):
-    print('DEBUG: rules_json =', rules_json)
-    import json
-    import re
-    try:
-        rules = json.loads(rules_json)
-    except Exception:
-        return None
-    result = {}
-
-    # Extract blocks like {1:...}, {2:...}, etc.
-    block_pattern = re.compile(r'\{(\d+):(.*?)\}', re.DOTALL)
-    blocks = {m.group(1): m.group(2).strip() for m in block_pattern.finditer(content)}
-
-    # Robust tag extraction
-    tag_blocks = parse_swift_tags(content)
-
-    for field, rule in rules.items():
-        # Support object rule or string rule
-        if isinstance(rule, dict):
-            path = rule.get('path')
-            condition = rule.get('condition')
-            cond_value = rule.get('value')
-            multiple = rule.get('multiple', False)
-            block_num = rule.get('block')
-            postprocess = rule.get('postprocess')
-        else:
-            path = rule
-            condition = None
-            cond_value = None
-            multiple = False
-            block_num = None
-            postprocess = None
-        value = None
-        # Block extraction
-        if block_num is not None:
-            value = blocks.get(str(block_num), None)
-        # Regex extraction
-        elif isinstance(path, str) and path.startswith('regex:'):
-            pattern = path[len('regex:'):].strip()
-            matches = list(re.finditer(pattern, content, re.MULTILINE | re.DOTALL))
-            if multiple:
-                value = [m.group(1).strip() if m.lastindex else (m.group(0).strip() if m else None) for m in matches]
-            else:
-                m = matches[0] if matches else None
-                value = m.group(1).strip() if m and m.lastindex else (m.group(0).strip() if m else None)
-        # Tag extraction
-        elif path:
-            tag = path if path.startswith(':') else f':{path}:'
-            tag_values = tag_blocks.get(tag, None)
-            if tag_values:
-                if multiple:
-                    # Flatten all lines from all occurrences
-                    lines = []
-                    for val in tag_values:
-                        lines.extend([l for l in val.split('\n') if l.strip() != ''])
-                    value = lines if lines else None
-                else:
-                    # Use the first occurrence, join lines
-                    value = tag_values[0] if tag_values else None
-            else:
-                value = None
-        # Apply condition if present
-        if condition:
-            if multiple and isinstance(value, list):
-                value = [v for v in value if apply_condition(v, condition, cond_value)]
-            else:
-                value = apply_condition(value, condition, cond_value)
-        # Generic post-processing based on rule['postprocess']
-        if postprocess and value:
-            func = globals().get(f"process_{postprocess}")
-            if callable(func):
-                value = func(value)
-        result[field] = value
-    return result
-
-def extract_xml_fields(content, rules_json):
-    import json
-    import logging
-    import re
-    try:
-        rules = json.loads(rules_json)
-    except Exception:
-        return None
-    result = {}
+    file = request.files.get('sample_file')
+    if file and file.filename:
+        sample = load_sample(file.read(), kind)
+    else:
+        sample = cached_sample(request.form.get('sample', ''), kind)
+        if sample is None:
+            return jsonify({'error': 'The sample is no longer cached; please upload it again.'}), 404
     try:
-        from lxml import etree
-        parser = etree.XMLParser(recover=True)
-        # Remove XML declaration if present
-        content_no_decl = re.sub(r'<\?xml[^>]*\?>', '', content).strip()
-        # Parse as fragments: wrap in a dummy root
-        wrapped_content = f'<Root>{content_no_decl}</Root>'
-        root = etree.fromstring(wrapped_content.encode('utf-8'), parser=parser)
-        nsmap = {}
-        apphdr_elem = None
-        doc_elem = None
-        def get_default_ns_uri(elem):
-            return elem.nsmap.get(None)
-        # Debug: print tag and nsmap for every element
-        for elem in root.iter():
-            logging.debug(f"ELEMENT tag: {elem.tag}, nsmap: {elem.nsmap}")
-        # Find AppHdr and Document elements and their namespaces robustly
-        for elem in root.iter():
-            tag_local = etree.QName(elem).localname
-            if tag_local == 'AppHdr' and 'app' not in nsmap:
-                ns_uri = get_default_ns_uri(elem)
-                if ns_uri:
-                    nsmap['app'] = ns_uri
-                    apphdr_elem = elem
-            elif tag_local == 'Document' and 'def' not in nsmap:
-                ns_uri = get_default_ns_uri(elem)
-                if ns_uri:
-                    nsmap['def'] = ns_uri
-                    doc_elem = elem
-            if 'app' in nsmap and 'def' in nsmap:
-                break
-        # Fallback: if still not found, search for any AppHdr/Document
-        if apphdr_elem is None or 'app' not in nsmap:
-            for elem in root.iter():
-                if etree.QName(elem).localname == 'AppHdr':
-                    ns_uri = get_default_ns_uri(elem)
-                    if ns_uri:
-                        nsmap['app'] = ns_uri
-                    apphdr_elem = elem
-                    break
-        if doc_elem is None or 'def' not in nsmap:
-            for elem in root.iter():
-                if etree.QName(elem).localname == 'Document':
-                    ns_uri = get_default_ns_uri(elem)
-                    if ns_uri:
-                        nsmap['def'] = ns_uri
-                    doc_elem = elem
-                    break
-        # If still not found, fallback to first found element
-        if apphdr_elem is None:
-            for elem in root.iter():
-                if etree.QName(elem).localname == 'AppHdr':
-                    apphdr_elem = elem
-                    break
-        if doc_elem is None:
-            for elem in root.iter():
-                if etree.QName(elem).localname == 'Document':
-                    doc_elem = elem
-                    break
-        logging.debug(f"extract_xml_fields nsmap: {nsmap}")
-        logging.debug(f"apphdr_elem tag: {getattr(apphdr_elem, 'tag', None)}")
-        logging.debug(f"doc_elem tag: {getattr(doc_elem, 'tag', None)}")
-        def extract_field(rule, context=None):
-            if isinstance(rule, dict):
-                path = rule.get('path')
-                condition = rule.get('condition')
-                cond_value = rule.get('value')
-                multiple = rule.get('multiple', False)
-                fields = rule.get('fields')
-            else:
-                path = rule
-                condition = None
-                cond_value = None
-                multiple = False
-                fields = None
-            value = None
-            if path:
-                xp = path
-                if xp.startswith('/def:Document'):
-                    base = doc_elem
-                    xp = '.' + xp[len('/def:Document'):]
-                elif xp.startswith('/app:AppHdr'):
-                    base = apphdr_elem
-                    xp = '.' + xp[len('/app:AppHdr'):]
-                else:
-                    base = context if context is not None else root
-                logging.debug(f"extract_field: path={xp}, base_tag={getattr(base, 'tag', None)}")
-                try:
-                    found = base.xpath(xp, namespaces=nsmap) if hasattr(base, 'xpath') else []
-                    logging.debug(f"extract_field: found={found}")
-                    if fields:
-                        if multiple:
-                            value = []
-                            for elem in found:
-                                obj = {}
-                                for subfield, subrule in fields.items():
-                                    obj[subfield] = extract_field(subrule, context=elem)
-                                value.append(obj)
-                        else:
-                            elem = found[0] if found else None
-                            if elem is not None:
-                                obj = {}
-                                for subfield, subrule in fields.items():
-                                    obj[subfield] = extract_field(subrule, context=elem)
-                                value = obj
-                            else:
-                                value = None
-                    else:
-                        if multiple:
-                            value = []
-                            for elem in found:
-                                if isinstance(elem, etree._Element):
-                                    v = elem.text
-                                else:
-                                    v = str(elem)
-                                if condition:
-                                    v = apply_condition(v, condition, cond_value)
-                                value.append(v)
-                            value = [v for v in value if v is not None]
-                        else:
-                            elem = found[0] if found else None
-                            if isinstance(elem, etree._Element):
-                                value = elem.text
-                            elif elem is not None:
-                                value = str(elem)
-                            else:
-                                value = None
-                            if condition:
-                                value = apply_condition(value, condition, cond_value)
-                except Exception as e:
-                    logging.debug(f"extract_field: Exception {e}")
-                    value = None
-            return value
-        for field, rule in rules.items():
-            result[field] = extract_field(rule)
-    except Exception as e:
-        logging.debug(f"extract_xml_fields: Exception {e}")
-        return None
-    return result
+        extracted, evaluated = preview_rules(sample, rules_json, mode)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid rules JSON: {e}'}), 400
+    return jsonify({'sample': sample.key, 'extracted': extracted, 'evaluated': evaluated, 'error': sample.error})
+
+@config.route('/config/preview/<int:config_id>', methods=['POST'])
+@login_required
+@permission_required('config_manage')
+def preview_configuration(config_id):
+    """Live preview while editing: only rules changed since the last preview are re-run."""
+    config_obj = Configuration.query.get_or_404(config_id)
+    file = request.files.get('sample_file')
+    kind = config_sample_kind(config_obj, request.form.get('schema_type', 'json').lower(), file.filename if file else '')
+    if not kind:
+        return jsonify({'error': 'Unsupported file type for extraction.'}), 400
+    return preview_response(kind, kind, request.form.get('rules') or config_obj.rules)
+
+@config.route('/config/profile/<int:config_id>', methods=['GET', 'POST'])
+@login_required
+@permission_required('config_manage')
+def profile_configuration(config_id):
+    config_obj = Configuration.query.get_or_404(config_id)
+    is_mt = config_obj.file_type.lower().startswith('mt')
+    if is_mt:
+        extract = lambda data, profile: extract_mt_fields(data, config_obj.rules, profile=profile)
+    else:
+        extract = lambda data, profile: extract_xml_fields(data, config_obj.rules, profile=profile)
+    return render_rule_profile('Configuration', config_obj.name, not is_mt, extract, url_for('config.configuration'))
 
 @config.route('/config/auditlog/<int:config_id>')
 @login_required
@@ -619,6 +367,104 @@ def export_config_auditlog(config_id):
         return output.getvalue()
     return Response(generate(), mimetype='text/csv', headers={'Content-Disposition': 'attachment;filename=auditlog.csv'})
 
+def xml_batch_workers():
+    """Threads for multi-file XML extraction; XML_BATCH_WORKERS in the app config overrides the default."""
+    return current_app.config.get('XML_BATCH_WORKERS')
+
+@config.route('/config/extract/<int:config_id>', methods=['POST'])
+@login_required
+@permission_required('config_manage')
+def extract_configuration_batch(config_id):
+    """
+    Runs the Configuration rules over every uploaded file; JSON list in
+    upload order. An MX file gives one entry; an MT file is streamed
+    message by message (iter_mt_fields) and gives one entry per message.
+    """
+    config_obj = Configuration.query.get_or_404(config_id)
+    files = [f for f in request.files.getlist('sample_file') if f and f.filename]
+    if not files:
+        return jsonify({'error': 'Please upload at least one file.'}), 400
+    kind = config_sample_kind(config_obj, 'json', files[0].filename)
+    if kind == 'xml':
+        results = extract_xml_fields_batch([f.stream for f in files], config_obj.rules, workers=xml_batch_workers())
+        return jsonify([{'file': f.filename, 'extracted': extracted} for f, extracted in zip(files, results)])
+    if kind != 'mt':
+        return jsonify({'error': 'Batch extraction is only available for MT and XML configurations.'}), 400
+    if get_mt_rule_plan(config_obj.rules) is None:
+        return jsonify({'error': 'Rules must be valid JSON.'}), 400
+    return jsonify([{'file': f.filename, 'message': n, 'extracted': extracted}
+                    for f in files for n, extracted in enumerate(iter_mt_fields(f.stream, config_obj.rules), 1)])
+
+@config.route('/config/validate/<int:config_id>', methods=['POST'])
+@login_required
+@permission_required('config_manage')
+def validate_configuration_batch(config_id):
+    """
+    Validates many records against the Configuration schema and reports
+    every error of every record. Takes a JSON body {"records": [...]} or
+    sample_file uploads, which are extracted first (one record per message
+    of an MT batch file).
+    """
+    config_obj = Configuration.query.get_or_404(config_id)
+    if not config_obj.schema:
+        return jsonify({'error': 'This configuration has no schema.'}), 400
+    if request.is_json:
+        records = (request.get_json(silent=True) or {}).get('records')
+        if not isinstance(records, list):
+            return jsonify({'error': 'Expected a JSON body {"records": [...]}.'}), 400
+        names = [None] * len(records)
+    else:
+        files = [f for f in request.files.getlist('sample_file') if f and f.filename]
+        if not files:
+            return jsonify({'error': 'Please upload at least one file or post records as JSON.'}), 400
+        if config_sample_kind(config_obj, 'json', files[0].filename) == 'xml':
+            records = extract_xml_fields_batch([f.stream for f in files], config_obj.rules, workers=xml_batch_workers())
+            names = [f.filename for f in files]
+        else:
+            records, names = [], []
+            for f in files:
+                extracted = list(iter_mt_fields(f.stream, config_obj.rules)) or [None]
+                records.extend(extracted)
+                names.extend([f.filename] if len(extracted) == 1 else [f'{f.filename} #{n}' for n in range(1, len(extracted) + 1)])
+    try:
+        validator = get_schema_validator(config_obj.schema, ('config', config_obj.id))
+    except Exception as e:
+        return jsonify({'error': f'Invalid schema: {e}'}), 400
+    results = []
+    for name, record in zip(names, records):
+        errors = validator.errors(record) if record is not None else ['Extraction failed.']
+        results.append({'file': name, 'valid': not errors, 'errors': errors})
+    return jsonify({'valid': sum(1 for r in results if r['valid']), 'invalid': sum(1 for r in results if not r['valid']), 'results': results})
+
+@config.route('/config/rows/<int:config_id>', methods=['POST'])
+@login_required
+@permission_required('config_manage')
+def export_configuration_rows(config_id):
+    """CSV with one row per transaction of the uploaded MX file(s), header fields repeated on each row."""
+    config_obj = Configuration.query.get_or_404(config_id)
+    files = [f for f in request.files.getlist('sample_file') if f and f.filename]
+    if not files:
+        flash('Please upload a file to export.')
+        return redirect(url_for('config.test_extraction', config_id=config_id))
+    group = request.form.get('group') or None
+    try:
+        columns = get_xml_rule_plan(config_obj.rules).row_layout(group)[0]
+    except Exception:
+        flash('Rules must be valid JSON.')
+        return redirect(url_for('config.test_extraction', config_id=config_id))
+    def generate():
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        for batch in iter_xml_row_batches((f.stream for f in files), config_obj.rules, group=group, workers=xml_batch_workers()):
+            for row in batch.rows:
+                writer.writerow(['; '.join(v or '' for v in value) if isinstance(value, list) else value for value in row])
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+        yield output.getvalue()
+    return Response(stream_with_context(generate()), mimetype='text/csv', headers={'Content-Disposition': f'attachment;filename={secure_filename(config_obj.name) or "rows"}.csv'})
+
 @config.app_errorhandler(403)
 def forbidden(e):
     g.error_403 = 'You do not have permission to access this page. Only admins are allowed.'
@@ -640,11 +486,20 @@ def list_filetypes():
     from flask import current_app, url_for
     # Annotate each filetype with usage_count and template status
     TEMPLATE_DIR = os.path.join(current_app.root_path, 'templates', 'filetypes')
+    templates = template_registry()
     for ft in filetypes:
         ft.usage_count = Configuration.query.filter_by(file_type=ft.name).count()
-        ft.has_txt_template = os.path.exists(os.path.join(TEMPLATE_DIR, f'{ft.name}.txt.j2'))
-        ft.has_xml_template = os.path.exists(os.path.join(TEMPLATE_DIR, f'{ft.name}.xml.j2'))
+        ft.has_txt_template = templates.get(ft.name, 'txt') is not None
+        ft.has_xml_template = templates.get(ft.name, 'xml') is not None
         ft.has_template = ft.has_txt_template or ft.has_xml_template
+        ft.xsd_files = [os.path.basename(p) for p in xsd_paths(xsd_dir(), ft.name)]
+        ft.field_formats = ''
+        if ft.file_mode != 'xml':
+            try:
+                validator = get_mt_format_validator(TEMPLATE_DIR, ft.name)
+            except (OSError, ValueError):
+                validator = None
+            ft.field_formats = json.dumps(validator.formats, indent=2) if validator else ''
     return render_template('filetypes.html', filetypes=filetypes, errors=[], search=search)
 
 @filetypes.route('/filetypes/add', methods=['GET', 'POST'])
@@ -665,6 +520,9 @@ def add_filetype():
             errors.append('Description must be at most 255 characters.')
         if FileType.query.filter_by(name=name).first():
             errors.append('File type already exists.')
+        # Reject regexes that can backtrack catastrophically
+        regex_errors, regex_warnings = check_rule_patterns(extraction_rules)
+        errors.extend(regex_errors)
         if errors:
             for e in errors:
                 flash(e)
@@ -675,6 +533,8 @@ def add_filetype():
         # Audit log
         db.session.add(AuditLog(user=current_user.username, action='add', filetype=name, details=f'Added file type: {name}'))
         db.session.commit()
+        for w in regex_warnings:
+            flash(w)
         flash('File type added successfully!')
         return redirect(url_for('filetypes.list_filetypes'))
     return render_template('filetype_form.html', errors=errors)
@@ -716,6 +576,9 @@ def edit_filetype(filetype_id):
             errors.append('Description must be at most 255 characters.')
         if FileType.query.filter(FileType.name == name, FileType.id != filetype_id).first():
             errors.append('Another file type with this name already exists.')
+        # Reject regexes that can backtrack catastrophically
+        regex_errors, regex_warnings = check_rule_patterns(extraction_rules)
+        errors.extend(regex_errors)
         if errors:
             for e in errors:
                 flash(e)
@@ -730,10 +593,177 @@ def edit_filetype(filetype_id):
         # Audit log
         db.session.add(AuditLog(user=current_user.username, action='edit', filetype=name, details=f'Edited file type: {old_name} -> {name}, {old_desc} -> {description}'))
         db.session.commit()
+        for w in regex_warnings:
+            flash(w)
         flash('File type updated successfully!')
         return redirect(url_for('filetypes.list_filetypes'))
     return render_template('filetype_form.html', filetype=ft, errors=errors)
 
+@filetypes.route('/filetypes/profile/<int:filetype_id>', methods=['GET', 'POST'])
+@login_required
+@permission_required('filetype_manage')
+def profile_filetype(filetype_id):
+    ft = FileType.query.get_or_404(filetype_id)
+    rules = ft.extraction_rules or '{}'
+    is_xml = ft.file_mode == 'xml'
+    if is_xml:
+        extract = lambda data, profile: extract_xml_with_xpaths(data, rules, profile=profile)
+    else:
+        extract = lambda data, profile: extract_mt_fields(data, rules, profile=profile)
+    return render_rule_profile('File Type', ft.name, is_xml, extract, url_for('filetypes.list_filetypes'))
+
+@filetypes.route('/filetypes/preview', methods=['POST'])
+@login_required
+@permission_required('filetype_manage')
+def preview_filetype():
+    """Live preview of the extraction mapping being edited on the file type form."""
+    if request.form.get('file_mode', 'xml') == 'xml':
+        return preview_response('xml', 'xpath', request.form.get('extraction_rules', '{}'))
+    return preview_response('mt', 'mt', request.form.get('extraction_rules', '{}'))
+
+def xsd_dir():
+    """Where uploaded XSDs live, named <file type>.<message definition>.xsd."""
+    return os.path.join(current_app.root_path, 'templates', 'filetypes', 'xsd')
+
+class OutputChecker:
+    """
+    Structural check of a rendered output fed in chunks: XSD for XML
+    targets, SWIFT field formats for MT text. result() adds the kind of
+    check to the XMLOutputCheck / MTOutputCheck result.
+    """
+    def __init__(self, target_type, ext):
+        if ext == 'xml':
+            self.check, self.checker = 'XSD', XMLOutputCheck(xsd_dir(), target_type)
+        else:
+            formats_dir = os.path.join(current_app.root_path, 'templates', 'filetypes')
+            self.check, self.checker = 'Field format', MTOutputCheck(formats_dir, target_type)
+
+    def feed(self, chunk):
+        self.checker.feed(chunk)
+
+    def result(self):
+        return dict(self.checker.result(), check=self.check)
+
+def check_output(output, target_type, ext):
+    """Structural check of a whole rendered output (see OutputChecker)."""
+    checker = OutputChecker(target_type, ext)
+    checker.feed(output)
+    return checker.result()
+
+@filetypes.route('/filetypes/<int:filetype_id>/formats', methods=['POST'])
+@login_required
+@permission_required('filetype_manage')
+def save_field_formats(filetype_id):
+    """Registers {tag: SWIFT format spec} for an MT file type; an empty mapping restores the built-in formats."""
+    ft = FileType.query.get_or_404(filetype_id)
+    path = formats_path(os.path.join(current_app.root_path, 'templates', 'filetypes'), ft.name)
+    if not path:
+        flash(f'Cannot store field formats for {ft.name}: the name has no characters usable in a file name.')
+        return redirect(url_for('filetypes.list_filetypes'))
+    try:
+        formats = json.loads(request.form.get('field_formats') or '{}')
+        if not isinstance(formats, dict):
+            raise ValueError('expected a JSON object of tag: format')
+        for tag, spec in formats.items():
+            compile_format(spec)
+    except (ValueError, TypeError) as e:
+        flash(f'Invalid field formats: {e}')
+        return redirect(url_for('filetypes.list_filetypes'))
+    if formats:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(formats, f, indent=2)
+    elif os.path.exists(path):
+        os.remove(path)
+    template_registry().refresh()
+    db.session.add(AuditLog(user=current_user.username, action='edit_formats', filetype=ft.name, details=f'Field formats: {json.dumps(formats)}'))
+    db.session.commit()
+    flash('Field formats saved.' if formats else 'Field formats reset to the built-in defaults.')
+    return redirect(url_for('filetypes.list_filetypes'))
+
+@filetypes.route('/filetypes/<int:filetype_id>/xsd', methods=['POST'])
+@login_required
+@permission_required('filetype_manage')
+def upload_xsd(filetype_id):
+    """Stores XSDs used to validate generated outputs of this file type; one per target namespace."""
+    ft = FileType.query.get_or_404(filetype_id)
+    files = [f for f in request.files.getlist('xsd_file') if f and f.filename]
+    if not files:
+        flash('Please select an XSD file.')
+        return redirect(url_for('filetypes.list_filetypes'))
+    if not xsd_filename(ft.name, 'xsd'):
+        flash(f'Cannot store XSDs for {ft.name}: the name has no characters usable in a file name.')
+        return redirect(url_for('filetypes.list_filetypes'))
+    schema_dir = xsd_dir()
+    os.makedirs(schema_dir, exist_ok=True)
+    saved = []
+    for file in files:
+        data = file.read()
+        try:
+            namespace = compile_uploaded_xsd(data, os.path.join(schema_dir, secure_filename(file.filename)))
+        except Exception as e:
+            flash(f'{file.filename} is not a valid XSD: {e}')
+            continue
+        # e.g. urn:iso:std:iso:20022:tech:xsd:pacs.008.001.08 -> pacs.008.001.08
+        part = secure_filename(namespace.rsplit(':', 1)[-1]) or secure_filename(file.filename.rsplit('.', 1)[0]) or 'schema'
+        filename = xsd_filename(ft.name, part)
+        with open(os.path.join(schema_dir, filename), 'wb') as f:
+            f.write(data)
+        saved.append(filename)
+    get_template_registry(schema_dir).refresh()
+    if saved:
+        db.session.add(AuditLog(user=current_user.username, action='upload_xsd', filetype=ft.name, details=f"Uploaded XSD: {', '.join(saved)}"))
+        db.session.commit()
+        flash(f"XSD uploaded: {', '.join(saved)}")
+    return redirect(url_for('filetypes.list_filetypes'))
+
+@filetypes.route('/filetypes/<int:filetype_id>/xsd/delete', methods=['POST'])
+@login_required
+@permission_required('filetype_manage')
+def delete_xsd(filetype_id):
+    ft = FileType.query.get_or_404(filetype_id)
+    removed = []
+    for path in xsd_paths(xsd_dir(), ft.name):
+        os.remove(path)
+        removed.append(os.path.basename(path))
+    get_template_registry(xsd_dir()).refresh()
+    if removed:
+        db.session.add(AuditLog(user=current_user.username, action='delete_xsd', filetype=ft.name, details=f"Removed XSD: {', '.join(removed)}"))
+        db.session.commit()
+    flash('XSD validation disabled for this file type.' if removed else 'No XSD to remove.')
+    return redirect(url_for('filetypes.list_filetypes'))
+
+@filetypes.route('/filetypes/<int:filetype_id>/extract', methods=['POST'])
+@login_required
+@permission_required('filetype_manage')
+def extract_filetype_batch(filetype_id):
+    """Applies the XML extraction mapping to every uploaded file; JSON list in upload order."""
+    ft = FileType.query.get_or_404(filetype_id)
+    files = [f for f in request.files.getlist('source_file') if f and f.filename]
+    if not files:
+        return jsonify({'error': 'Please upload at least one file.'}), 400
+    if ft.file_mode != 'xml':
+        return jsonify({'error': 'Batch extraction is only available for XML file types.'}), 400
+    results = extract_xml_with_xpaths_batch([f.stream for f in files], ft.extraction_rules or '{}', workers=xml_batch_workers())
+    return jsonify([{'file': f.filename, 'extracted': extracted} for f, extracted in zip(files, results)])
+
+@filetypes.route('/filetypes/<int:filetype_id>/records', methods=['POST'])
+@login_required
+@permission_required('filetype_manage')
+def extract_filetype_records(filetype_id):
+    """Streams one JSON line per transaction of an uploaded bulk pacs.008 / pain.001 file."""
+    ft = FileType.query.get_or_404(filetype_id)
+    file = request.files.get('source_file')
+    if not file or file.filename == '':
+        return jsonify({'error': 'Please upload a file.'}), 400
+    if ft.file_mode != 'xml':
+        return jsonify({'error': 'Record streaming is only available for XML file types.'}), 400
+    rules = ft.extraction_rules or '{}'
+    record_tag = request.form.get('record_tag') or None
+    def generate():
+        for record in iter_xml_records(file.stream, rules, record_tag=record_tag):
+            yield json.dumps(record) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @filetypes.route('/filetypes/toggle/<int:filetype_id>', methods=['POST'])
 @login_required
 @permission_required('filetype_manage')
@@ -796,6 +826,8 @@ def diff_highlight(diff_text):
 
 def init_app(app):
     app.jinja_env.filters['diff_highlight'] = diff_highlight 
+    # Interpreter and pool size for the regex rule workers (see regex_guard)
+    configure_workers(app.config.get('REGEX_WORKER_PYTHON'), app.config.get('REGEX_MAX_WORKERS'))
 
 # --- Backfill script for AuditLog entries ---
 @config.route('/config/backfill_auditlog')
@@ -888,6 +920,7 @@ def edit_converter(config_id):
         config.schema = request.form.get('schema')
         print("Saving rules:", config.rules)
         db.session.commit()
+        invalidate_conversion_plans(converter_id=config.id)
         print("Saved config:", config.rules)
         flash('Converter configuration updated successfully!')
         return redirect(url_for('converters.list_converters'))
@@ -901,6 +934,7 @@ def delete_converter(config_id):
     config = ConverterConfig.query.get_or_404(config_id)
     db.session.delete(config)
     db.session.commit()
+    invalidate_conversion_plans(converter_id=config_id)
     flash('Converter configuration deleted successfully!')
     return redirect(url_for('converters.list_converters'))
 
@@ -1009,7 +1043,7 @@ def execute_workflow(id):
         if request.method == 'POST' and 'initial_input' in request.files:
             file = request.files['initial_input']
             if file and file.filename:
-                content = file.read().decode('utf-8')
+                content = decode_swift(file.read())
                 session[input_key] = content
                 session[session_key] = 0
                 session[files_key] = {}
@@ -1048,64 +1082,18 @@ def execute_workflow(id):
     stage_cfg = converter_configs.get(str(stage_cfg_id))
     expected_output = None
     html_diff = None
+    output_check = None
     actual_content = session[files_key].get(str(stage_idx))
     error = None
     prev_output = session[input_key]
     # Generate expected output for this stage
     if stage_cfg:
-        import re, json
-        template_dir = os.path.join(current_app.root_path, 'templates', 'filetypes')
-        template_content = None
-        for ext in ['xml', 'txt']:
-            template_path = os.path.join(template_dir, f'{stage_cfg.target_type}.{ext}.j2')
-            print(f"[DEBUG] Looking for template: {template_path}")
-            if os.path.exists(template_path):
-                with open(template_path, encoding='utf-8') as f:
-                    template_content = f.read()
-                print(f"[DEBUG] Loaded template: {template_path}")
-                break
-        else:
-            print(f"[DEBUG] No template found for {stage_cfg.target_type}")
-        if template_content:
-            try:
-                mapping_rules = json.loads(stage_cfg.rules)
-            except Exception as e:
-                error = f"Error in mapping: {e}"
-                mapping_rules = {}
-            from ..models import FileType
-            source_filetype = FileType.query.filter_by(name=stage_cfg.source_type).first()
-            extraction_rules = source_filetype.extraction_rules if source_filetype else '{}'
-            print(f"[DEBUG] Stage {stage_idx+1} input for extraction (first 500 chars):\n", prev_output[:500])
-            if source_filetype and source_filetype.file_mode == 'xml':
-                extracted = extract_xml_with_xpaths(prev_output, extraction_rules)
-            else:
-                extracted = extract_generic_text_fields(prev_output, template_content)
-            print(f"[DEBUG] Stage {stage_idx+1} extracted fields:", extracted)
-            mapped_data = {}
-            for tgt_var in re.findall(r'@@(.*?)@@', template_content):
-                map_cfg = mapping_rules.get(tgt_var, {}) if isinstance(mapping_rules.get(tgt_var), dict) else {}
-                value = ''
-                if map_cfg.get('sources') and map_cfg.get('transform'):
-                    sources = map_cfg['sources']
-                    vals = [extracted.get(s, '') for s in sources]
-                    transform_func = globals().get(map_cfg['transform'])
-                    if callable(transform_func):
-                        value = transform_func(vals)
-                    else:
-                        value = ''.join(vals)
-                elif map_cfg.get('source'):
-                    value = extracted.get(map_cfg['source'], map_cfg.get('default', ''))
-                elif 'default' in map_cfg:
-                    value = map_cfg['default']
-                else:
-                    value = ''
-                if value and map_cfg.get('prefix'):
-                    value = f"{map_cfg['prefix']}{value}"
-                mapped_data[tgt_var] = value if value is not None else ''
-            def replace_vars(match):
-                var = match.group(1)
-                return str(mapped_data.get(var, ''))
-            expected_output = re.sub(r'@@(.*?)@@', replace_vars, template_content)
+        print(f"[DEBUG] Stage {stage_idx+1} input for extraction (first 500 chars):\n", prev_output[:500])
+        # Workflow stages apply the mapping without the uppercase/lowercase/date_format value transforms
+        template, plan, expected_output, output_check = convert_source(stage_cfg, prev_output, value_transforms=False)
+        if template:
+            if plan.error:
+                error = plan.error
             print(f"[DEBUG] Stage {stage_idx+1} expected_output (first 500 chars):\n", expected_output[:500])
     # Handle actual file upload and diff
     if request.method == 'POST' and 'actual_file' in request.files and actual_content is None:
@@ -1191,7 +1179,7 @@ def execute_workflow(id):
         print(f"[DEBUG] Passing output to next stage (first 500 chars):\n", expected_output[:500])
         session[input_key] = expected_output
         session.modified = True
-    return render_template('test_workflow_execute.html', workflow=workflow, stages=stages, converter_configs=converter_configs, stage_idx=stage_idx, stage_cfg=stage_cfg, expected_output=expected_output, actual_content=actual_content, html_diff=html_diff, error=error, done=False, failed=False, need_input=False)
+    return render_template('test_workflow_execute.html', workflow=workflow, stages=stages, converter_configs=converter_configs, stage_idx=stage_idx, stage_cfg=stage_cfg, expected_output=expected_output, actual_content=actual_content, html_diff=html_diff, output_check=output_check, error=error, done=False, failed=False, need_input=False)
 
 @converters.route('/test-workflow/<int:id>/audit', methods=['GET'])
 @login_required
@@ -1216,33 +1204,19 @@ def data_generator():
     values = {}
     if selected_type:
         # Get template variables
-        template_dir = os.path.join(current_app.root_path, 'templates', 'filetypes')
-        template_content = None
-        file_ext = None
-        for ext in ['xml', 'txt']:
-            template_path = os.path.join(template_dir, f'{selected_type}.{ext}.j2')
-            if os.path.exists(template_path):
-                with open(template_path, encoding='utf-8') as f:
-                    template_content = f.read()
-                file_ext = ext
-                break
-        if template_content:
-            import re
-            template_vars = re.findall(r'@@(.*?)@@', template_content)
+        template = find_template(selected_type)
+        segments = template.segments if template else None
+        if segments and segments.content:
+            template_vars = segments.placeholders
             if request.method == 'POST':
                 # Collect values for each variable
                 values = {var: request.form.get(var, '') for var in template_vars}
-                # Render template
-                def replace_vars(match):
-                    var = match.group(1)
-                    return str(values.get(var, ''))
-                rendered_output = re.sub(r'@@(.*?)@@', replace_vars, template_content)
-                # Save to temp file and provide download
+                # Render straight into the temp file and provide download
                 temp_dir = tempfile.gettempdir()
-                temp_filename = f'generated_{selected_type}.{file_ext}'
+                temp_filename = f'generated_{selected_type}.{template.ext}'
                 temp_path = os.path.join(temp_dir, temp_filename)
                 with open(temp_path, 'w', encoding='utf-8') as f:
-                    f.write(rendered_output)
+                    segments.write(values, f)
                 download_url = url_for('converters.download_generated', filename=temp_filename)
     return render_template('data_generator.html', filetypes=filetypes, selected_type=selected_type, template_vars=template_vars, values=values, download_url=download_url)
 
@@ -1274,6 +1248,7 @@ def converter_test():
     result = None
     error = None
     download_url = None
+    output_check = None
     selected_id = request.form.get('converter_id')
     if request.method == 'POST' and selected_id:
         converter = ConverterConfig.query.get(int(selected_id))
@@ -1284,158 +1259,102 @@ def converter_test():
             if not file or file.filename == '':
                 error = "Please upload a file."
             else:
-                content = file.read().decode('utf-8')
-                import re, json, os
-                template_dir = os.path.join(current_app.root_path, 'templates', 'filetypes')
-                template_content = None
-                file_ext = None
-                for ext in ['xml', 'txt']:
-                    template_path = os.path.join(template_dir, f'{converter.target_type}.{ext}.j2')
-                    if os.path.exists(template_path):
-                        with open(template_path, encoding='utf-8') as f:
-                            template_content = f.read()
-                        file_ext = ext
-                        break
-                if not template_content:
+                # Raw bytes: the XML parser decodes them itself
+                content = file.read()
+                template, plan, rendered_output, output_check = convert_source(converter, content)
+                if not template:
                     error = "No template found for target type."
                     result = None
                     download_url = None
                 else:
-                    try:
-                        mapping_rules = json.loads(converter.rules)
-                    except Exception as e:
-                        error = f"Error in mapping: {e}"
-                        mapping_rules = {}
-                    # --- Use extraction_rules from source file type for extraction ---
-                    from ..models import FileType
-                    source_filetype = FileType.query.filter_by(name=converter.source_type).first()
-                    extraction_rules = source_filetype.extraction_rules if source_filetype else '{}'
-                    if source_filetype and source_filetype.file_mode == 'xml':
-                        extracted = extract_xml_with_xpaths(content, extraction_rules)
-                    else:
-                        extracted = extract_generic_text_fields(content, template_content)
-                    print('Extracted variables:', extracted)
-                    mapped_data = {}
-                    for tgt_var in re.findall(r'@@(.*?)@@', template_content):
-                        map_cfg = mapping_rules.get(tgt_var, {}) if isinstance(mapping_rules.get(tgt_var), dict) else {}
-                        # --- Enhanced mapping logic ---
-                        value = ''
-                        if map_cfg.get('sources') and map_cfg.get('transform'):
-                            # Composite field with transform
-                            sources = map_cfg['sources']
-                            vals = [extracted.get(s, '') for s in sources]
-                            transform_func = globals().get(map_cfg['transform'])
-                            if callable(transform_func):
-                                value = transform_func(vals)
-                            else:
-                                value = ''.join(vals)
-                        elif map_cfg.get('source'):
-                            value = extracted.get(map_cfg['source'], map_cfg.get('default', ''))
-                        elif 'default' in map_cfg:
-                            value = map_cfg['default']
-                        else:
-                            value = ''
-                        # Apply prefix if specified
-                        if value and map_cfg.get('prefix'):
-                            value = f"{map_cfg['prefix']}{value}"
-                        # Apply transformation if specified (uppercase, lowercase, date_format)
-                        transform = map_cfg.get('transform', 'none')
-                        date_format = map_cfg.get('date_format', '')
-                        if value is not None and value != '':
-                            if transform == 'uppercase':
-                                value = str(value).upper()
-                            elif transform == 'lowercase':
-                                value = str(value).lower()
-                            elif transform == 'date_format' and date_format:
-                                try:
-                                    dt = None
-                                    for fmt in ('%Y-%m-%d', '%Y%m%d', '%d-%m-%Y', '%Y/%m/%d'):
-                                        try:
-                                            dt = datetime.strptime(str(value), fmt)
-                                            break
-                                        except Exception:
-                                            continue
-                                    if dt:
-                                        value = dt.strftime(date_format)
-                                except Exception:
-                                    pass
-                        mapped_data[tgt_var] = value if value is not None else ''
-                    def replace_vars(match):
-                        var = match.group(1)
-                        return str(mapped_data.get(var, ''))
-                    rendered_output = re.sub(r'@@(.*?)@@', replace_vars, template_content)
+                    error = plan.error
                     result = rendered_output
                     temp_dir = tempfile.gettempdir()
-                    temp_filename = f'converted_output.{file_ext}'
+                    temp_filename = f'converted_output.{template.ext}'
                     temp_path = os.path.join(temp_dir, temp_filename)
                     with open(temp_path, 'w', encoding='utf-8') as f:
                         f.write(rendered_output)
                     download_url = url_for('converters.download_generated', filename=temp_filename)
-    return render_template('converter_test.html', converter_configs=converter_configs, converter_configs_dict=converter_configs_dict, result=result, error=error, download_url=download_url)
+    return render_template('converter_test.html', converter_configs=converter_configs, converter_configs_dict=converter_configs_dict, result=result, error=error, download_url=download_url, output_check=output_check)
 
-def extract_generic_text_fields(file_content, template_content=None):
-    import re
-    tag_dict = {}
-    current_tag = None
-    current_value_lines = []
-    # Normalize line endings
-    lines = file_content.replace('\r\n', '\n').replace('\r', '\n').split('\n')
-    for line in lines:
-        # End of block marker
-        if line.strip() == '-}':
-            break
-        # Tag detection
-        tag_match = re.match(r'^\s*(:[0-9A-Za-z]{2,3}:)', line)
-        if tag_match:
-            # Save previous tag's value
-            if current_tag is not None:
-                tag_dict[current_tag] = list(current_value_lines)
-            # Start new tag
-            current_tag = tag_match.group(1)[1:-1]  # e.g., '50K'
-            value = line[line.find(tag_match.group(1)) + len(tag_match.group(1)):]
-            current_value_lines = [value] if value.strip() or value == '' else []
-        elif current_tag is not None:
-            current_value_lines.append(line)
-    # Save last tag
-    if current_tag is not None:
-        tag_dict[current_tag] = list(current_value_lines)
-    # Flatten for output
-    tags = {}
-    for tag, lines in tag_dict.items():
-        tags[f'tag{tag}'] = ' '.join([l.strip() for l in lines])
-        for idx, line in enumerate(lines):
-            tags[f'tag{tag}Line{idx+1}'] = line.strip()
-    return tags
-
-def extract_xml_with_xpaths(file_content, rules_json):
-    import json
-    from lxml import etree
-    import re
-    rules = json.loads(rules_json)
-    # Strip namespaces
-    def strip_ns(xml):
-        xml = re.sub(r'xmlns(:\w+)?="[^"]*"', '', xml)
-        xml = re.sub(r'<(/?)(\w+):', r'<\1', xml)
-        xml = re.sub(r'(</?)(\w+):', r'\1', xml)
-        return xml
-    file_content = strip_ns(file_content)
-    content_no_decl = re.sub(r'<\?xml[^>]*\?>', '', file_content).strip()
-    wrapped_content = f'<Root>{content_no_decl}</Root>'
-    root = etree.fromstring(wrapped_content.encode('utf-8'), parser=etree.XMLParser(recover=True))
-    result = {}
-    for var, xpath in rules.items():
-        try:
-            found = root.xpath(xpath)
-            if found:
-                if isinstance(found[0], etree._Element):
-                    result[var] = (found[0].text or '').strip()
-                else:
-                    result[var] = str(found[0]).strip()
-            else:
-                result[var] = ''
-        except Exception as e:
-            result[var] = ''
-    return result
+@converters.route('/api/convert/<int:config_id>', methods=['POST'])
+@csrf.exempt
+@login_required
+@permission_required('config_manage')
+def api_convert(config_id):
+    """
+    Converts the request body (the raw source document, or JSON
+    {"content": "..."}) with a ConverterConfig. The output gets the same
+    XSD / field format check as converter_test: a JSON request is answered
+    with {'output', 'valid', 'output_check'}; a raw one with the converted
+    document, streamed, and the check status in X-Output-Check. With
+    ?strict=1 an output that fails the check is answered with 422 and the
+    check result instead. Errors are JSON {'error': ...}.
+    """
+    converter = ConverterConfig.query.get(config_id)
+    if not converter:
+        return jsonify({'error': 'Converter config not found.'}), 404
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        content = payload.get('content') if isinstance(payload, dict) else None
+        if not isinstance(content, str):
+            return jsonify({'error': 'Expected a JSON object with a "content" string.'}), 400
+    else:
+        content = request.get_data(cache=False)
+    if not content:
+        return jsonify({'error': 'Empty request body.'}), 400
+    template, plan, extract = prepare_conversion(converter)
+    if not template:
+        return jsonify({'error': 'No template found for target type.'}), 422
+    if plan.error:
+        return jsonify({'error': plan.error}), 422
+    mapped = plan.map(extract(content))
+    # The check reads the rendered chunks once; the response renders them again
+    checker = OutputChecker(converter.target_type, template.ext)
+    for chunk in plan.iter_render(mapped):
+        checker.feed(chunk)
+    output_check = checker.result()
+    valid = output_check['status'] in OUTPUT_CHECK_PASSED
+    if request.is_json:
+        return jsonify({'output': plan.render(mapped), 'valid': valid, 'output_check': output_check})
+    if not valid and request.args.get('strict') in ('1', 'true'):
+        return jsonify({'error': f"Converted output failed the {output_check['check']} check.", 'valid': False, 'output_check': output_check}), 422
+    mimetype = 'application/xml' if template.ext == 'xml' else 'text/plain'
+    headers = {'X-Converter-Config': str(converter.id), 'X-Output-Check': output_check['status']}
+    return Response(plan.iter_render(mapped), mimetype=f'{mimetype}; charset=utf-8', headers=headers)
+
+@converters.route('/api/convert/<int:config_id>/batch', methods=['POST'])
+@csrf.exempt
+@login_required
+@permission_required('config_manage')
+def api_convert_batch(config_id):
+    """
+    Converts every document in the uploaded source_file(s) (zip archives or
+    batch files of MT/MX messages; or the raw request body) and streams back
+    a zip with one output per document and a manifest.json listing each
+    document's status and output check result.
+    """
+    converter = ConverterConfig.query.get(config_id)
+    if not converter:
+        return jsonify({'error': 'Converter config not found.'}), 404
+    uploads = [(f.filename, f.stream) for f in request.files.getlist('source_file') if f and f.filename]
+    if not uploads:
+        form_post = request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded')
+        if form_post or (not request.content_length and 'chunked' not in request.headers.get('Transfer-Encoding', '')):
+            return jsonify({'error': 'Please upload at least one file.'}), 400
+        uploads = [('body', request.stream)]
+    template, plan, extract = prepare_conversion(converter)
+    if not template:
+        return jsonify({'error': 'No template found for target type.'}), 422
+    if plan.error:
+        return jsonify({'error': plan.error}), 422
+    info = {'converter': converter.name, 'source_type': converter.source_type, 'target_type': converter.target_type}
+    def check():
+        return OutputChecker(converter.target_type, template.ext)
+    chunks = stream_batch_zip(iter_batch_sources(uploads), extract, plan.map_batch, plan.iter_render, template.ext,
+                              workers=xml_batch_workers(), manifest_info=info, check=check)
+    filename = secure_filename(f'{converter.name}_converted.zip') or 'converted.zip'
+    return Response(stream_with_context(chunks), mimetype='application/zip', headers={'Content-Disposition': f'attachment;filename={filename}'})
 
 @converters.route('/config/get_filetypes')
 @login_required
@@ -1445,6 +1364,51 @@ def get_filetypes():
     filetypes = [ft.name for ft in FileType.query.order_by(FileType.name).all()]
     return jsonify(filetypes)
 
+def template_registry():
+    return get_template_registry(os.path.join(current_app.root_path, 'templates', 'filetypes'))
+
+def find_template(target_type):
+    """TemplateEntry of the templates/filetypes template for a FileType (xml before txt), or None."""
+    return template_registry().find(target_type)
+
+def prepare_conversion(converter, value_transforms=True):
+    """
+    Looks up what a ConverterConfig needs once: (TemplateEntry,
+    ConversionPlan, extract) where extract(content) returns the source
+    fields the mapping reads from one document (bytes or str). extract does
+    not touch the database, so it can run on worker threads. (None, None,
+    None) if the target has no template.
+    """
+    template = find_template(converter.target_type)
+    if not template:
+        return None, None, None
+    plan = get_conversion_plan(converter, template, value_transforms)
+    source_filetype = FileType.query.filter_by(name=converter.source_type).first()
+    extraction_rules = source_filetype.extraction_rules if source_filetype else '{}'
+    xml_source = bool(source_filetype and source_filetype.file_mode == 'xml')
+    def extract(content):
+        # Only evaluate the extraction rules this mapping actually reads
+        if xml_source:
+            return extract_xml_with_xpaths(content, extraction_rules, fields=plan.fields)
+        if isinstance(content, bytes):
+            content = decode_swift(content)
+        return extract_generic_text_fields(content, plan.template, fields=plan.fields)
+    return template, plan, extract
+
+def convert_source(converter, content, value_transforms=True):
+    """
+    Runs a ConverterConfig on one source document: extracts the fields its
+    mapping reads with the source FileType's rules, renders them into the
+    target template and checks the result (check_output). Returns
+    (TemplateEntry, ConversionPlan, output, output check), or (None, None,
+    None, None) if the target has no template.
+    """
+    template, plan, extract = prepare_conversion(converter, value_transforms)
+    if not template:
+        return None, None, None, None
+    output = plan.render(plan.map(extract(content)))
+    return template, plan, output, check_output(output, converter.target_type, template.ext)
+
 @converters.route('/upload-template', methods=['POST'])
 @login_required
 @permission_required('config_manage')
@@ -1461,6 +1425,8 @@ def upload_template():
     template_dir = os.path.join(current_app.root_path, 'templates', 'filetypes')
     os.makedirs(template_dir, exist_ok=True)
     file.save(os.path.join(template_dir, filename))
+    invalidate_conversion_plans(template_path=os.path.join(template_dir, filename))
+    template_registry().refresh()
     flash('Template uploaded successfully!')
     return redirect(url_for('filetypes.list_filetypes'))
 
@@ -1482,6 +1448,84 @@ def download_template(filename):
     else:
         return send_file(file_path)
 
+# --- Corpus triage: random access to message #N of large batch files ---
+CORPUS_DIRS = ('resources', 'uploads')
+
+def corpus_file_path(rel_path):
+    """Resolves a corpus file under resources/ or uploads/, or aborts with 404."""
+    base = os.path.dirname(current_app.root_path)
+    path = os.path.realpath(os.path.join(base, rel_path or ''))
+    for d in CORPUS_DIRS:
+        root = os.path.realpath(os.path.join(base, d))
+        if path.startswith(root + os.sep) and os.path.isfile(path):
+            return path
+    abort(404)
+
+@converters.route('/corpus/index')
+@login_required
+@permission_required('config_manage')
+def corpus_index():
+    rel_path = request.args.get('file', '')
+    entries = load_message_index(corpus_file_path(rel_path))
+    return jsonify({'file': rel_path, 'count': len(entries), 'messages': [e._asdict() for e in entries]})
+
+@converters.route('/corpus/message/<int:n>')
+@login_required
+@permission_required('config_manage')
+def corpus_message(n):
+    path = corpus_file_path(request.args.get('file', ''))
+    entries = load_message_index(path)
+    if n < 0 or n >= len(entries):
+        abort(404)
+    return Response(read_message(path, n, entries), mimetype='text/plain')
+
+def corpus_sample_files(xml):
+    """Corpus files (relative paths) under resources/ and uploads/ of the given format."""
+    base = os.path.dirname(current_app.root_path)
+    files = []
+    for d in CORPUS_DIRS:
+        root = os.path.join(base, d)
+        if not os.path.isdir(root):
+            continue
+        for name in sorted(os.listdir(root)):
+            if name.endswith(SIDECAR_SUFFIX) or not os.path.isfile(os.path.join(root, name)):
+                continue
+            if name.lower().endswith('.xml') == xml:
+                files.append(f'{d}/{name}')
+    return files
+
+def render_rule_profile(kind, name, xml, extract, back_url):
+    """
+    Runs extract over the selected corpus files and/or uploaded samples and
+    renders the per-rule cost report, most expensive rule first.
+    """
+    files = corpus_sample_files(xml)
+    selected = files
+    rows = None
+    profile = None
+    if request.method == 'POST':
+        selected = request.form.getlist('files')
+        paths = [corpus_file_path(f) for f in selected]
+        uploads = [f for f in request.files.getlist('sample_files') if f and f.filename]
+        temp_dir = tempfile.mkdtemp() if uploads else None
+        for file in uploads:
+            path = os.path.join(temp_dir, secure_filename(file.filename))
+            file.save(path)
+            paths.append(path)
+        if not paths:
+            flash('Select or upload at least one sample file.')
+        else:
+            try:
+                profile = profile_corpus(extract, paths)
+                rows = profile.ranked()
+            except Exception as e:
+                flash(f'Profiling failed: {e}')
+            finally:
+                if temp_dir:
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+    return render_template('rule_profile.html', kind=kind, name=name, files=files, selected=selected,
+                           profile=profile, rows=rows, max_messages=PROFILE_MAX_MESSAGES, back_url=back_url)
+
 @converters.route('/test-workflow/<int:id>/clone', methods=['POST'])
 @login_required
 @permission_required('workflow_manage')
@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from .regex_guard import GuardedPattern, RegexTimeout
+
+_MISSING = object()
+
+
+def rules_hash(rules_json):
+    """
+    Stable cache key for a rules/schema string as stored on Configuration,
+    FileType or ConverterConfig.
+    """
+    if rules_json is None:
+        rules_json = ''
+    if isinstance(rules_json, str):
+        rules_json = rules_json.encode('utf-8')
+    return hashlib.sha1(rules_json).hexdigest()
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU cache shared by the compiled rule/plan caches.
+    With maxbytes, entries are also evicted while the sizes given by
+    sizeof(value) add up to more than maxbytes.
+    """
+    def __init__(self, maxsize=128, maxbytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._remove(key)
+            self._data[key] = value
+            if self.maxbytes is not None:
+                self._sizes[key] = self.sizeof(value)
+                self.nbytes += self._sizes[key]
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self.nbytes > self.maxbytes):
+                self._remove(next(iter(self._data)))
+        return value
+
+    def get_or_build(self, key, build):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.put(key, build())
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._remove(key, default)
+
+    def discard_where(self, predicate):
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                self._remove(key)
+
+    def keys(self):
+        """Snapshot of the keys, least recently used first."""
+        with self._lock:
+            return list(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+
+    def _remove(self, key, default=None):
+        self.nbytes -= self._sizes.pop(key, 0)
+        return self._data.pop(key, default)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+def compile_condition(condition, cond_value):
+    """
+    Returns a predicate closure value -> value|None for a rule condition.
+    Unknown or empty conditions pass the value through unchanged.
+    """
+    if not condition:
+        return None
+    if condition == 'contains':
+        return lambda v: v if v is not None and cond_value in v else None
+    elif condition == 'equals':
+        return lambda v: v if v is not None and v == cond_value else None
+    elif condition == 'not_equals':
+        return lambda v: v if v is not None and v != cond_value else None
+    elif condition == 'starts_with':
+        return lambda v: v if v is not None and v.startswith(cond_value) else None
+    elif condition == 'ends_with':
+        return lambda v: v if v is not None and v.endswith(cond_value) else None
+    elif condition == 'regex':
+        guard = GuardedPattern(cond_value)
+        return lambda v: v if v is not None and _guarded_test(guard, v) else None
+    return lambda v: v
+
+
+def _guarded_test(guard, value):
+    try:
+        return guard.test(value)
+    except RegexTimeout as e:
+        logging.warning('regex condition skipped: %s', e)
+        return False
+
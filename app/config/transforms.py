@@ -0,0 +1,219 @@
+import re
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+# Input formats the mapping's date_format value transform accepts, in the order tried
+DATE_INPUT_FORMATS = ('%Y-%m-%d', '%Y%m%d', '%d-%m-%Y', '%Y/%m/%d')
+
+# Dates the SWIFT transforms read: ISO (optionally with a time part), SWIFT YYMMDD and the above
+TRANSFORM_DATE_FORMATS = ('%Y-%m-%d', '%y%m%d') + DATE_INPUT_FORMATS[1:]
+
+_DATE_DIRECTIVES = {
+    '%Y': r'(?P<Y>\d{4})',
+    '%y': r'(?P<y>\d{2})',
+    # As in strptime, so one-digit months and days ('2024-1-5') are accepted
+    '%m': r'(?P<m>1[0-2]|0[1-9]|[1-9])',
+    '%d': r'(?P<d>3[01]|[12]\d|0[1-9]|[1-9]| [1-9])',
+}
+
+_ISO_TIME = re.compile(r'T\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?')
+_SWIFT_AMOUNT = re.compile(r'(\d+),(\d*)')
+_DECIMAL_AMOUNT = re.compile(r'(\d+)(?:\.(\d*))?')
+
+# name -> Transform subclass, see register_transform
+TRANSFORMS = {}
+
+
+def compile_date_format(fmt):
+    """
+    Regex for a strptime-style date format built from %Y, %y, %m and %d.
+    Raises ValueError for any other directive.
+    """
+    parts = []
+    for token in re.split(r'(%.)', fmt):
+        if token.startswith('%'):
+            if token not in _DATE_DIRECTIVES:
+                raise ValueError(f'unsupported directive {token} in date format {fmt!r}')
+            parts.append(_DATE_DIRECTIVES[token])
+        else:
+            parts.append(re.escape(token))
+    return re.compile(''.join(parts))
+
+
+class DateParser:
+    """
+    Parses date strings in any of formats with precompiled regexes. The
+    format that matched last is tried first, so a parser kept per mapped
+    field detects that field's format once and then hits it on the first
+    try. With allow_time an ISO time part ('T10:20:30Z') is ignored.
+    """
+    def __init__(self, formats=DATE_INPUT_FORMATS, allow_time=False):
+        self.formats = [compile_date_format(fmt) for fmt in formats]
+        self.allow_time = allow_time
+        self._last = 0
+
+    def parse(self, value):
+        """datetime for value (time 00:00), or None if no format matches a valid date."""
+        value = str(value)
+        if self.allow_time:
+            m = _ISO_TIME.search(value)
+            if m and m.end() == len(value):
+                value = value[:m.start()]
+        last = self._last
+        order = [last] + [i for i in range(len(self.formats)) if i != last]
+        for i in order:
+            m = self.formats[i].fullmatch(value)
+            if m is None:
+                continue
+            dt = _to_datetime(m)
+            if dt is not None:
+                self._last = i
+                return dt
+        return None
+
+
+def _to_datetime(m):
+    fields = m.groupdict()
+    if fields.get('Y') is not None:
+        year = int(fields['Y'])
+    else:
+        # strptime's %y pivot: 69-99 -> 1900s, 00-68 -> 2000s
+        year = int(fields['y'])
+        year += 1900 if year >= 69 else 2000
+    try:
+        return datetime(year, int(fields['m']), int(fields['d']))
+    except ValueError:
+        return None
+
+
+def swift_amount(value):
+    """
+    Amount in SWIFT notation: decimal comma, no thousands separators, at
+    least one integer digit ('1,234.50' -> '1234,50', '325' -> '325,').
+    Values that are not amounts are returned unchanged.
+    """
+    text = str(value).strip().replace(' ', '')
+    m = _SWIFT_AMOUNT.fullmatch(text)
+    if m is None:
+        m = _DECIMAL_AMOUNT.fullmatch(text.replace(',', ''))
+        if m is None:
+            return value
+    return f"{m.group(1).lstrip('0') or '0'},{m.group(2) or ''}"
+
+
+def iso_amount(value):
+    """Amount with a decimal point ('1234,5' -> '1234.5', '325,' -> '325'); non-amounts unchanged."""
+    text = str(value).strip()
+    m = _SWIFT_AMOUNT.fullmatch(text) or _DECIMAL_AMOUNT.fullmatch(text)
+    if m is None:
+        return value
+    integer = m.group(1).lstrip('0') or '0'
+    return f'{integer}.{m.group(2)}' if m.group(2) else integer
+
+
+def register_transform(name):
+    """Class decorator adding a Transform subclass to TRANSFORMS under name."""
+    def decorator(cls):
+        cls.name = name
+        TRANSFORMS[name] = cls
+        return cls
+    return decorator
+
+
+def get_transform(name):
+    """A new instance of the registered transform name, or None."""
+    cls = TRANSFORMS.get(name) if isinstance(name, str) else None
+    return cls() if cls is not None else None
+
+
+class Transform(ABC):
+    """
+    A named mapping transform for rules of the form {"sources": [...],
+    "transform": name}: called with the list of source values it returns
+    the mapped value. Each mapped field gets its own instance, so state
+    such as a detected date format is kept per field. batch() is the
+    list-in/list-out form for many records at once.
+    """
+    name = None
+
+    @abstractmethod
+    def __call__(self, vals):
+        """The mapped value for one list of source values."""
+
+    def batch(self, rows):
+        """One mapped value per list of source values in rows."""
+        return [self(vals) for vals in rows]
+
+
+def _args(vals, n):
+    vals = list(vals)[:n]
+    return vals + [''] * (n - len(vals))
+
+
+class _DateTransform(Transform):
+    output_format = None
+
+    def __init__(self):
+        self.dates = DateParser(TRANSFORM_DATE_FORMATS, allow_time=True)
+
+    def date(self, value):
+        if not value:
+            return ''
+        dt = self.dates.parse(value)
+        return dt.strftime(self.output_format) if dt else value
+
+
+@register_transform('mt103_32A')
+class MT103Field32A(_DateTransform):
+    """Field 32A from [settlement date, currency, amount]: YYMMDD + CCY + SWIFT amount."""
+    output_format = '%y%m%d'
+
+    def __call__(self, vals):
+        date, ccy, amount = _args(vals, 3)
+        return f'{self.date(date)}{str(ccy).strip().upper()}{swift_amount(amount)}'
+
+
+@register_transform('mt103_33B')
+class MT103Field33B(Transform):
+    """Field 33B from [currency, amount]: CCY + SWIFT amount."""
+    def __call__(self, vals):
+        ccy, amount = _args(vals, 2)
+        return f'{str(ccy).strip().upper()}{swift_amount(amount)}'
+
+
+@register_transform('swift_amount')
+class SwiftAmount(Transform):
+    """The joined source values as a SWIFT amount (see swift_amount)."""
+    def __call__(self, vals):
+        return swift_amount(''.join(vals))
+
+    def batch(self, rows):
+        return [swift_amount(''.join(vals)) for vals in rows]
+
+
+@register_transform('iso_amount')
+class ISOAmount(Transform):
+    """The joined source values as a decimal-point amount (see iso_amount)."""
+    def __call__(self, vals):
+        return iso_amount(''.join(vals))
+
+    def batch(self, rows):
+        return [iso_amount(''.join(vals)) for vals in rows]
+
+
+@register_transform('swift_date')
+class SwiftDate(_DateTransform):
+    """The joined source values as a SWIFT YYMMDD date."""
+    output_format = '%y%m%d'
+
+    def __call__(self, vals):
+        return self.date(''.join(vals))
+
+
+@register_transform('iso_date')
+class ISODate(_DateTransform):
+    """The joined source values as an ISO YYYY-MM-DD date."""
+    output_format = '%Y-%m-%d'
+
+    def __call__(self, vals):
+        return self.date(''.join(vals))
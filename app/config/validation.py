@@ -0,0 +1,74 @@
+import json
+
+from jsonschema import validators
+from jsonschema.exceptions import best_match
+
+from .rules import LRUCache, rules_hash
+
+_validator_cache = LRUCache(maxsize=128)
+
+# Values the required-field check treats as missing
+EMPTY_VALUES = (None, '', [], {})
+
+
+class SchemaValidator:
+    """
+    A Configuration schema parsed and checked once, with its jsonschema
+    validator built up front. Besides the schema itself, fields listed in
+    'required' must not be empty (None, '', [] or {}).
+    """
+    def __init__(self, schema):
+        self.schema = schema
+        cls = validators.validator_for(schema)
+        cls.check_schema(schema)
+        self.validator = cls(schema)
+        required = schema.get('required', []) if isinstance(schema, dict) else []
+        self.required = [f for f in required if isinstance(f, str)]
+
+    def missing(self, record):
+        """Required fields that are absent or empty in record."""
+        return [f for f in self.required if record.get(f) in EMPTY_VALUES]
+
+    def first_error(self, record):
+        """The most relevant schema error (as jsonschema.validate reports it), or None."""
+        return best_match(self.validator.iter_errors(record))
+
+    def errors(self, record):
+        """Every problem with one record as a list of messages; empty if it is valid."""
+        messages = []
+        missing = self.missing(record) if isinstance(record, dict) else []
+        if missing:
+            messages.append(f"Required field(s) missing or empty: {', '.join(missing)}")
+        # Already reported above
+        reported = {f'{f!r} is a required property' for f in missing}
+        for error in sorted(self.validator.iter_errors(record), key=lambda e: [str(p) for p in e.absolute_path]):
+            if error.validator == 'required' and error.message in reported:
+                continue
+            path = '/'.join(str(p) for p in error.absolute_path)
+            messages.append(f'{path}: {error.message}' if path else error.message)
+        return messages
+
+
+def get_schema_validator(schema_json, owner=None):
+    """
+    Cached SchemaValidator for a schema string. owner identifies the config
+    it belongs to (e.g. ('config', id)) so invalidate_schema_validators can
+    drop it when that config is edited. Raises ValueError for invalid JSON
+    and jsonschema.SchemaError for an invalid schema.
+    """
+    key = (owner, rules_hash(schema_json))
+    return _validator_cache.get_or_build(key, lambda: SchemaValidator(json.loads(schema_json)))
+
+
+def invalidate_schema_validators(owner):
+    """Forgets the validators built for owner's schema."""
+    _validator_cache.discard_where(lambda key: key[0] == owner)
+
+
+def validate_records(records, schema_json, owner=None):
+    """
+    Checks many extracted records against one schema with a single cached
+    validator. Returns one list of error messages per record, in order.
+    """
+    validator = get_schema_validator(schema_json, owner)
+    return [validator.errors(record) for record in records]
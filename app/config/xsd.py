@@ -0,0 +1,168 @@
+import os
+import threading
+
+from lxml import etree
+from werkzeug.utils import secure_filename
+
+from .conversion import get_template_registry
+from .rules import LRUCache
+
+# Validation errors reported per output
+XSD_MAX_ERRORS = 20
+
+_schema_cache = LRUCache(maxsize=64)
+
+
+class CompiledXSD:
+    """
+    One uploaded XSD compiled into an etree.XMLSchema. Compiling an ISO 20022
+    schema takes seconds, so these are kept across requests and only rebuilt
+    when the file changes. Validation is serialized per schema because the
+    schema object keeps its error log on itself.
+    """
+    def __init__(self, path):
+        self.path = path
+        tree = etree.parse(path)
+        self.target_namespace = tree.getroot().get('targetNamespace', '')
+        self.schema = etree.XMLSchema(tree)
+        self.lock = threading.Lock()
+
+    def errors(self, elem):
+        """Validation messages for elem, checked as a standalone document."""
+        with self.lock:
+            if self.schema.validate(elem):
+                return []
+            return [f'line {e.line}: {e.message}' for e in self.schema.error_log][:XSD_MAX_ERRORS]
+
+
+def xsd_filename(filetype_name, part):
+    """
+    File name an XSD for a FileType is stored under: <name>.<message
+    definition>.xsd with the name passed through secure_filename, or None
+    if nothing of the name is left.
+    """
+    stem = secure_filename(filetype_name)
+    return f'{stem}.{part}.xsd' if stem else None
+
+
+def xsd_files(schema_dir, filetype_name):
+    """
+    (path, mtime_ns, size) of the uploaded XSD files of a FileType (see
+    xsd_filename), from the shared listing of schema_dir, which is re-read
+    at most every TEMPLATE_CHECK_INTERVAL seconds or on refresh().
+    """
+    stem = secure_filename(filetype_name)
+    if not stem:
+        return []
+    return get_template_registry(schema_dir).files(stem + '.', '.xsd')
+
+
+def xsd_paths(schema_dir, filetype_name):
+    """Uploaded XSD files of a FileType (see xsd_filename)."""
+    return [path for path, _, _ in xsd_files(schema_dir, filetype_name)]
+
+
+def get_compiled_xsd(path, mtime_ns, size):
+    """CompiledXSD for a file, cached by path and modification time."""
+    return _schema_cache.get_or_build((path, mtime_ns, size), lambda: CompiledXSD(path))
+
+
+def compile_uploaded_xsd(data, path):
+    """
+    Checks that uploaded XSD bytes compile (relative imports resolve next to
+    path) and returns their targetNamespace. Raises etree.XMLSchemaParseError
+    or etree.XMLSyntaxError otherwise.
+    """
+    root = etree.fromstring(data, base_url=path)
+    etree.XMLSchema(root)
+    return root.get('targetNamespace', '')
+
+
+# Output check statuses (validate_xml_output, validate_mt_output) that let an output through
+OUTPUT_CHECK_PASSED = ('valid', 'unchecked')
+
+
+class XMLOutputCheck:
+    """
+    Incremental form of validate_xml_output: feed() the rendered output in
+    chunks (str or bytes, e.g. from ConversionPlan.iter_render) as they are
+    written out, then result(). Only the parsed tree is kept, never the
+    output text.
+    """
+    def __init__(self, schema_dir, filetype_name):
+        self.schema_dir = schema_dir
+        self.filetype_name = filetype_name
+        self._parser = etree.XMLParser()
+        self._parser.feed(b'<Root>')
+        self._head = b''
+        self._error = None
+
+    def feed(self, chunk):
+        if self._error is not None:
+            return
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if self._head is not None:
+            # Held back until the XML declaration, if any, is complete
+            head = self._head + chunk
+            start = head.lstrip(b'\xef\xbb\xbf').lstrip()
+            if start.startswith(b'<?xml') and b'?>' not in start or b'<?xml'.startswith(start):
+                self._head = head
+                return
+            chunk, self._head = _strip_declaration(head), None
+        try:
+            self._parser.feed(chunk)
+        except etree.XMLSyntaxError as e:
+            self._error = e
+
+    def result(self):
+        """{'status', 'errors', 'checked'} as described for validate_xml_output."""
+        root = None
+        if self._head:
+            self._head, head = None, self._head
+            self.feed(_strip_declaration(head) if b'?>' in head else head)
+        if self._error is None:
+            try:
+                self._parser.feed(b'</Root>')
+                root = self._parser.close()
+            except etree.XMLSyntaxError as e:
+                self._error = e
+        if self._error is not None:
+            return {'status': 'malformed', 'errors': [str(self._error)], 'checked': []}
+        schemas = {}
+        for path, mtime_ns, size in xsd_files(self.schema_dir, self.filetype_name):
+            try:
+                compiled = get_compiled_xsd(path, mtime_ns, size)
+            except (OSError, etree.LxmlError) as e:
+                return {'status': 'invalid', 'errors': [f'{os.path.basename(path)}: {e}'], 'checked': []}
+            schemas[compiled.target_namespace] = compiled
+        errors, checked = [], []
+        for elem in root.iterchildren(etree.Element):
+            compiled = schemas.get(etree.QName(elem).namespace or '')
+            if compiled is None:
+                continue
+            checked.append(etree.QName(elem).localname)
+            errors.extend(f'{etree.QName(elem).localname}: {message}' for message in compiled.errors(elem))
+        if not checked:
+            return {'status': 'unchecked', 'errors': [], 'checked': []}
+        return {'status': 'invalid' if errors else 'valid', 'errors': errors, 'checked': checked}
+
+
+def validate_xml_output(content, schema_dir, filetype_name):
+    """
+    Structural check of a generated MX output (AppHdr and/or Document
+    fragments) against the XSDs uploaded for filetype_name. Each top-level
+    element is validated with the schema for its namespace. Returns
+    {'status', 'errors', 'checked'}; status is 'valid', 'invalid',
+    'malformed' (not well-formed XML) or 'unchecked' (no matching XSD).
+    """
+    check = XMLOutputCheck(schema_dir, filetype_name)
+    check.feed(content)
+    return check.result()
+
+
+def _strip_declaration(content):
+    content = content.lstrip(b'\xef\xbb\xbf').lstrip()
+    if content.startswith(b'<?xml'):
+        content = content[content.index(b'?>') + 2:]
+    return content
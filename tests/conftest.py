@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run from the repository root or from tests/: make the app package importable
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def read_resource():
+    """Reads a sample from resources/ (text, or bytes with mode='rb')."""
+    def read(name, mode='r'):
+        with open(os.path.join(ROOT, 'resources', name), mode) as f:
+            return f.read()
+    return read
@@ -0,0 +1,85 @@
+import inspect
+import json
+from types import SimpleNamespace
+
+import pytest
+from flask import g
+from flask_login import AnonymousUserMixin
+
+from app import create_app
+from app.config import routes
+from app.config.conversion import TemplateRegistry
+
+# The models' relationship warnings are not what these tests are about
+pytestmark = pytest.mark.filterwarnings('ignore::sqlalchemy.exc.SAWarning')
+
+TEMPLATE = '{4:\n:20:@@ref@@\n:23B:@@op@@\n-}'
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch, read_resource):
+    (tmp_path / 'MT103.txt.j2').write_text(TEMPLATE)
+    registry = TemplateRegistry(str(tmp_path))
+    converter = SimpleNamespace(id=7, name='pacs2mt', source_type='pacs008', target_type='MT103',
+                                rules=json.dumps({'ref': {'source': 'MsgId'}, 'op': {'default': 'CRED'}}))
+    source = SimpleNamespace(name='pacs008', file_mode='xml', extraction_rules=read_resource('rules_pacs008.txt'))
+    app = create_app()
+    with app.app_context():
+        monkeypatch.setattr(routes.ConverterConfig, 'query', SimpleNamespace(get=lambda i: converter if i == 7 else None))
+        monkeypatch.setattr(routes.FileType, 'query', SimpleNamespace(
+            filter_by=lambda **kw: SimpleNamespace(first=lambda: source if kw['name'] == 'pacs008' else None)))
+    monkeypatch.setattr(routes, 'template_registry', lambda: registry)
+
+    def call(config_id=7, query='', **kwargs):
+        with app.test_request_context(f'/api/convert/{config_id}{query}', method='POST', **kwargs):
+            g._login_user = AnonymousUserMixin()
+            response = inspect.unwrap(routes.api_convert)(config_id)
+            status = 200
+            if isinstance(response, tuple):
+                response, status = response
+            return status, response
+    call.converter = converter
+    return call
+
+
+def test_raw_request_streams_the_document_with_the_check_status(api, read_resource):
+    status, response = api(data=read_resource('pacs008.xml', 'rb'), content_type='application/xml')
+    assert status == 200 and response.is_streamed
+    assert response.headers['X-Output-Check'] == 'valid' and response.headers['X-Converter-Config'] == '7'
+    assert response.get_data(as_text=True) == '{4:\n:20:GBS13084JVKPJE4G\n:23B:CRED\n-}'
+
+
+def test_failed_check_is_reported_and_blocks_only_in_strict_mode(api, read_resource):
+    api.converter.rules = json.dumps({'ref': {'source': 'MsgId'}, 'op': {'default': 'CREDIT'}})
+    doc = read_resource('pacs008.xml', 'rb')
+    status, response = api(data=doc, content_type='application/xml')
+    assert status == 200 and response.headers['X-Output-Check'] == 'invalid'
+    assert ':23B:CREDIT' in response.get_data(as_text=True)
+    status, response = api(query='?strict=1', data=doc, content_type='application/xml')
+    body = response.get_json()
+    assert status == 422 and body['valid'] is False
+    assert body['output_check']['errors'] == [":23B: 'CREDIT' does not match 4!c"]
+    status, response = api(json={'content': doc.decode('utf-8')})
+    body = response.get_json()
+    assert status == 200 and body['valid'] is False and ':23B:CREDIT' in body['output']
+
+
+def test_json_request(api, read_resource):
+    status, response = api(json={'content': read_resource('pacs008.xml')})
+    body = response.get_json()
+    assert status == 200 and body['valid'] is True and body['output_check']['check'] == 'Field format'
+    assert body['output'] == '{4:\n:20:GBS13084JVKPJE4G\n:23B:CRED\n-}'
+
+
+def test_error_status_codes(api, read_resource):
+    doc = read_resource('pacs008.xml', 'rb')
+    assert api(config_id=8, data=doc)[0] == 404
+    assert api(data=b'')[0] == 400
+    assert api(json=['not', 'an', 'object'])[0] == 400
+    assert api(data=b'{"content": ', content_type='application/json')[0] == 400
+    api.converter.rules = '{bad'
+    status, response = api(data=doc)
+    assert status == 422 and response.get_json()['error'].startswith('Error in mapping:')
+    api.converter.target_type = 'MT202'
+    status, response = api(data=doc)
+    assert status == 422 and response.get_json() == {'error': 'No template found for target type.'}
@@ -0,0 +1,81 @@
+import io
+import json
+import zipfile
+
+from app.config.batch import BATCH_MANIFEST, iter_batch_sources, stream_batch_zip
+
+
+def zip_bytes(entries):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        for name, data in entries.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def convert(sources, workers=None):
+    def extract(data):
+        if not data.strip():
+            raise ValueError('empty document')
+        return data.decode()
+
+    class Check:
+        def __init__(self):
+            self.chunks = []
+
+        def feed(self, chunk):
+            self.chunks.append(chunk)
+
+        def result(self):
+            return {'status': 'invalid' if 'BAD' in ''.join(self.chunks) else 'valid', 'errors': [], 'checked': []}
+
+    chunks = stream_batch_zip(sources, extract, lambda rows: [r.upper() for r in rows], lambda value: [value[:3], value[3:]],
+                              'txt', workers=workers, manifest_info={'converter': 'test'}, check=Check)
+    zf = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+    return zf, json.loads(zf.read(BATCH_MANIFEST))
+
+
+def test_batch_zip_outputs_and_manifest():
+    sources = [(f'doc{i}.xml', f'message {i}'.encode()) for i in range(40)]
+    sources += [('empty.xml', b''), ('bad.xml', b'bad one'), ('doc1.xml', b'again')]
+    zf, manifest = convert(sources, workers=4)
+    outputs = [f'doc{i}.txt' for i in range(40)] + ['bad.txt', 'doc1_2.txt']
+    assert zf.namelist() == outputs + [BATCH_MANIFEST]
+    assert zf.read('doc7.txt') == b'MESSAGE 7'
+    assert (manifest['converter'], manifest['total'], manifest['ok'], manifest['failed'], manifest['invalid']) == ('test', 43, 41, 1, 1)
+    by_source = {r['source']: r for r in manifest['entries'][40:]}
+    assert by_source['empty.xml']['status'] == 'error' and by_source['empty.xml']['output'] is None
+    assert by_source['bad.xml']['status'] == 'invalid' and by_source['bad.xml']['output_check']['status'] == 'invalid'
+    assert [r['source'] for r in manifest['entries']] == [name for name, _ in sources]
+
+
+def test_batch_zip_entry_names_stay_inside_the_archive():
+    sources = [('../../etc/passwd', b'a'), ('/abs/x.xml', b'b'), ('C:\\win\\y.xml', b'c'), ('..', b'd')]
+    zf, _ = convert(sources)
+    assert zf.namelist() == ['etc/passwd.txt', 'abs/x.txt', 'win/y.txt', 'output.txt', BATCH_MANIFEST]
+
+
+def test_batch_sources_from_zip_batch_and_single_uploads(read_resource):
+    pacs008 = read_resource('pacs008.xml', 'rb').strip()
+    mt = read_resource('mt103.txt', 'rb').strip()
+    uploads = [
+        ('in.zip', io.BytesIO(zip_bytes({'a/one.xml': pacs008, 'two.txt': mt}))),
+        ('batch.txt', io.BytesIO(mt + b'\n' + mt)),
+        ('single.txt', io.BytesIO(mt)),
+        ('plain.xml', io.BytesIO(b'<Other>no AppHdr or Document</Other>')),
+        ('empty.txt', io.BytesIO(b'')),
+    ]
+    sources = list(iter_batch_sources(uploads))
+    assert [name for name, _ in sources] == ['a/one.xml', 'two.txt', 'batch_00001', 'batch_00002', 'single.txt', 'plain.xml']
+    assert [bytes(data) for _, data in sources[:5]] == [pacs008, mt, mt, mt, mt]
+    assert bytes(sources[5][1]) == b'<Other>no AppHdr or Document</Other>'
+
+
+def test_mt_batch_uploads_are_streamed_per_message(read_resource):
+    mt = read_resource('mt103.txt', 'rb').strip()
+    legacy = mt.replace(b'OUR', b'\xe9UR')
+    uploads = [('cr.txt', io.BytesIO(mt.replace(b'\n', b'\r') + b'\r$' + mt.replace(b'\n', b'\r'))),
+               ('legacy.txt', io.BytesIO(legacy + b'\n' + legacy))]
+    sources = list(iter_batch_sources(uploads))
+    assert [name for name, _ in sources] == ['cr_00001', 'cr_00002', 'legacy_00001', 'legacy_00002']
+    assert [bytes(data) for _, data in sources] == [mt, mt, legacy, legacy]
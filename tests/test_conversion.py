@@ -0,0 +1,107 @@
+import io
+import json
+from types import SimpleNamespace
+
+from app.config.conversion import (SegmentTemplate, TemplateRegistry, get_conversion_plan, get_template_registry,
+                                   invalidate_conversion_plans, required_source_fields)
+
+TEMPLATE = ':20:@@ref@@\n:32A:@@f32a@@\n:50K:@@payer@@\n:70:@@info@@\n-}'
+
+RULES = {
+    'ref': {'source': 'MsgId', 'transform': 'uppercase'},
+    'f32a': {'sources': ['SttlmDt', 'Ccy', 'Amt'], 'transform': 'mt103_32A'},
+    'payer': {'source': 'Dbtr', 'prefix': '/', 'default': 'UNKNOWN'},
+    'info': {'default': 'NONE'},
+    'unused': {'source': 'Other'},
+}
+
+RECORD = {'MsgId': 'abc1', 'SttlmDt': '2024-01-31', 'Ccy': 'eur', 'Amt': '1000.5', 'Dbtr': 'ACME'}
+
+
+def converter(id=1, rules=RULES):
+    return SimpleNamespace(id=id, rules=json.dumps(rules))
+
+
+def template_entry(path='MT103.txt.j2', mtime_ns=1, content=TEMPLATE):
+    return SimpleNamespace(path=path, mtime_ns=mtime_ns, size=len(content), segments=SegmentTemplate(content))
+
+
+def test_plan_maps_and_renders_a_record():
+    plan = get_conversion_plan(converter(), template_entry())
+    assert plan.error is None
+    assert plan.fields == {'MsgId', 'SttlmDt', 'Ccy', 'Amt', 'Dbtr'}
+    assert plan.fields == required_source_fields(RULES, TEMPLATE)
+    mapped = plan.map(RECORD)
+    assert mapped == {'ref': 'ABC1', 'f32a': '240131EUR1000,5', 'payer': '/ACME', 'info': 'NONE'}
+    assert plan.render(mapped) == ':20:ABC1\n:32A:240131EUR1000,5\n:50K:/ACME\n:70:NONE\n-}'
+    records = [RECORD, dict(RECORD, MsgId='x2', Dbtr='')]
+    assert plan.map_batch(records) == [plan.map(r) for r in records]
+
+
+def test_invalid_mapping_rules_map_nothing():
+    plan = get_conversion_plan(SimpleNamespace(id=2, rules='{bad'), template_entry())
+    assert plan.error.startswith('Error in mapping:')
+    assert plan.render(plan.map(RECORD)) == ':20:\n:32A:\n:50K:\n:70:\n-}'
+
+
+def test_plans_are_cached_until_the_rules_or_template_change():
+    plan = get_conversion_plan(converter(), template_entry())
+    assert get_conversion_plan(converter(), template_entry()) is plan
+    assert get_conversion_plan(converter(), template_entry(), value_transforms=False) is not plan
+    assert get_conversion_plan(converter(rules=dict(RULES, info={'default': 'X'})), template_entry()) is not plan
+    assert get_conversion_plan(converter(), template_entry(mtime_ns=2)) is not plan
+    invalidate_conversion_plans(converter_id=1)
+    assert get_conversion_plan(converter(), template_entry()) is not plan
+    plan = get_conversion_plan(converter(), template_entry())
+    invalidate_conversion_plans(template_path='MT103.txt.j2')
+    assert get_conversion_plan(converter(), template_entry()) is not plan
+
+
+def test_chunked_rendering_matches_render():
+    segments = SegmentTemplate('<A>@@a@@</A>' * 50 + '<B>@@b@@</B>@@missing@@')
+    values = {'a': 'x' * 30, 'b': 7}
+    text = segments.render(values)
+    assert text.endswith('<B>7</B>') and text.count('x' * 30) == 50
+    for size in (1, 16, 1000, 10 ** 6):
+        chunks = list(segments.iter_render(values, chunk_size=size))
+        assert ''.join(chunks) == text
+        assert all(len(chunk) >= size for chunk in chunks[:-1])
+    out = io.StringIO()
+    segments.write(values, out, chunk_size=64)
+    assert out.getvalue() == text
+
+
+def test_template_registry_indexes_templates_by_name_and_extension(tmp_path):
+    (tmp_path / 'MT103.txt.j2').write_text(':20:@@ref@@')
+    (tmp_path / 'pacs.008.xml.j2').write_text('<Document>@@id@@</Document>')
+    (tmp_path / 'pacs.008.txt.j2').write_text('@@id@@')
+    (tmp_path / 'notes.md').write_text('not a template')
+    registry = get_template_registry(str(tmp_path))
+    assert get_template_registry(str(tmp_path)) is registry
+    assert registry.find('pacs.008').ext == 'xml'
+    assert registry.get('pacs.008', 'txt').segments.content == '@@id@@'
+    assert registry.find('MT103').segments.variables == ['ref']
+    assert registry.find('notes') is None and registry.stat('notes.md')[0] == str(tmp_path / 'notes.md')
+
+
+def test_template_registry_picks_up_changes(tmp_path):
+    path = tmp_path / 'MT103.txt.j2'
+    path.write_text(':20:@@ref@@')
+    registry = TemplateRegistry(str(tmp_path), check_interval=3600)
+    entry = registry.find('MT103')
+    segments = entry.segments
+    path.write_text(':20:@@ref@@\n:23B:@@op@@')
+    (tmp_path / 'MT202.txt.j2').write_text(':20:@@ref@@')
+    # Within the check interval the listing is not re-read
+    assert registry.find('MT103') is entry and registry.find('MT202') is None
+    registry.refresh()
+    assert registry.find('MT103').segments.variables == ['ref', 'op']
+    unchanged = registry.find('MT202')
+    segments_202 = unchanged.segments
+    # An unchanged file keeps its entry and parsed template
+    registry.refresh()
+    assert registry.find('MT202') is unchanged and unchanged.segments is segments_202
+    path.unlink()
+    registry = TemplateRegistry(str(tmp_path), check_interval=0)
+    assert registry.find('MT103') is None
+    assert segments.variables == ['ref']
@@ -0,0 +1,32 @@
+from app.config.corpus import index_messages, load_message_index, read_message
+
+
+def test_mt_batch_is_split_per_message(read_resource):
+    mt = read_resource('mt103.txt', 'rb').strip()
+    # RJE-style '$' delimiter and plain blank lines between messages
+    batch = mt + b'\n$' + mt + b'\n\n' + mt + b'\n'
+    kind, entries = index_messages(batch)
+    assert kind == 'mt'
+    assert [batch[e.offset:e.offset + e.length] for e in entries] == [mt] * 3
+    assert {(e.type, e.ref, e.uetr) for e in entries} == {('MT103', 'GBS13084JVKPJE4G', '2ff70014-81e6-455e-bc2c-364dc0724026')}
+
+
+def test_mx_batch_is_split_per_message(read_resource):
+    pacs008 = read_resource('pacs008.xml', 'rb').strip()
+    pain001 = read_resource('pain001.xml', 'rb').strip()
+    batch = pacs008 + b'\n' + pain001 + b'\n' + pacs008
+    kind, entries = index_messages(batch)
+    assert kind == 'mx'
+    assert [batch[e.offset:e.offset + e.length] for e in entries] == [pacs008, pain001, pacs008]
+    assert [e.type for e in entries] == ['pacs.008.001.08', 'pain.001.001.09', 'pacs.008.001.08']
+
+
+def test_read_message_uses_the_sidecar_index(tmp_path, read_resource):
+    mt = read_resource('mt103.txt', 'rb').strip()
+    other = mt.replace(b':20:GBS13084JVKPJE4G', b':20:SECOND')
+    path = tmp_path / 'batch.txt'
+    path.write_bytes(mt + b'\n' + other + b'\n')
+    entries = load_message_index(str(path))
+    assert (tmp_path / 'batch.txt.idx.json').exists()
+    assert [e.ref for e in entries] == ['GBS13084JVKPJE4G', 'SECOND']
+    assert read_message(str(path), 1) == other
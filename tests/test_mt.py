@@ -0,0 +1,64 @@
+import io
+import json
+
+import pytest
+
+from app.config.mt import (STREAM_CHUNK_SIZE, decode_swift, extract_generic_text_fields, extract_mt_fields,
+                           iter_mt_fields, iter_mt_messages, parse_swift_tags, tokenize_mt)
+
+REPEATED_13C = '{4:\n:20:R1\n:13C:/A/1\n:13C:/B/2\n:21:X\n-}'
+
+
+def test_demand_driven_extraction_keeps_last_repeated_tag():
+    full = extract_generic_text_fields(REPEATED_13C)
+    wanted = extract_generic_text_fields(REPEATED_13C, fields={'tag13C'})
+    assert full['tag13C'] == '/B/2'
+    assert wanted == {k: v for k, v in full.items() if k.startswith('tag13C')}
+
+
+def test_demand_driven_extraction_matches_full_scan_on_every_field():
+    full = extract_generic_text_fields(REPEATED_13C)
+    for field in full:
+        assert extract_generic_text_fields(REPEATED_13C, fields={field})[field] == full[field]
+
+
+@pytest.mark.parametrize('newline', ['\r', '\r\n'])
+def test_cr_line_endings_extract_like_lf(read_resource, newline):
+    mt = read_resource('mt103.txt')
+    converted = mt.replace('\n', newline)
+    assert extract_generic_text_fields(converted) == extract_generic_text_fields(mt)
+    assert parse_swift_tags(converted) == parse_swift_tags(mt)
+    assert extract_generic_text_fields(decode_swift(converted.encode('utf-8'))) == extract_generic_text_fields(mt)
+
+
+def test_nested_header_blocks(read_resource):
+    index = tokenize_mt(read_resource('mt103.txt'))
+    blocks = index.block_dict()
+    assert blocks['3'] == '{108:EUO6AA55FUYQ}{111:001}{121:2ff70014-81e6-455e-bc2c-364dc0724026}'
+    assert blocks['1'] == 'F01MIDLGB22AXXX0001000001'
+
+
+STREAM_RULES = json.dumps({'ref': '20', 'b4': {'block': 4}, 'b3': {'block': 3},
+                           'acct': {'path': '50K', 'multiple': True}, 'r': {'path': 'regex::32A:(\\d{6})'}})
+
+
+def mt_batch(read_resource, newline):
+    mt = read_resource('mt103.txt').strip()
+    messages = [mt.replace(':20:GBS13084JVKPJE4G', f':20:REF{n}') for n in range(5)]
+    return messages, ('\n$'.join(messages) + '\n').replace('\n', newline)
+
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n', '\r'])
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 64, 1000, STREAM_CHUNK_SIZE])
+def test_chunk_boundaries_do_not_change_streamed_results(read_resource, newline, chunk_size):
+    messages, batch = mt_batch(read_resource, newline)
+    expected = [extract_mt_fields(m.replace('\n', newline), STREAM_RULES) for m in messages]
+    assert list(iter_mt_fields(io.BytesIO(batch.encode('utf-8')), STREAM_RULES, chunk_size=chunk_size)) == expected
+    assert list(iter_mt_fields(io.StringIO(batch), STREAM_RULES, chunk_size=chunk_size)) == expected
+
+
+def test_streamed_messages_split_like_the_corpus_index(read_resource):
+    messages, batch = mt_batch(read_resource, '\n')
+    streamed = [index.content[index.start:index.end] for index in iter_mt_messages(io.StringIO(batch), chunk_size=100)]
+    assert streamed == messages
+    assert list(iter_mt_fields(io.StringIO(batch), '{bad')) == []
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from app.config.conversion import get_template_registry
+from app.config.mt_format import compile_format, formats_path, get_mt_format_validator, validate_mt_output
+
+MT103 = (
+    '{1:F01BANKBEBBAXXX0000000000}{2:I103BANKDEFFXXXXN}{4:\n'
+    ':20:REF123\n'
+    ':23B:CRED\n'
+    ':32A:240101EUR1000,50\n'
+    ':50K:/12345\nJOHN DOE\n'
+    ':59:/67890\nJANE ROE\n'
+    ':71A:SHA\n'
+    '-}'
+)
+
+
+@pytest.mark.parametrize('spec, value, ok', [
+    ('16x', 'REF123', True),
+    ('16x', 'R' * 17, False),
+    ('4!c', 'CRED', True),
+    ('4!c', 'CRE', False),
+    ('6!n3!a15d', '240101EUR1000,50', True),
+    ('6!n3!a15d', '240101EUR1000.50', False),
+    ('[/34x CrLf]4*35x', '/12345\nJOHN DOE', True),
+    ('[/34x CrLf]4*35x', 'A\nB\nC\nD\nE', False),
+])
+def test_compiled_formats(spec, value, ok):
+    assert bool(compile_format(spec).fullmatch(value)) is ok
+
+
+def test_unreadable_format_raises():
+    with pytest.raises(ValueError):
+        compile_format('[16x')
+
+
+def test_builtin_formats_check_generated_messages(tmp_path):
+    assert validate_mt_output(MT103, str(tmp_path), 'MT103')['status'] == 'valid'
+    result = validate_mt_output(MT103.replace(':23B:CRED', ':23B:CREDIT'), str(tmp_path), 'MT103')
+    assert result['status'] == 'invalid' and result['errors'] == [":23B: 'CREDIT' does not match 4!c"]
+    assert validate_mt_output(MT103, str(tmp_path), 'MT999')['status'] == 'unchecked'
+
+
+def test_override_file_is_found_through_the_shared_registry(tmp_path):
+    builtin = get_mt_format_validator(str(tmp_path), 'MT103')
+    with open(formats_path(str(tmp_path), 'MT103'), 'w', encoding='utf-8') as f:
+        json.dump({'20': '3!c'}, f)
+    # The directory listing is only re-read after the check interval or refresh()
+    assert get_mt_format_validator(str(tmp_path), 'MT103') is builtin
+    get_template_registry(str(tmp_path)).refresh()
+    validator = get_mt_format_validator(str(tmp_path), 'MT103')
+    assert validator.formats == {'20': '3!c'}
+    assert get_mt_format_validator(str(tmp_path), 'MT103') is validator
+    assert validate_mt_output(MT103, str(tmp_path), 'MT103')['errors'] == [":20: 'REF123' does not match 3!c"]
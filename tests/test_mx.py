@@ -0,0 +1,203 @@
+import json
+import logging
+import mmap
+import time
+
+import pytest
+from lxml import etree
+
+from app.config.mx import (discover_headers, extract_xml_fields, extract_xml_fields_batch, extract_xml_rows,
+                           extract_xml_with_xpaths, extract_xml_with_xpaths_batch, get_xpath_table, iter_xml_records,
+                           iter_xml_row_batches, map_ordered, parse_fragments)
+from app.config.profiling import PARSE_STEP, RuleProfile
+
+
+def bulk_pacs008(read_resource, refs):
+    """pacs008.xml with its CdtTrfTxInf repeated once per EndToEndId in refs."""
+    doc = read_resource('pacs008.xml')
+    start = doc.index('<CdtTrfTxInf>')
+    end = doc.index('</CdtTrfTxInf>') + len('</CdtTrfTxInf>')
+    tx = doc[start:end]
+    txs = ''.join(tx.replace('23BYPASSGM73', ref) for ref in refs)
+    return doc[:start] + txs + doc[end:]
+
+
+def test_profiled_xpath_extraction_times_each_rule(read_resource):
+    rules = read_resource('rules_pacs008.txt')
+    doc = read_resource('pacs008.xml', 'rb')
+    profile = RuleProfile()
+    profiled = extract_xml_with_xpaths(doc, rules, profile=profile)
+    assert profiled == extract_xml_with_xpaths(doc, rules)
+    assert set(profile.stats) == set(profiled) | {PARSE_STEP}
+
+
+@pytest.mark.parametrize('xpath, expected', [
+    ('/Root/Document/FIToFICstmrCdtTrf/GrpHdr/MsgId', 'GBS13084JVKPJE4G'),
+    ('/Root/def:Document/def:FIToFICstmrCdtTrf/def:GrpHdr/def:MsgId', 'GBS13084JVKPJE4G'),
+    ('/Root/AppHdr/Fr/FIId/FinInstnId/BICFI', 'MIDLGB22XXX'),
+    ('/Root/app:AppHdr/app:Fr/app:FIId/app:FinInstnId/app:BICFI', 'MIDLGB22XXX'),
+    ('//MsgId', 'GBS13084JVKPJE4G'),
+    ('//def:MsgId', 'GBS13084JVKPJE4G'),
+    ('/Root/Document/FIToFICstmrCdtTrf/CdtTrfTxInf[1]/PmtId/EndToEndId', '23BYPASSGM73'),
+    ('/Root/Document/FIToFICstmrCdtTrf/CdtTrfTxInf/IntrBkSttlmAmt/@Ccy', 'USD'),
+    ('/Root/Document/Nope', ''),
+])
+def test_namespaced_and_prefixless_xpaths(read_resource, xpath, expected):
+    doc = read_resource('pacs008.xml', 'rb')
+    rules = json.dumps({'value': xpath})
+    assert extract_xml_with_xpaths(doc, rules) == {'value': expected}
+    assert extract_xml_with_xpaths(doc, rules, fields={'value'}) == {'value': expected}
+
+
+def test_demand_driven_xpath_extraction_matches_full(read_resource):
+    rules = read_resource('rules_pacs008.txt')
+    doc = read_resource('pacs008.xml', 'rb')
+    full = extract_xml_with_xpaths(doc, rules)
+    wanted = {'MsgId', 'UETR'}
+    assert extract_xml_with_xpaths(doc, rules, fields=wanted) == {k: full[k] for k in wanted}
+
+
+def test_every_source_type_extracts_the_same(read_resource, tmp_path):
+    rules = read_resource('rules_pacs008.txt')
+    doc = read_resource('pacs008.xml', 'rb')
+    expected = extract_xml_with_xpaths(doc, rules)
+    path = tmp_path / 'pacs008.xml'
+    path.write_bytes(doc)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        assert extract_xml_with_xpaths(mm, rules) == expected
+    with open(path, 'rb') as f:
+        assert extract_xml_with_xpaths(f, rules) == expected
+    assert extract_xml_with_xpaths(bytearray(doc), rules) == expected
+    assert extract_xml_with_xpaths(memoryview(doc), rules) == expected
+    assert extract_xml_with_xpaths(doc.decode('utf-8'), rules) == expected
+
+
+def test_declared_encoding_is_honoured(read_resource):
+    doc = read_resource('pacs008.xml').replace('encoding="UTF-8"', 'encoding="ISO-8859-1"')
+    doc = doc.replace('<MsgId>GBS13084JVKPJE4G', '<MsgId>GBS13084JVKPJE4Gé')
+    rules = json.dumps({'m': '//MsgId'})
+    assert extract_xml_with_xpaths(doc.encode('latin-1'), rules) == {'m': 'GBS13084JVKPJE4Gé'}
+
+
+@pytest.mark.parametrize('encoding', ['bogus', 'ebcdic-cp-ch'])
+def test_unknown_declared_encoding_falls_back_to_utf8(read_resource, encoding):
+    rules = read_resource('rules_pacs008.txt')
+    doc = read_resource('pacs008.xml', 'rb')
+    declared = doc.replace(b'encoding="UTF-8"', f'encoding="{encoding}"'.encode('ascii'))
+    assert extract_xml_with_xpaths(declared, rules) == extract_xml_with_xpaths(doc, rules)
+    assert extract_xml_fields(declared, json.dumps({'m': '//def:MsgId'})) == {'m': 'GBS13084JVKPJE4G'}
+
+
+def test_xpath_table_is_shared_per_rules_and_namespaces(read_resource):
+    rules = json.dumps({'m': '//def:MsgId', 'bic': '//app:BICFI'})
+    nsmap = {'app': 'urn:iso:std:iso:20022:tech:xsd:head.001.001.02',
+             'def': 'urn:iso:std:iso:20022:tech:xsd:pacs.008.001.08'}
+    table = get_xpath_table(rules, nsmap)
+    assert get_xpath_table(rules, dict(nsmap)) is table
+    assert get_xpath_table(rules, {'def': nsmap['def']}) is not table
+    assert get_xpath_table(json.dumps({'m': '//def:MsgId'}), nsmap) is not table
+    doc = read_resource('pacs008.xml', 'rb')
+    assert extract_xml_fields(doc, rules) == {'m': 'GBS13084JVKPJE4G', 'bic': 'MIDLGB22XXX'}
+    compiled = dict(table)
+    assert set(compiled) == {'//def:MsgId', '//app:BICFI'}
+    # A second message reuses the compiled expressions
+    assert extract_xml_fields(doc, rules) == {'m': 'GBS13084JVKPJE4G', 'bic': 'MIDLGB22XXX'}
+    assert all(table[expr] is xpath for expr, xpath in compiled.items())
+
+
+def test_header_discovery(read_resource):
+    apphdr, doc, nsmap = discover_headers(parse_fragments(read_resource('pacs008.xml', 'rb')))
+    assert etree.QName(apphdr).localname == 'AppHdr'
+    assert etree.QName(doc).localname == 'Document'
+    assert nsmap == {'app': 'urn:iso:std:iso:20022:tech:xsd:head.001.001.02',
+                     'def': 'urn:iso:std:iso:20022:tech:xsd:pacs.008.001.08'}
+    # Without a namespace the only candidate is still returned
+    apphdr, doc, nsmap = discover_headers(parse_fragments(b'<Document><A>1</A></Document>'))
+    assert apphdr is None and doc.tag == 'Document' and nsmap == {}
+
+
+def test_extraction_logs_elements_only_at_debug_level(read_resource, caplog):
+    doc = read_resource('pacs008.xml', 'rb')
+    rules = json.dumps({'m': '//def:MsgId'})
+    with caplog.at_level(logging.INFO):
+        assert extract_xml_fields(doc, rules) == {'m': 'GBS13084JVKPJE4G'}
+    assert not caplog.records
+    with caplog.at_level(logging.DEBUG):
+        assert extract_xml_fields(doc, rules) == {'m': 'GBS13084JVKPJE4G'}
+    assert any(r.getMessage().startswith('ELEMENT tag:') for r in caplog.records)
+
+
+def test_streamed_records_match_per_transaction_extraction(read_resource):
+    rules = read_resource('rules_pacs008.txt')
+    refs = ['E2E-1', 'E2E-2', 'E2E-3']
+    records = list(iter_xml_records(bulk_pacs008(read_resource, refs).encode('utf-8'), rules))
+    assert records == [extract_xml_with_xpaths(bulk_pacs008(read_resource, [ref]), rules) for ref in refs]
+    wanted = {'MsgId', 'EndToEndId'}
+    assert list(iter_xml_records(bulk_pacs008(read_resource, refs), rules, fields=wanted)) == [
+        {'MsgId': 'GBS13084JVKPJE4G', 'EndToEndId': ref} for ref in refs]
+
+
+def test_streamed_pain001_records_see_their_payment_information(read_resource):
+    rules = json.dumps({'MsgId': '/Root/Document/CstmrCdtTrfInitn/GrpHdr/MsgId',
+                        'Dbtr': '/Root/Document/CstmrCdtTrfInitn/PmtInf/Dbtr/Nm',
+                        'E2E': '/Root/Document/CstmrCdtTrfInitn/PmtInf/CdtTrfTxInf/PmtId/EndToEndId'})
+    doc = read_resource('pain001.xml', 'rb')
+    assert list(iter_xml_records(doc, rules)) == [extract_xml_with_xpaths(doc, rules)]
+    assert list(iter_xml_records(doc, rules, record_tag='PmtInf')) == [extract_xml_with_xpaths(doc, rules)]
+
+
+ROW_RULES = json.dumps({
+    'msgid': '/def:Document/def:FIToFICstmrCdtTrf/def:GrpHdr/def:MsgId',
+    'txs': {'path': '/def:Document/def:FIToFICstmrCdtTrf/def:CdtTrfTxInf', 'multiple': True,
+            'fields': {'e2e': './def:PmtId/def:EndToEndId', 'ccy': './def:IntrBkSttlmAmt/@Ccy'}},
+})
+
+
+def test_rows_broadcast_the_header_onto_each_transaction(read_resource):
+    batch = extract_xml_rows(bulk_pacs008(read_resource, ['E2E-1', 'E2E-2']), ROW_RULES)
+    assert batch.columns == ('msgid', 'e2e', 'ccy')
+    assert batch.rows == [('GBS13084JVKPJE4G', 'E2E-1', 'USD'), ('GBS13084JVKPJE4G', 'E2E-2', 'USD')]
+    assert batch.column('e2e') == ['E2E-1', 'E2E-2']
+    assert batch.to_columns()['msgid'] == ['GBS13084JVKPJE4G'] * 2
+    # The same values as the nested extraction
+    nested = extract_xml_fields(bulk_pacs008(read_resource, ['E2E-1', 'E2E-2']), ROW_RULES)
+    assert [(nested['msgid'], tx['e2e'], tx['ccy']) for tx in nested['txs']] == batch.rows
+    assert extract_xml_rows(read_resource('pacs008.xml'), '{bad') is None
+
+
+def test_row_batches_keep_source_order(read_resource):
+    sources = [bulk_pacs008(read_resource, [f'{i}-{j}' for j in range(i % 3 + 1)]) for i in range(12)]
+    expected = [row for source in sources for row in extract_xml_rows(source, ROW_RULES).rows]
+    batches = list(iter_xml_row_batches(sources, ROW_RULES, batch_size=4, workers=4))
+    assert all(len(batch) >= 4 for batch in batches[:-1])
+    assert [row for batch in batches for row in batch.rows] == expected
+
+
+def test_map_ordered_keeps_input_order_and_bounds_work_in_flight():
+    started = []
+
+    def items():
+        for i in range(20):
+            started.append(i)
+            yield i
+
+    def slow(i):
+        # Later items finish first
+        time.sleep((20 - i) * 0.001)
+        return i * i
+
+    results = map_ordered(slow, items(), workers=3)
+    assert next(results) == 0
+    assert len(started) <= 2 * 3 + 1
+    assert list(results) == [i * i for i in range(1, 20)]
+    assert list(map_ordered(slow, range(5), workers=1)) == [0, 1, 4, 9, 16]
+
+
+def test_batch_extraction_matches_one_by_one(read_resource):
+    rules = read_resource('rules_pacs008.txt')
+    config_rules = json.dumps({'e2e': '//def:EndToEndId'})
+    sources = [bulk_pacs008(read_resource, [f'E2E-{i}']).encode('utf-8') for i in range(10)]
+    assert extract_xml_with_xpaths_batch(sources, rules, workers=4) == [
+        extract_xml_with_xpaths(source, rules) for source in sources]
+    assert extract_xml_fields_batch(sources, config_rules, workers=4) == [{'e2e': f'E2E-{i}'} for i in range(10)]
+    assert extract_xml_fields_batch(sources[:2], '{bad', workers=4) == [None, None]
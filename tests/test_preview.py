@@ -0,0 +1,65 @@
+import json
+
+import pytest
+from flask import Flask
+
+from app.config import preview
+from app.config.mt import extract_mt_fields
+from app.config.mx import extract_xml_fields, extract_xml_with_xpaths
+from app.config.preview import cached_sample, load_sample, preview_rules
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    preview._samples.clear()
+    yield app
+    preview._samples.clear()
+
+
+def test_preview_reevaluates_only_changed_rules(app, read_resource):
+    mt = read_resource('mt103.txt', 'rb')
+    rules = {'ref': '20', 'amount': '32A', 'ccy': {'path': 'regex::32A:\\d{6}([A-Z]{3})'}}
+    with app.test_request_context():
+        sample = load_sample(mt, 'mt')
+        result, evaluated = preview_rules(sample, json.dumps(rules), 'mt')
+        assert result == extract_mt_fields(mt, json.dumps(rules)) and sorted(evaluated) == sorted(rules)
+        rules['amount'] = '33B'
+        rules['party'] = '50K'
+        result, evaluated = preview_rules(cached_sample(sample.key, 'mt'), json.dumps(rules), 'mt')
+        assert result == extract_mt_fields(mt, json.dumps(rules)) and sorted(evaluated) == ['amount', 'party']
+        assert preview_rules(sample, json.dumps(rules), 'mt')[1] == []
+        with pytest.raises(ValueError):
+            preview_rules(sample, '[]', 'mt')
+
+
+def test_xml_previews_match_the_extractors(app, read_resource):
+    doc = read_resource('pacs008.xml', 'rb')
+    mapping = read_resource('rules_pacs008.txt')
+    config_rules = json.dumps({'m': '//def:MsgId', 'bic': '//app:BICFI'})
+    with app.test_request_context():
+        sample = load_sample(doc, 'xml')
+        assert preview_rules(sample, mapping, 'xpath')[0] == extract_xml_with_xpaths(doc, mapping)
+        assert preview_rules(sample, config_rules, 'xml')[0] == extract_xml_fields(doc, config_rules)
+        assert preview_rules(load_sample(b'<Document><A>', 'xml'), config_rules, 'xml')[0] is not None
+
+
+def test_sample_cache_is_bounded_per_session_and_by_bytes(app, monkeypatch):
+    with app.test_request_context():
+        samples = [load_sample(f':20:REF{i}\n'.encode('ascii'), 'mt') for i in range(preview.PREVIEW_SAMPLES + 1)]
+        assert cached_sample(samples[0].key, 'mt') is None
+        assert all(cached_sample(s.key, 'mt') is s for s in samples[1:])
+        assert load_sample(b':20:REF1\n', 'mt') is samples[1]
+    with app.test_request_context():
+        # Another session does not see the samples of the first
+        assert cached_sample(samples[1].key, 'mt') is None
+    monkeypatch.setattr(preview._samples, 'maxbytes', 100)
+    with app.test_request_context():
+        big = load_sample(b':20:' + b'X' * 60 + b'\n', 'mt')
+        assert cached_sample(big.key, 'mt') is big
+        other = load_sample(b':20:' + b'Y' * 60 + b'\n', 'mt')
+        assert cached_sample(big.key, 'mt') is None and cached_sample(other.key, 'mt') is other
+        huge = load_sample(b':20:' + b'Z' * 200 + b'\n', 'mt')
+        assert huge.content.startswith(':20:ZZZ') and cached_sample(huge.key, 'mt') is None
+        assert preview._samples.nbytes <= 100
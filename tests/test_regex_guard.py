@@ -0,0 +1,87 @@
+import json
+import sys
+import threading
+import time
+
+import pytest
+
+from app.config import regex_guard
+from app.config.mt import extract_mt_fields
+from app.config.regex_guard import GuardedPattern, RegexTimeout, analyze_pattern, check_rule_patterns
+
+SLOW = r'^(.*?,){12}P'
+SLOW_TEXT = '1,' * 30
+
+
+@pytest.fixture
+def short_budget(monkeypatch):
+    monkeypatch.setattr(regex_guard, 'REGEX_TIME_BUDGET', 0.3)
+
+
+def test_guarded_pattern_matches():
+    assert GuardedPattern(r':20:(\w+)').first(':20:REF1 :20:REF2') == 'REF1'
+    assert GuardedPattern(r':20:(\w+)').all(':20:REF1 :20:REF2') == ['REF1', 'REF2']
+    assert GuardedPattern(r'^CR').test('CRED') is True
+    assert GuardedPattern(r'x').first('abc') is None
+    with pytest.raises(Exception):
+        GuardedPattern('(')
+
+
+def test_slow_pattern_times_out(short_budget):
+    start = time.perf_counter()
+    with pytest.raises(RegexTimeout):
+        GuardedPattern(SLOW).first(SLOW_TEXT)
+    assert time.perf_counter() - start < 5
+    # The killed worker is replaced on the next call
+    assert GuardedPattern(r'(\d+)').first('a 12') == '12'
+
+
+def test_timed_out_rule_fails_only_its_field(short_budget, read_resource):
+    rules = json.dumps({'ref': '20', 'slow': {'path': 'regex:' + SLOW}})
+    assert extract_mt_fields(read_resource('mt103.txt') + SLOW_TEXT, rules) == {'ref': 'GBS13084JVKPJE4G', 'slow': None}
+
+
+def test_worker_pool_is_capped():
+    pattern = GuardedPattern(r'(\d+)')
+    results = []
+
+    def run():
+        for _ in range(4):
+            results.append(pattern.first('abc 123'))
+
+    threads = [threading.Thread(target=run) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ['123'] * 64
+    assert len(regex_guard._idle_workers) <= regex_guard.REGEX_MAX_WORKERS
+    workers = list(regex_guard._idle_workers)
+    regex_guard.shutdown_workers()
+    assert regex_guard._idle_workers == []
+    assert all(w.process.poll() is not None for w in workers)
+
+
+def test_workers_start_with_the_configured_interpreter(monkeypatch):
+    regex_guard.shutdown_workers()
+    monkeypatch.setattr(regex_guard, '_python', None)
+    regex_guard.configure_workers(python=sys.executable)
+    try:
+        assert GuardedPattern('a').test('a')
+        assert regex_guard._idle_workers[0].process.args[0] == sys.executable
+    finally:
+        regex_guard.configure_workers()
+        regex_guard.shutdown_workers()
+
+
+def test_pattern_analysis():
+    assert [s for s, _ in analyze_pattern('(a+)+')] == ['error']
+    assert [s for s, _ in analyze_pattern('(a|ab)*')] == ['warning']
+    assert [s for s, _ in analyze_pattern(SLOW)] == ['warning']
+    assert analyze_pattern(r':20:(\w+)') == []
+    assert analyze_pattern('(')[0][0] == 'error'
+    errors, warnings = check_rule_patterns(json.dumps({
+        'a': 'regex:(a+)+', 'b': {'path': '20', 'condition': 'regex', 'value': '(x|xy)*'},
+        'c': {'path': 'x', 'fields': {'d': 'regex:(\\d+)'}}}))
+    assert errors == ["Rule 'a': nested quantifier (e.g. (a+)+) can backtrack catastrophically."]
+    assert warnings == ["Rule 'b': alternation inside a quantified group (e.g. (a|ab)*) may backtrack heavily."]
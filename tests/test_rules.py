@@ -0,0 +1,44 @@
+import json
+
+from app.config.mt import extract_mt_fields, get_mt_rule_plan
+from app.config.rules import LRUCache, compile_condition, rules_hash
+
+RULES = json.dumps({'ref': '20', 'op': {'path': '23B', 'condition': 'equals', 'value': 'CRED'},
+                    'acct': {'path': '50K', 'multiple': True, 'postprocess': 'account_lines'}})
+
+
+def test_rule_plan_is_compiled_once_per_rules_string():
+    plan = get_mt_rule_plan(RULES)
+    assert plan is get_mt_rule_plan(RULES)
+    assert plan is not get_mt_rule_plan(RULES.replace('23B', '23E'))
+    assert get_mt_rule_plan('{bad') is None
+    assert rules_hash(RULES) == rules_hash(RULES.encode('utf-8'))
+
+
+def test_cached_plan_extracts_like_a_fresh_one(read_resource):
+    mt = read_resource('mt103.txt')
+    first = extract_mt_fields(mt, RULES)
+    assert first['ref'] == 'GBS13084JVKPJE4G' and first['op'] == 'CRED'
+    assert extract_mt_fields(mt, RULES) == first
+
+
+def test_conditions():
+    assert compile_condition('', 'x') is None
+    assert compile_condition('contains', 'RE')('CRED') == 'CRED'
+    assert compile_condition('equals', 'CRED')('SPAY') is None
+    assert compile_condition('not_equals', 'CRED')('SPAY') == 'SPAY'
+    assert compile_condition('starts_with', 'CR')('CRED') == 'CRED'
+    assert compile_condition('ends_with', 'X')('CRED') is None
+    assert compile_condition('regex', r'^C\w+D$')('CRED') == 'CRED'
+    assert compile_condition('unknown', 'x')('CRED') == 'CRED'
+    assert compile_condition('equals', 'x')(None) is None
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert 'b' not in cache and cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.get_or_build('d', lambda: 4) == 4 and len(cache) == 2
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import pytest
+
+from app.config.transforms import (DATE_INPUT_FORMATS, TRANSFORM_DATE_FORMATS, DateParser, Transform,
+                                   get_transform, iso_amount, swift_amount)
+
+DATES = ['2024-01-05', '2024-1-5', '20240105', '05-01-2024', '5-1-2024', '2024/1/15', '2024131', '2024115',
+         '240105', '991231', '2024-13-01', '2024-02-30', '2024-01-05T10:20', 'not a date', '']
+
+
+def strptime_any(value, formats):
+    for fmt in formats:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return None
+
+
+@pytest.mark.parametrize('formats', [DATE_INPUT_FORMATS, TRANSFORM_DATE_FORMATS])
+@pytest.mark.parametrize('value', DATES)
+def test_date_parser_matches_strptime(formats, value):
+    assert DateParser(formats).parse(value) == strptime_any(value, formats)
+
+
+def test_date_parser_keeps_working_after_switching_formats():
+    parser = DateParser()
+    assert parser.parse('20240105') == datetime(2024, 1, 5)
+    assert parser.parse('2024-1-6') == datetime(2024, 1, 6)
+    assert parser.parse('7-1-2024') == datetime(2024, 1, 7)
+
+
+def test_date_parser_ignores_iso_time_when_allowed():
+    assert DateParser(allow_time=True).parse('2024-01-05T10:20:30.5+01:00') == datetime(2024, 1, 5)
+    assert DateParser().parse('2024-01-05T10:20:30') is None
+
+
+@pytest.mark.parametrize('value, swift, iso', [
+    ('1,234.50', '1234,50', '1234.50'),
+    ('325', '325,', '325'),
+    ('325,', '325,', '325'),
+    ('0012,5', '12,5', '12.5'),
+    ('n/a', 'n/a', 'n/a'),
+])
+def test_amounts(value, swift, iso):
+    assert swift_amount(value) == swift
+    assert iso_amount(swift) == iso
+
+
+def test_registered_transforms():
+    assert get_transform('mt103_32A')(['2024-1-5', 'usd', '325']) == '240105USD325,'
+    assert get_transform('mt103_33B')(['EUR', '10.5']) == 'EUR10,5'
+    assert get_transform('iso_date').batch([['240105'], ['2024-01-06T08:00:00Z'], ['bad']]) == ['2024-01-05', '2024-01-06', 'bad']
+    assert get_transform('swift_amount').batch([['1', '000.5']]) == ['1000,5']
+    assert get_transform('unknown') is None
+
+
+def test_transform_requires_call():
+    with pytest.raises(TypeError):
+        Transform()
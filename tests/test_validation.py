@@ -0,0 +1,43 @@
+import json
+
+import pytest
+from jsonschema.exceptions import SchemaError
+
+from app.config.validation import get_schema_validator, invalidate_schema_validators, validate_records
+
+SCHEMA = json.dumps({
+    'type': 'object',
+    'required': ['ref', 'amount'],
+    'properties': {'ref': {'type': 'string'}, 'amount': {'type': 'string', 'pattern': '^[0-9,]+$'}},
+})
+
+
+def test_validator_is_built_once_per_schema_and_owner():
+    validator = get_schema_validator(SCHEMA, ('config', 1))
+    assert get_schema_validator(SCHEMA, ('config', 1)) is validator
+    assert get_schema_validator(SCHEMA, ('config', 2)) is not validator
+    invalidate_schema_validators(('config', 1))
+    assert get_schema_validator(SCHEMA, ('config', 1)) is not validator
+
+
+def test_invalid_schemas_raise():
+    with pytest.raises(ValueError):
+        get_schema_validator('{bad')
+    with pytest.raises(SchemaError):
+        get_schema_validator(json.dumps({'type': 'nope'}))
+
+
+def test_batch_validation_reports_each_record():
+    records = [
+        {'ref': 'A1', 'amount': '100,50'},
+        {'ref': '', 'amount': '100,50'},
+        {'amount': 'x'},
+    ]
+    assert validate_records(records, SCHEMA) == [
+        [],
+        ['Required field(s) missing or empty: ref'],
+        ['Required field(s) missing or empty: ref', "amount: 'x' does not match '^[0-9,]+$'"],
+    ]
+    validator = get_schema_validator(SCHEMA)
+    assert validator.first_error(records[0]) is None
+    assert validator.first_error(records[2]).message == "'ref' is a required property"
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from app.config.conversion import get_template_registry
+from app.config.xsd import XMLOutputCheck, xsd_filename, xsd_paths, validate_xml_output
+
+NS = 'urn:test:pay.001'
+
+XSD = f'''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="{NS}"
+    xmlns="{NS}" elementFormDefault="qualified">
+  <xs:element name="Document">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="MsgId" type="xs:string"/>
+        <xs:element name="Amt" type="xs:decimal"/>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>
+'''
+
+
+def write_xsd(schema_dir, name='pay.001'):
+    path = os.path.join(schema_dir, xsd_filename(name, 'pay.001.001.01'))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(XSD)
+    get_template_registry(str(schema_dir)).refresh()
+    return path
+
+
+def document(amount):
+    return f'<?xml version="1.0"?><Document xmlns="{NS}"><MsgId>M1</MsgId><Amt>{amount}</Amt></Document>'
+
+
+def test_outputs_are_validated_against_the_uploaded_xsd(tmp_path):
+    write_xsd(tmp_path)
+    assert validate_xml_output(document('10.5'), str(tmp_path), 'pay.001') == {
+        'status': 'valid', 'errors': [], 'checked': ['Document']}
+    result = validate_xml_output(document('ten'), str(tmp_path), 'pay.001')
+    assert result['status'] == 'invalid' and result['checked'] == ['Document']
+    assert 'Amt' in result['errors'][0] and result['errors'][0].startswith('Document: line ')
+    assert validate_xml_output(document('10.5')[:-5], str(tmp_path), 'pay.001')['status'] == 'malformed'
+    # No XSD for the namespace or the file type
+    other = '<Document xmlns="urn:other"><X/></Document>'
+    assert validate_xml_output(other, str(tmp_path), 'pay.001')['status'] == 'unchecked'
+    assert validate_xml_output(document('ten'), str(tmp_path), 'pacs.008')['status'] == 'unchecked'
+
+
+def test_xsd_files_are_listed_from_the_shared_registry(tmp_path):
+    assert validate_xml_output(document('ten'), str(tmp_path), 'pay.001')['status'] == 'unchecked'
+    path = write_xsd(tmp_path)
+    assert xsd_paths(str(tmp_path), 'pay.001') == [path]
+    os.remove(path)
+    # Not re-listed until the check interval passes or refresh() is called
+    assert xsd_paths(str(tmp_path), 'pay.001') == [path]
+    get_template_registry(str(tmp_path)).refresh()
+    assert xsd_paths(str(tmp_path), 'pay.001') == []
+
+
+def test_broken_xsd_reports_invalid(tmp_path):
+    path = write_xsd(tmp_path)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"><xs:element/></xs:schema>')
+    get_template_registry(str(tmp_path)).refresh()
+    result = validate_xml_output(document('10.5'), str(tmp_path), 'pay.001')
+    assert result['status'] == 'invalid' and result['errors'][0].startswith(os.path.basename(path))
+
+
+@pytest.mark.parametrize('amount', ['10.5', 'ten'])
+def test_chunked_check_matches_the_whole_output(tmp_path, amount):
+    write_xsd(tmp_path)
+    output = '\n  ' + document(amount)
+    for size in (1, 7, len(output)):
+        check = XMLOutputCheck(str(tmp_path), 'pay.001')
+        for i in range(0, len(output), size):
+            check.feed(output[i:i + size] if size > 1 else output[i].encode('utf-8'))
+        assert check.result() == validate_xml_output(output, str(tmp_path), 'pay.001')
+    check = XMLOutputCheck(str(tmp_path), 'pay.001')
+    check.feed('<Document xmlns="urn:test:pay.001"><MsgId>')
+    check.feed('M1</Amt></Document>')
+    assert check.result()['status'] == 'malformed'